@@ -0,0 +1,186 @@
+"""Analog paddle channel: KeyGroup values turned into joystick axes or threshold keys
+
+The controller decodes every KeyGroup of a frame into its analog slots first and then
+calls update() once, so only the latest value per location and frame is used. Values go
+through a response table built once from the deadzone and curve, and only positions
+that changed are emitted.
+
+update() runs on the notification path and doesn't allocate: the table holds every
+possible output as a ready-made int, and axis positions are handed to the injection
+thread through one pre-bound method instead of a new message per frame.
+"""
+from typing import Dict, List, Sequence, Tuple
+
+from key_output import EV_ABS, EV_KEY, INPUT_EVENT, UinputDevice
+
+# Largest paddle value reported by the Ride, in either direction
+ANALOG_MAX = 100
+
+# Axis range of the virtual joystick
+AXIS_MAX = 32767
+
+DEFAULT_DEADZONE = 0.1
+DEFAULT_CURVE = 1.0
+
+# Share of the full travel where a threshold key is pressed, and where it is released again
+PRESS_AT = 0.5
+RELEASE_AT = 0.35
+
+# Linux input event codes (linux/input-event-codes.h)
+ABS_X = 0x00
+ABS_Y = 0x01
+# A gamepad button, so the device is classified as a joystick
+BTN_SOUTH = 0x130
+
+
+def response_table(deadzone: float = DEFAULT_DEADZONE, curve: float = DEFAULT_CURVE,
+                   scale: int = AXIS_MAX) -> Tuple[int, ...]:
+    """Output for every raw value from -ANALOG_MAX to ANALOG_MAX, at index raw + ANALOG_MAX
+
+    Values within deadzone (a share of the full travel) map to 0, the rest is rescaled to
+    0..1, raised to the power of curve (above 1 gives finer control near the center) and
+    scaled to +-scale.
+    """
+    if not 0 <= deadzone < 1:
+        raise ValueError(f"Deadzone must be in [0, 1), got {deadzone}")
+    if curve <= 0:
+        raise ValueError(f"Curve must be positive, got {curve}")
+    table = []
+    for raw in range(-ANALOG_MAX, ANALOG_MAX + 1):
+        travel = (abs(raw) / ANALOG_MAX - deadzone) / (1 - deadzone)
+        output = round(max(travel, 0.0) ** curve * scale)
+        table.append(output if raw >= 0 else -output)
+    return tuple(table)
+
+
+class AnalogChannel:
+    """Latest position of each paddle location, emitted when it changes"""
+
+    def __init__(self, locations: Sequence[int], deadzone: float = DEFAULT_DEADZONE, curve: float = DEFAULT_CURVE):
+        self.locations = tuple(locations)
+        self.table = response_table(deadzone, curve)
+        self.positions: List[int] = [0] * len(self.locations)
+
+    def update(self, slots: Sequence[int]) -> None:
+        """Map the values of one frame and emit the positions that changed"""
+        table = self.table
+        positions = self.positions
+        changed = False
+        index = 0
+        for location in self.locations:
+            raw = slots[location]
+            if raw > ANALOG_MAX:
+                raw = ANALOG_MAX
+            elif raw < -ANALOG_MAX:
+                raw = -ANALOG_MAX
+            position = table[raw + ANALOG_MAX]
+            if position != positions[index]:
+                positions[index] = position
+                changed = True
+            index += 1
+        if changed:
+            self.emit()
+
+    def emit(self) -> None:
+        raise NotImplementedError
+
+    def set_locations(self, locations: Sequence[int]) -> None:
+        """Follow other locations, keeping the positions of those followed already"""
+        positions = dict(zip(self.locations, self.positions))
+        self.locations = tuple(locations)
+        self.positions = [positions.get(location, 0) for location in self.locations]
+
+    def close(self) -> None:
+        """Release any resources held by the channel"""
+
+
+class PaddleAxes(AnalogChannel):
+    """Paddles as the axes of a virtual joystick, written from the injection thread
+
+    Positions changed by several frames before the thread gets to them are written once,
+    with their latest values.
+    """
+
+    def __init__(self, injector, output: "UinputJoystick", locations: Sequence[int] = (0, 1),
+                 deadzone: float = DEFAULT_DEADZONE, curve: float = DEFAULT_CURVE):
+        super().__init__(locations, deadzone, curve)
+        self.injector = injector
+        self.output = output
+        # Positions last written to the output (only touched by the injection thread)
+        self._written = [0] * len(self.locations)
+        self._queued = False
+        # Bound once, so queueing a delivery doesn't create a method object per frame
+        self._deliver_bound = self._deliver
+
+    def emit(self) -> None:
+        if not self._queued:
+            self._queued = True
+            self.injector.call(self._deliver_bound)
+
+    def _deliver(self) -> None:
+        # Cleared before reading, so a change made meanwhile queues another delivery
+        self._queued = False
+        written = self._written
+        for index, position in enumerate(self.positions):
+            if position != written[index]:
+                written[index] = position
+                self.output.move(index, position)
+        self.output.flush()
+
+    def close(self) -> None:
+        self.output.close()
+
+
+class PaddleKeys(AnalogChannel):
+    """Paddles as keys, pressed past PRESS_AT of the travel and released below RELEASE_AT"""
+
+    def __init__(self, injector, keys: Dict[int, str], deadzone: float = DEFAULT_DEADZONE,
+                 curve: float = DEFAULT_CURVE):
+        super().__init__(tuple(keys), deadzone, curve)
+        self.injector = injector
+        self.keys = tuple(keys.values())
+        self.press_at = round(PRESS_AT * AXIS_MAX)
+        self.release_at = round(RELEASE_AT * AXIS_MAX)
+        self.held = [False] * len(self.locations)
+
+    def emit(self) -> None:
+        held = self.held
+        injector = self.injector
+        flush = False
+        for index, position in enumerate(self.positions):
+            travel = abs(position)
+            if not held[index] and travel >= self.press_at:
+                held[index] = True
+                injector.press(self.keys[index])
+                flush = True
+            elif held[index] and travel < self.release_at:
+                held[index] = False
+                injector.release(self.keys[index])
+                flush = True
+        if flush:
+            injector.flush()
+
+    def set_keys(self, keys: Dict[int, str]) -> None:
+        """Use the keys of another key mapping, releasing those held (left for the caller to flush)
+
+        A paddle held past PRESS_AT presses its new key once it moves, not right away.
+        """
+        for index, key in enumerate(self.keys):
+            if self.held[index]:
+                self.injector.release(key)
+        self.set_locations(tuple(keys))
+        self.keys = tuple(keys.values())
+        self.held = [False] * len(self.locations)
+
+
+class UinputJoystick(UinputDevice):
+    """Virtual Linux joystick on /dev/uinput with one absolute axis per paddle"""
+
+    NAME = "Zwift Ride Paddles"
+    PRODUCT_ID = 0x0002
+    AXES = (ABS_X, ABS_Y)
+    EVENT_BITS = {EV_KEY: (BTN_SOUTH,), EV_ABS: AXES}
+    ABS_RANGES = {ABS_X: (-AXIS_MAX, AXIS_MAX), ABS_Y: (-AXIS_MAX, AXIS_MAX)}
+
+    def move(self, index: int, position: int) -> None:
+        self._buffer += INPUT_EVENT.pack(0, 0, EV_ABS, self.AXES[index], position)
@@ -0,0 +1,161 @@
+"""Notification timing analyzer: is the input lag on the BLE side or the host side?
+
+Tracks, per unit and message type, the inter-arrival time and its jitter, repeated and
+duplicated frames, and gaps that suggest dropped frames, plus an estimate of the
+effective BLE connection interval per unit. Notifications can only arrive at connection
+events, so the shortest typical spacing between notifications that are not in the same
+event approximates the interval the OS negotiated.
+
+Live:      python app.py --analyze
+Recorded:  python analyzer.py ride.zrl [--every 5]
+"""
+import argparse
+import statistics
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from app import MEASUREMENT_CHAR_UUID
+
+MESSAGE_NAMES = {0x23: "buttons", 0x19: "status", 0x15: "idle", 0x2a: "initial"}
+
+# Notifications closer than this were delivered in the same connection event
+SAME_EVENT_NS = 1_500_000
+# A gap longer than this many typical intervals counts the frames in between as missing
+GAP_FACTOR = 1.8
+# Inter-arrival samples kept per stream for the rolling statistics
+WINDOW = 512
+# Frames between refreshes of a stream's typical interval
+TYPICAL_REFRESH = 64
+
+
+class StreamStats:
+    """Timing of one message type from one unit"""
+
+    __slots__ = ("count", "last_ns", "last_payload", "intervals", "typical", "repeats", "duplicates", "missing")
+
+    def __init__(self, window: int):
+        self.count = 0
+        self.last_ns = 0
+        self.last_payload = b""
+        self.intervals: Deque[int] = deque(maxlen=window)
+        # Median interval, refreshed every TYPICAL_REFRESH frames to keep observe() cheap
+        self.typical = 0
+        # Same payload as the previous frame, and the subset that came in the same connection event
+        self.repeats = 0
+        self.duplicates = 0
+        # Frames estimated missing from gaps in a periodic stream
+        self.missing = 0
+
+
+class NotificationAnalyzer:
+    """Collects notification timing, fed live through wrap() or from a log through observe()"""
+
+    def __init__(self, window: int = WINDOW):
+        self.window = window
+        self.streams: Dict[Tuple[int, int], StreamStats] = {}
+        # Spacing between notifications of any type, per unit, for the connection interval
+        self.event_intervals: Dict[int, Deque[int]] = {}
+        self._last_ns: Dict[int, int] = {}
+
+    def observe(self, timestamp_ns: int, device_id: int, data: bytes) -> None:
+        """Account for one measurement notification"""
+        if not data:
+            return
+        key = (device_id, data[0])
+        stream = self.streams.get(key)
+        if stream is None:
+            stream = self.streams[key] = StreamStats(self.window)
+
+        if stream.count:
+            interval = timestamp_ns - stream.last_ns
+            if data == stream.last_payload:
+                stream.repeats += 1
+                if interval < SAME_EVENT_NS:
+                    stream.duplicates += 1
+            typical = stream.typical
+            if typical and interval > GAP_FACTOR * typical:
+                stream.missing += round(interval / typical) - 1
+            stream.intervals.append(interval)
+            if stream.count % TYPICAL_REFRESH == 8:
+                stream.typical = sorted(stream.intervals)[len(stream.intervals) // 2]
+        stream.count += 1
+        stream.last_ns = timestamp_ns
+        stream.last_payload = bytes(data)
+
+        last = self._last_ns.get(device_id)
+        if last is not None and timestamp_ns - last >= SAME_EVENT_NS:
+            intervals = self.event_intervals.get(device_id)
+            if intervals is None:
+                intervals = self.event_intervals[device_id] = deque(maxlen=self.window)
+            intervals.append(timestamp_ns - last)
+        self._last_ns[device_id] = timestamp_ns
+
+    def wrap(self, char_uuid: str, handler: Callable[[int, bytearray], None],
+             device_id: int) -> Callable[[int, bytearray], None]:
+        """Return a notification handler that is analyzed before calling handler"""
+        if char_uuid != MEASUREMENT_CHAR_UUID:
+            return handler
+        observe = self.observe
+        monotonic_ns = time.monotonic_ns
+
+        def analyzed_handler(sender: int, data: bytearray) -> None:
+            observe(monotonic_ns(), device_id, data)
+            handler(sender, data)
+
+        return analyzed_handler
+
+    def connection_interval_ms(self, device_id: int) -> Optional[float]:
+        """Effective connection interval of a unit: the 10th percentile of the spacing between connection events"""
+        intervals = self.event_intervals.get(device_id)
+        if not intervals or len(intervals) < 4:
+            return None
+        ordered = sorted(intervals)
+        return ordered[len(ordered) // 10] / 1e6
+
+    def report(self) -> str:
+        """Rolling report over the last WINDOW notifications of every stream"""
+        lines = [f"{'unit':>4} {'type':8} {'count':>7} {'mean ms':>8} {'jitter ms':>9} {'min ms':>7} "
+                 f"{'max ms':>7} {'repeats':>7} {'dupes':>5} {'missing':>7}"]
+        for (device_id, msg_type), stream in sorted(self.streams.items()):
+            name = MESSAGE_NAMES.get(msg_type, f"0x{msg_type:02x}")
+            intervals = [ns / 1e6 for ns in stream.intervals]
+            if len(intervals) >= 2:
+                timing = (f"{statistics.fmean(intervals):8.2f} {statistics.stdev(intervals):9.2f} "
+                          f"{min(intervals):7.2f} {max(intervals):7.2f}")
+            else:
+                timing = f"{'-':>8} {'-':>9} {'-':>7} {'-':>7}"
+            lines.append(f"{device_id:4} {name:8} {stream.count:7} {timing} "
+                         f"{stream.repeats:7} {stream.duplicates:5} {stream.missing:7}")
+        for device_id in sorted(self.event_intervals):
+            interval = self.connection_interval_ms(device_id)
+            if interval is not None:
+                lines.append(f"unit {device_id}: effective connection interval ~{interval:.1f} ms")
+        return "\n".join(lines)
+
+
+def analyze_log(path: str, every: float) -> NotificationAnalyzer:
+    """Analyze a recorded log, printing a report every `every` seconds of recorded time"""
+    from replay import read_log
+
+    analyzer = NotificationAnalyzer()
+    next_report = None
+    for timestamp, device_id, char_uuid, data in read_log(path):
+        if char_uuid != MEASUREMENT_CHAR_UUID:
+            continue
+        if next_report is None:
+            next_report = timestamp + every * 1e9
+        elif timestamp >= next_report:
+            print(analyzer.report(), end="\n\n")
+            next_report += every * 1e9
+        analyzer.observe(timestamp, device_id, data)
+    print(analyzer.report())
+    return analyzer
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Analyze notification timing of a recorded Zwift Ride log")
+    parser.add_argument("log", help="log written with app.py --record")
+    parser.add_argument("--every", type=float, default=5.0, help="seconds of recorded time between reports")
+    args = parser.parse_args()
+    analyze_log(args.log, args.every)
@@ -1,26 +1,94 @@
+import argparse
 import asyncio
+import functools
 import json
 import logging
+import logging.handlers
+import queue
+import random
+import sys
+import threading
 import time
-from typing import Dict, List, Optional, Tuple, Any
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Sequence, Tuple
 
 from bleak import BleakClient, BleakScanner
 from bleak.backends.device import BLEDevice
 from bleak.backends.scanner import AdvertisementData
-import keyboard
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='[%(asctime)s] %(levelname)s: %(message)s',
-    datefmt='%H:%M:%S'
-)
+from analog import DEFAULT_CURVE, DEFAULT_DEADZONE, AnalogChannel, PaddleAxes, PaddleKeys, UinputJoystick
+from connection_tuning import ConnectionParameters, tune_connection
+from focus import FocusMonitor, Window, WindowRule, compile_window_rules, match_window
+from gestures import GestureEngine, GestureTable, compile_gesture_table, is_seconds
+from key_output import KEY_OUTPUTS, KeyOutput, KeyboardOutput, create_key_output
+from latency import LatencyStats
+from macros import MacroEngine, MacroTable, compile_macro_table
+from pointer import MOUSE_OUTPUTS, MouseAction, MouseEngine, MouseOutput, MouseTable, PaddleMouse, \
+    compile_mouse_table, parse_mouse_action
+
 logger = logging.getLogger(__name__)
 
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    """Queue records as they are, so even message formatting happens on the listener thread
+
+    Hot-path log calls only pass immutable arguments (ints and strings), so deferring
+    the formatting can't change the message.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Set up logging so that formatting and writing to stderr happen off the event loop"""
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%H:%M:%S'))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+
+    root = logging.getLogger()
+    root.handlers = [LazyQueueHandler(log_queue)]
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+class EventRateLimiter:
+    """Token bucket per event type, so a held button or a chatty device can't flood the log"""
+
+    def __init__(self, rate: float = 10.0, burst: float = 20.0):
+        # Sustained events per second and the burst allowed on top, per event type
+        self.rate = rate
+        self.burst = burst
+        self._tokens: Dict[str, float] = {}
+        self._updated: Dict[str, float] = {}
+        # Events dropped by the limiter, per event type
+        self.suppressed: Dict[str, int] = {}
+
+    def allow(self, event: str, level: int = logging.INFO) -> bool:
+        """Whether a record for event at level (INFO by default) should be logged now"""
+        if not logger.isEnabledFor(level):
+            return False
+        now = time.monotonic()
+        tokens = self._tokens.get(event, self.burst) + (now - self._updated.get(event, now)) * self.rate
+        self._updated[event] = now
+        if tokens >= 1.0:
+            self._tokens[event] = min(tokens, self.burst) - 1.0
+            return True
+        self._tokens[event] = tokens
+        self.suppressed[event] = self.suppressed.get(event, 0) + 1
+        return False
+
+
+# Rate limiter for the log events of the notification path
+log_events = EventRateLimiter()
+
 # Constants for Zwift Ride
 RIDE_NAME = "Zwift Ride"  # Device name shown in logs
 MANUFACTURER_ID = 2378  # Decimal representation of 0x094A
 LEFT_DEVICE_ID = 8  # Device ID for Ride Left
+RIGHT_DEVICE_ID = 9  # Device ID for Ride Right
+DEVICE_SIDES = {LEFT_DEVICE_ID: "left", RIGHT_DEVICE_ID: "right"}
 
 CUSTOM_SERVICE_UUID = "0000fc82-0000-1000-8000-00805f9b34fb"
 MEASUREMENT_CHAR_UUID = "00000002-19ca-4651-86e5-fa29dcdd09d1"
@@ -47,6 +115,15 @@ BUTTON_MASKS = {
     "ONOFF_R_BTN": 0x20000,
 }
 
+# Every bit of the button map that carries a button
+ALL_BUTTONS_MASK = sum(BUTTON_MASKS.values())
+
+# Button name per bit position of the button map (None for unused bits)
+BUTTON_NAMES_BY_BIT: Tuple[Optional[str], ...] = tuple(
+    next((name for name, mask in BUTTON_MASKS.items() if mask == 1 << bit), None)
+    for bit in range(32)
+)
+
 # Default key mapping - customize this as needed
 DEFAULT_KEY_MAPPING = {
     "LEFT_BTN": "left",
@@ -68,152 +145,1100 @@ DEFAULT_KEY_MAPPING = {
 }
 
 
-class ZwiftRideController:
-    def __init__(self, key_mapping=None):
-        self.device: Optional[BLEDevice] = None
-        self.client: Optional[BleakClient] = None
-        self.connected = False
-        self.key_mapping = key_mapping or DEFAULT_KEY_MAPPING
-        self.pressed_buttons = set()
-        # Track last press time to handle repeated presses
-        self.last_press_time = {}
-        # Minimum time between repeated keypresses (in seconds)
-        self.repeat_delay = 0.2
-        # Keep track of which keys are currently being held down
-        self.active_keys = set()
-        # Store discovered devices for selection
-        self.discovered_devices = []
-
-    def load_key_mapping(self, json_file: str) -> None:
-        """Load key mapping from a JSON file"""
+INFINITY = float("inf")
+
+
+def mapped_key(value: Any) -> Optional[str]:
+    """Key of a key_mapping.json entry: a key name, or an object with "key" and optional repeat timing"""
+    if isinstance(value, dict):
+        return value.get("key")
+    return value
+
+
+def compile_key_table(key_mapping: Dict[str, Any]) -> Tuple[Tuple[Optional[str], ...], int]:
+    """Compile a button name -> key mapping into a per-bit key table and the mask of mapped bits"""
+    keys = tuple(mapped_key(key_mapping.get(name)) if name else None for name in BUTTON_NAMES_BY_BIT)
+    mapped_mask = 0
+    for bit, key in enumerate(keys):
+        if key:
+            mapped_mask |= 1 << bit
+    return keys, mapped_mask
+
+
+def compile_repeat_table(key_mapping: Dict[str, Any], delay: float,
+                         interval: float) -> Tuple[Tuple[float, ...], Tuple[float, ...], int]:
+    """Compile per-bit repeat delays and intervals, and the mask of mapped bits that repeat
+
+    Buttons take the given defaults unless their entry sets its own timing, like
+    {"key": "up", "repeat_delay": 0.3, "repeat_interval": 0.05}, or turns repeats off
+    with {"key": "enter", "repeat": false}.
+    """
+    if delay < 0:
+        raise ValueError("The repeat delay can't be negative")
+    if interval <= REPEAT_GAP:
+        raise ValueError(f"The repeat interval must be longer than {REPEAT_GAP} s")
+    delays = []
+    intervals = []
+    repeat_mask = 0
+    for bit, name in enumerate(BUTTON_NAMES_BY_BIT):
+        value = key_mapping.get(name) if name else None
+        options = value if isinstance(value, dict) else {}
+        button_delay = options.get("repeat_delay", delay)
+        button_interval = options.get("repeat_interval", interval)
+        repeat = options.get("repeat", True)
+        # The timer wheel only finds out about a bad value on the first press, with the key already down
+        if not is_seconds(button_delay):
+            raise ValueError(f"The repeat delay of {name} must be a number of seconds, got {button_delay!r}")
+        if not is_seconds(button_interval) or button_interval <= REPEAT_GAP:
+            raise ValueError(f"The repeat interval of {name} must be a number of seconds longer than {REPEAT_GAP}, "
+                             f"got {button_interval!r}")
+        if not isinstance(repeat, bool):
+            raise ValueError(f"repeat of {name} must be true or false, got {repeat!r}")
+        delays.append(button_delay)
+        intervals.append(button_interval)
+        if mapped_key(value) and repeat:
+            repeat_mask |= 1 << bit
+    return tuple(delays), tuple(intervals), repeat_mask
+
+
+class CompiledMapping(NamedTuple):
+    """Everything the notification path needs from a key mapping, compiled once per mapping"""
+    key_table: Tuple[Optional[str], ...]
+    # Bits mirrored as keys through key_table
+    mapped_mask: int
+    repeat_delays: Tuple[float, ...]
+    repeat_intervals: Tuple[float, ...]
+    repeat_mask: int
+    # Gestures and chords, None if the mapping has none
+    gesture_table: Optional[GestureTable]
+    # Macros, None if the mapping has none
+    macro_table: Optional[MacroTable] = None
+    # Mouse actions of the buttons, None if the mapping has none
+    mouse_table: Optional[MouseTable] = None
+    # (location, key) and (location, mouse action) of the paddles, for --paddles keys and mouse
+    paddle_keys: Tuple[Tuple[int, str], ...] = ()
+    paddle_actions: Tuple[Tuple[int, MouseAction], ...] = ()
+
+
+def compile_mapping(key_mapping: Dict[str, Any], repeat_delay: float, repeat_interval: float) -> CompiledMapping:
+    """Validate and compile a key mapping; raises ValueError if it can't be used
+
+    Doesn't touch any controller state, so it can run off the event loop.
+    """
+    if not isinstance(key_mapping, dict):
+        raise ValueError(f"A key mapping must be a JSON object, got {type(key_mapping).__name__}")
+    for name, value in key_mapping.items():
+        # Chords are checked with the gestures
+        if "+" not in name and not isinstance(mapped_key(value), (str, type(None))):
+            raise ValueError(f"{name} must map to a key name or an object, got {value!r}")
+    key_table, mapped_mask = compile_key_table(key_mapping)
+    repeat_delays, repeat_intervals, repeat_mask = compile_repeat_table(key_mapping, repeat_delay, repeat_interval)
+    gesture_table = compile_gesture_table(key_mapping, BUTTON_MASKS)
+    if gesture_table is not None:
+        # Buttons with gestures, or in a chord, are left to the gesture engine
+        mapped_mask &= ~gesture_table.mask
+    macro_table = compile_macro_table(key_mapping, BUTTON_MASKS)
+    if macro_table is not None and gesture_table is not None and macro_table.mask & gesture_table.mask:
+        raise ValueError("Buttons with a macro can't have gestures or be in a chord")
+    mouse_table = compile_mouse_table(key_mapping, BUTTON_MASKS)
+    if mouse_table is not None and gesture_table is not None and mouse_table.mask & gesture_table.mask:
+        raise ValueError("Buttons with a mouse action can't have gestures or be in a chord")
+    paddle_keys = []
+    paddle_actions = []
+    for name, location in PADDLE_NAMES.items():
+        value = key_mapping.get(name)
+        if mapped_key(value):
+            paddle_keys.append((location, mapped_key(value)))
+        action = parse_mouse_action(value, name, paddle=True)
+        if action is not None:
+            paddle_actions.append((location, action))
+    return CompiledMapping(key_table, mapped_mask, repeat_delays, repeat_intervals, repeat_mask, gesture_table,
+                           macro_table, mouse_table, tuple(paddle_keys), tuple(paddle_actions))
+
+
+# Name of the only profile of a key mapping file without profiles
+DEFAULT_PROFILE = "default"
+# Chord that cycles through the profiles, unless the file names another one
+DEFAULT_SWITCH_PROFILE = "ONOFF_L_BTN+ONOFF_R_BTN"
+
+
+class Profiles(NamedTuple):
+    """Named key mappings, all compiled up front so switching between them is only a swap"""
+    names: Tuple[str, ...]
+    mappings: Tuple[Dict[str, Any], ...]
+    compiled: Tuple[CompiledMapping, ...]
+    # Profile of each kind of focused window, see focus.py
+    window_rules: Tuple[WindowRule, ...] = ()
+
+
+def compile_profiles(source: Any, repeat_delay: float, repeat_interval: float) -> Profiles:
+    """Validate and compile every profile of a key mapping file; raises ValueError if one can't be used
+
+    The file holds either one key mapping, the "default" profile, or several:
+    {"switch_profile": "ONOFF_L_BTN+ONOFF_R_BTN", "profiles": {"MyWhoosh": {...}, "Zwift": {...}}}
+    The switch_profile chord (that one unless given) goes to the next profile in the file.
+    An optional "window_profiles" list picks a profile by the focused window (focus.py).
+    """
+    if not isinstance(source, dict) or "profiles" not in source:
+        return Profiles((DEFAULT_PROFILE,), (source,), (compile_mapping(source, repeat_delay, repeat_interval),))
+    profiles = source["profiles"]
+    if not isinstance(profiles, dict) or not profiles:
+        raise ValueError("profiles must be a JSON object with at least one profile")
+    switch = source.get("switch_profile", DEFAULT_SWITCH_PROFILE)
+    if not isinstance(switch, str) or "+" not in switch:
+        raise ValueError(f"switch_profile must be a chord of buttons joined by +, got {switch!r}")
+    mappings = []
+    compiled = []
+    for name, key_mapping in profiles.items():
+        if not isinstance(key_mapping, dict):
+            raise ValueError(f"Profile {name} must be a JSON object, got {type(key_mapping).__name__}")
+        if switch in key_mapping:
+            raise ValueError(f"Profile {name} maps {switch}, which switches profiles")
+        key_mapping = dict(key_mapping, **{switch: {"command": "next_profile"}})
         try:
-            with open(json_file, 'r') as f:
-                self.key_mapping = json.load(f)
-            logger.info(f"Loaded key mapping from {json_file}")
-        except Exception as e:
-            logger.error(f"Error loading key mapping: {e}")
+            compiled.append(compile_mapping(key_mapping, repeat_delay, repeat_interval))
+        except ValueError as e:
+            raise ValueError(f"Profile {name}: {e}") from None
+        mappings.append(key_mapping)
+    window_rules = compile_window_rules(source.get("window_profiles", []), list(profiles))
+    return Profiles(tuple(profiles), tuple(mappings), tuple(compiled), window_rules)
 
-    def save_key_mapping(self, json_file: str) -> None:
-        """Save current key mapping to a JSON file"""
-        try:
-            with open(json_file, 'w') as f:
-                json.dump(self.key_mapping, f, indent=4)
-            logger.info(f"Saved key mapping to {json_file}")
-        except Exception as e:
-            logger.error(f"Error saving key mapping: {e}")
 
-    def is_left_controller(self, device: BLEDevice, adv_data: AdvertisementData) -> bool:
-        """Check if device is the left Zwift Ride controller based on manufacturer data"""
-        if not device.name or RIDE_NAME not in device.name:
-            return False
+def read_key_mapping(json_file: str, repeat_delay: float, repeat_interval: float) -> Tuple[Any, Profiles]:
+    """Read and compile a key mapping file"""
+    with open(json_file, 'r') as f:
+        source = json.load(f)
+    return source, compile_profiles(source, repeat_delay, repeat_interval)
 
-        # Check if manufacturer data exists
-        if not hasattr(adv_data, 'manufacturer_data') or not adv_data.manufacturer_data:
-            return False
 
-        # Based on your logs, we're looking for manufacturer ID 2378 and device ID 8 in the first byte
-        manuf_data = adv_data.manufacturer_data.get(MANUFACTURER_ID)
-        if manuf_data is not None and len(manuf_data) >= 1:
-            device_id = manuf_data[0]
-            logger.info(f"Device {device.name} [{device.address}] has device ID: {device_id}")
-            return device_id == LEFT_DEVICE_ID
+# Key mapping, reloaded whenever it changes unless --no-reload is given
+KEY_MAPPING_FILE = "key_mapping.json"
 
-        return False
+# Profile in use, restored on the next start
+ACTIVE_PROFILE_FILE = "active_profile.json"
 
-    async def scan_for_device(self) -> bool:
-        """Scan for Zwift Ride left controller only"""
-        logger.info(f"Scanning for Zwift Ride left controller (device_id {LEFT_DEVICE_ID})...")
-        self.discovered_devices = []
-        left_controller_found = False
-
-        def detection_callback(device: BLEDevice, advertisement_data: AdvertisementData):
-            nonlocal left_controller_found
-
-            # First just log all Zwift devices for debugging
-            if device.name and RIDE_NAME in device.name:
-                logger.info(f"Found device: {device.name} [{device.address}]")
-                logger.info(f"  RSSI: {advertisement_data.rssi if hasattr(advertisement_data, 'rssi') else 'Unknown'}")
-
-                # Print manufacturer data for debugging
-                if hasattr(advertisement_data, 'manufacturer_data'):
-                    logger.info(f"  Manufacturer data: {advertisement_data.manufacturer_data}")
-
-                # Check if it's the left controller
-                if self.is_left_controller(device, advertisement_data):
-                    logger.info(f"*** IDENTIFIED as LEFT controller! ***")
-                    # Store the left controller
-                    if device not in self.discovered_devices:
-                        self.discovered_devices.append(device)
-                        left_controller_found = True
-
-        # Scan for devices
-        scanner = BleakScanner()
-        scanner.register_detection_callback(detection_callback)
-        await scanner.start()
-
-        # Scan until we find the left controller or timeout
-        scan_time = 0
-        max_scan_time = 30  # Maximum scan time in seconds
-        while not left_controller_found and scan_time < max_scan_time:
-            await asyncio.sleep(1.0)
-            scan_time += 1
-            logger.info(f"Scanning... {scan_time}/{max_scan_time} seconds")
-
-        await scanner.stop()
-
-        if not self.discovered_devices:
-            logger.error(f"No Zwift Ride left controller (device_id {LEFT_DEVICE_ID}) found")
-            return False
+# Last connected controller and its GATT handles, kept next to key_mapping.json
+DEVICE_CACHE_FILE = "device_cache.json"
 
-        # Use the first left controller we found
-        self.device = self.discovered_devices[0]
-        logger.info(f"Selected left controller: {self.device.name} [{self.device.address}]")
-        return True
+# Maximum time to scan for the controller (in seconds)
+SCAN_TIMEOUT = 30.0
+
+# Reconnect backoff (in seconds): the first delay doubles per failed attempt up to the maximum,
+# and each wait is drawn uniformly below it so a fleet of controllers doesn't retry in lockstep
+RECONNECT_BASE_DELAY = 0.5
+RECONNECT_MAX_DELAY = 30.0
+
+# Seconds between reports of the notification analyzer (--analyze)
+ANALYZER_REPORT_INTERVAL = 5.0
+
+# Number of analog locations tracked (0 is the left paddle, 1 the right one)
+ANALOG_SLOTS = 4
+
+# Analog location of the paddle on each unit, and its name in key_mapping.json
+PADDLE_LOCATIONS = {LEFT_DEVICE_ID: 0, RIGHT_DEVICE_ID: 1}
+PADDLE_NAMES = {"PADDLE_L": 0, "PADDLE_R": 1}
+
+
+def decode_key_group(buffer, offset: int, slots: List[int]) -> int:
+    """Decode the KeyGroup at offset into slots[location] and return the offset after it
+
+    Works in place on bytes, bytearray or memoryview without slicing. Returns -1 if there
+    is no KeyGroup at offset or it is malformed. Locations outside slots are skipped.
+    """
+    end = len(buffer)
+    if offset >= end or buffer[offset] != 0x1a:
+        return -1
+
+    try:
+        # Length of the KeyPress message
+        offset += 1
+        length = 0
+        shift = 0
+        while True:
+            byte = buffer[offset]
+            offset += 1
+            length |= (byte & 0x7f) << shift
+            if byte < 0x80:
+                break
+            shift += 7
+        stop = offset + length
+        if stop > end:
+            return -1
+
+        # Absent fields keep their protobuf default of 0
+        location = 0
+        analog_value = 0
+        while offset < stop:
+            tag = buffer[offset]
+            offset += 1
+            wire_type = tag & 0x7
+
+            if wire_type == 0:  # Varint
+                value = 0
+                shift = 0
+                while True:
+                    byte = buffer[offset]
+                    offset += 1
+                    value |= (byte & 0x7f) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+                field_num = tag >> 3
+                if field_num == 1:  # Location
+                    location = value
+                elif field_num == 2:  # AnalogValue, ZigZag encoded sint32
+                    analog_value = (value >> 1) ^ -(value & 1)
+
+            elif wire_type == 2:  # Length-delimited, skipped
+                length = 0
+                shift = 0
+                while True:
+                    byte = buffer[offset]
+                    offset += 1
+                    length |= (byte & 0x7f) << shift
+                    if byte < 0x80:
+                        break
+                    shift += 7
+                offset += length
+
+            elif wire_type == 1:  # 64-bit, skipped
+                offset += 8
 
-    async def connect(self) -> bool:
-        """Connect to the Zwift Ride left controller"""
-        if not self.device:
-            logger.error("No left controller to connect to. Please scan first.")
+            elif wire_type == 5:  # 32-bit, skipped
+                offset += 4
+
+            else:
+                return -1
+
+        if offset != stop:
+            return -1
+
+    except IndexError:
+        return -1
+
+    if location < len(slots):
+        slots[location] = analog_value
+    return stop
+
+
+# Gap between the release and the re-press of a repeated key (in seconds)
+REPEAT_GAP = 0.01
+
+
+class KeyInjector:
+    """Inject key events from a worker thread so the BLE callback never blocks"""
+
+    def __init__(self, output: KeyOutput):
+        self.output = output
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        # Events of the current notification, handed over as one batch by flush()
+        self._batch: List[Tuple[bool, str]] = []
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # Re-press timers of repeated keys, so a release can cancel them
+        self._pending: Dict[str, asyncio.TimerHandle] = {}
+        # Optional latency instrumentation, and the notification time of the current batch
+        self.latency: Optional[LatencyStats] = None
+        self.stamp = 0
+
+    def start(self) -> None:
+        """Start the injection thread (must be called from the event loop)"""
+        self._loop = asyncio.get_running_loop()
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="key-injector", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        """Flush queued key events and stop the injection thread"""
+        for handle in self._pending.values():
+            handle.cancel()
+        self._pending.clear()
+        self.flush()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def press(self, key: str) -> None:
+        """Queue a key press"""
+        self._batch.append((True, key))
+
+    def release(self, key: str) -> None:
+        """Queue a key release, cancelling any pending re-press of the key"""
+        handle = self._pending.pop(key, None)
+        if handle is not None:
+            handle.cancel()
+        self._batch.append((False, key))
+
+    def repeat(self, key: str) -> None:
+        """Release a key now and press it again after REPEAT_GAP"""
+        self.release(key)
+        self._pending[key] = self._loop.call_later(REPEAT_GAP, self._repress, key)
+
+    def call(self, fn: Callable[[], None]) -> None:
+        """Run fn on the injection thread, after the batches handed over so far"""
+        self._queue.put(fn)
+
+    def flush(self) -> None:
+        """Hand the events queued since the last flush to the injection thread as one batch"""
+        if self._batch:
+            self._queue.put((self.stamp, time.perf_counter_ns() if self.latency else 0, self._batch))
+            self._batch = []
+        self.stamp = 0
+
+    def _repress(self, key: str) -> None:
+        del self._pending[key]
+        self.press(key)
+        self.flush()
+
+    def _run(self) -> None:
+        output = self.output
+        perf_counter_ns = time.perf_counter_ns
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            if callable(item):
+                try:
+                    item()
+                except Exception as e:
+                    logger.error("inject_error call=%r error=%r", item, e)
+                continue
+            stamp, queued, batch = item
+            if queued:
+                picked = perf_counter_ns()
+            for pressed, key in batch:
+                try:
+                    if pressed:
+                        output.press(key)
+                    else:
+                        output.release(key)
+                except Exception as e:
+                    logger.error("inject_error key=%s error=%r", key, e)
+            try:
+                output.flush()
+            except Exception as e:
+                logger.error("flush_error error=%r", e)
+            if queued:
+                # Read per batch, as instrumentation can be enabled after the thread starts
+                self.latency.record_injection(stamp, queued, picked, perf_counter_ns())
+
+
+class KeyRepeater:
+    """Auto-repeat of held keys on a loop timer, so repeats don't depend on notification traffic
+
+    The first repeat of a key comes delay after its press, then one every interval, on the
+    loop's monotonic clock. Each deadline follows from the previous deadline, not from when
+    the timer actually fired, so lateness doesn't add up; a timer firing more than an
+    interval late skips the missed repeats instead of sending them in a burst.
+
+    Rather than a loop timer per key, one timer (loop.call_at) is armed for the earliest
+    deadline, like a timer wheel with a single slot. Pressing only re-arms it when a new
+    deadline comes first, and releasing just clears bits: a timer left armed for released
+    buttons finds nothing due and arms for the next held one, if any. Taps therefore cost
+    no timer at all while one is pending. Both take the mask of all the buttons that
+    changed in a notification, so a chord costs one call, and its keys come due together
+    and are repeated in one batch.
+    """
+
+    def __init__(self, injector: KeyInjector, clock: Any = None):
+        self.injector = injector
+        # Anything with time() and call_at(), normally the running event loop
+        self.clock = clock
+        # Bits of the buttons whose keys are repeating
+        self._held = 0
+        self._keys: List[Optional[str]] = [None] * 32
+        self._intervals = [0.0] * 32
+        self._deadlines = [0.0] * 32
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_at = INFINITY
+        # Repeats sent since the start
+        self.repeats = 0
+
+    def start(self) -> None:
+        """Schedule repeats on the running loop (must be called from the event loop)"""
+        self.clock = asyncio.get_running_loop()
+
+    def press(self, mask: int, keys: Sequence[Optional[str]], delays: Sequence[float],
+              intervals: Sequence[float]) -> None:
+        """Start repeating the keys of newly pressed buttons, with per-bit keys and timing
+
+        Does nothing until start() gave the repeater a loop.
+        """
+        clock = self.clock
+        if clock is None:
+            return
+        now = clock.time()
+        earliest = self._timer_at
+        self._held |= mask
+        while mask:
+            low = mask & -mask
+            mask ^= low
+            bit = low.bit_length() - 1
+            # Copied, so a new key mapping doesn't change what a held button repeats
+            self._keys[bit] = keys[bit]
+            self._intervals[bit] = intervals[bit]
+            deadline = self._deadlines[bit] = now + delays[bit]
+            if deadline < earliest:
+                earliest = deadline
+        if earliest < self._timer_at:
+            self._arm(earliest)
+
+    def release(self, mask: int) -> None:
+        """Stop repeating the keys of released buttons"""
+        self._held &= ~mask
+
+    def release_all(self) -> None:
+        self._held = 0
+        if self._timer is not None:
+            self._cancel()
+
+    def _arm(self, deadline: float) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer_at = deadline
+        self._timer = self.clock.call_at(deadline, self._fire)
+
+    def _cancel(self) -> None:
+        self._timer.cancel()
+        self._timer = None
+        self._timer_at = INFINITY
+
+    def _fire(self) -> None:
+        self._timer = None
+        self._timer_at = INFINITY
+        now = self.clock.time()
+        deadlines = self._deadlines
+        earliest = INFINITY
+        repeated = False
+
+        held = self._held
+        while held:
+            low = held & -held
+            held ^= low
+            bit = low.bit_length() - 1
+            deadline = deadlines[bit]
+            if deadline <= now:
+                key = self._keys[bit]
+                if log_events.allow("repeat"):
+                    logger.info("repeat key=%s", key)
+                # For repeat presses, we need to release and press again to simulate repeated keypresses
+                self.injector.repeat(key)
+                self.repeats += 1
+                repeated = True
+                interval = self._intervals[bit]
+                deadline += interval
+                if deadline <= now:
+                    deadline += ((now - deadline) // interval + 1) * interval
+                deadlines[bit] = deadline
+            if deadline < earliest:
+                earliest = deadline
+
+        if repeated:
+            self.injector.flush()
+        if self._held:
+            self._arm(earliest)
+
+
+class DeviceSession:
+    """Connection to one Zwift Ride unit, feeding its notifications to the shared controller"""
+
+    def __init__(self, controller: "ZwiftRideController", device_id: int):
+        self.controller = controller
+        self.device_id = device_id
+        self.side = DEVICE_SIDES[device_id]
+        self.device: Optional[BLEDevice] = None
+        self.client: Optional[BleakClient] = None
+        self.connected = False
+        # Set when the connection drops
+        self.disconnected = asyncio.Event()
+        # Address of the last unit we connected to, tried first when reconnecting
+        self.last_address: Optional[str] = None
+        # Link parameters negotiated on the last connect
+        self.connection_parameters: Optional[ConnectionParameters] = None
+
+    def _characteristics(self) -> Tuple[Any, Any, Any]:
+        """Control, measurement and response characteristics, as cached handles when the cache is for this device"""
+        cache = self.controller.device_cache.get(self.side, {})
+        handles = cache.get("handles")
+        if handles and cache.get("address") == self.client.address:
+            return handles["control"], handles["measurement"], handles["response"]
+
+        services = self.client.services
+        return (
+            services.get_characteristic(CONTROL_CHAR_UUID),
+            services.get_characteristic(MEASUREMENT_CHAR_UUID),
+            services.get_characteristic(RESPONSE_CHAR_UUID),
+        )
+
+    def _update_device_cache(self, control_char: Any, measurement_char: Any, response_char: Any) -> None:
+        """Remember the connected unit and its handles, writing the cache file only on change"""
+        device_cache = self.controller.device_cache
+        handles = {
+            name: char if isinstance(char, int) else char.handle
+            for name, char in (("control", control_char), ("measurement", measurement_char), ("response", response_char))
+        }
+        cache = {
+            "address": self.client.address,
+            "name": self.device.name if self.device else device_cache.get(self.side, {}).get("name", RIDE_NAME),
+            "device_id": self.device_id,
+            "handles": handles,
+        }
+        if cache != device_cache.get(self.side):
+            device_cache[self.side] = cache
+            self.controller.save_device_cache()
+
+    async def connect(self, address: Optional[str] = None) -> bool:
+        """Connect to this unit, directly by address if given"""
+        if not address and not self.device:
+            logger.error(f"No {self.side} controller to connect to. Please scan first.")
             return False
 
-        logger.info(f"Connecting to left controller {self.device.name} [{self.device.address}]...")
+        controller = self.controller
+        target = address or self.device
+        logger.info(f"Connecting to {self.side} controller {address or f'{self.device.name} [{self.device.address}]'}...")
 
         try:
-            self.client = BleakClient(self.device)
+            self.disconnected = asyncio.Event()
+            self.client = controller.client_class(target, disconnected_callback=self._on_disconnect)
             await self.client.connect()
-            logger.info("Connected to left controller")
+            logger.info(f"Connected to {self.side} controller")
+
+            control_char, measurement_char, response_char = self._characteristics()
 
             # Perform initial handshake
-            control_char = self.client.services.get_characteristic(CONTROL_CHAR_UUID)
             await self.client.write_gatt_char(control_char, b"RideOn")
             logger.info("Sent RideOn handshake")
 
+            # Ask for the shortest connection interval before the button stream starts
+            self.connection_parameters = await tune_connection(self.client)
+            logger.info(f"Connection parameters ({self.side} controller): {self.connection_parameters}")
+
+            notification_handler = functools.partial(controller.notification_handler, device_id=self.device_id)
+            response_handler = controller.response_handler
+            for tap in controller.taps:
+                notification_handler = tap.wrap(MEASUREMENT_CHAR_UUID, notification_handler, self.device_id)
+                response_handler = tap.wrap(RESPONSE_CHAR_UUID, response_handler, self.device_id)
+
             # Set up notifications for measurement characteristic
-            measurement_char = self.client.services.get_characteristic(MEASUREMENT_CHAR_UUID)
-            await self.client.start_notify(measurement_char, self.notification_handler)
+            await self.client.start_notify(measurement_char, notification_handler)
 
             # Set up notifications for response characteristic
-            response_char = self.client.services.get_characteristic(RESPONSE_CHAR_UUID)
-            await self.client.start_notify(response_char, self.response_handler)
+            await self.client.start_notify(response_char, response_handler)
 
+            controller.injector.start()
+            controller.start_timers()
+            self.last_address = self.client.address
+            self._update_device_cache(control_char, measurement_char, response_char)
             self.connected = True
             return True
 
         except Exception as e:
-            logger.error(f"Connection error: {e}")
+            logger.error(f"Connection error ({self.side} controller): {e}")
+            # The cached handles may be stale (e.g. after a firmware update), look them up again next time
+            controller.device_cache.get(self.side, {}).pop("handles", None)
+            # A step after connect() may have failed: don't leave the link open on a client we drop,
+            # the unit doesn't advertise (so can't be found again) while it's linked
+            try:
+                await self.client.disconnect()
+            except Exception:
+                pass
             return False
 
     async def disconnect(self) -> None:
-        """Disconnect from the device"""
+        """Disconnect from the unit"""
         if self.client and self.connected:
-            # Release all keys that might still be pressed
-            for key in self.active_keys:
-                keyboard.release(key)
-            self.active_keys.clear()
-
+            self.controller.release_device(self.device_id)
+            # Cleared first, so the disconnected callback doesn't take this for a dropout
+            self.connected = False
             await self.client.disconnect()
-            logger.info("Disconnected from device")
+            logger.info(f"Disconnected from {self.side} controller")
+
+    def _on_disconnect(self, client: BleakClient) -> None:
+        """Release held buttons and wake whoever waits on the session when the link drops"""
+        if client is not self.client:
+            # A late callback from a client we already replaced
+            return
+        if self.connected:
+            logger.warning(f"The {self.side} controller disconnected")
+            # Don't leave keys held down while the unit is gone
+            self.controller.release_device(self.device_id)
             self.connected = False
+        self.disconnected.set()
+
+    async def wait_disconnected(self) -> None:
+        """Wait until the unit disconnects"""
+        await self.disconnected.wait()
+
+    async def reconnect(self) -> None:
+        """Connect, trying the last known address before scanning, with jittered exponential backoff"""
+        attempt = 0
+        while True:
+            attempt += 1
+            logger.info(f"Connection attempt {attempt} ({self.side} controller)")
+
+            if self.last_address and await self.connect(self.last_address):
+                return
+            device = await self.controller.scan_for_device(self.device_id)
+            if device:
+                self.device = device
+                if await self.connect():
+                    return
+
+            delay = random.uniform(0, min(RECONNECT_MAX_DELAY, RECONNECT_BASE_DELAY * 2 ** (attempt - 1)))
+            logger.info(f"Failed to connect to the {self.side} controller. Retrying in {delay:.1f} seconds...")
+            await asyncio.sleep(delay)
+
+    async def run(self) -> None:
+        """Keep the session alive, reconnecting after every dropout"""
+        while True:
+            await self.reconnect()
+            logger.info(f"Listening for input from the {self.side} controller. Press Ctrl+C to exit.")
+            await self.wait_disconnected()
+            logger.info(f"Lost the {self.side} controller, reconnecting...")
+
+
+class ZwiftRideController:
+    # BLE classes, replaceable with fakes to run without the hardware
+    scanner_class = BleakScanner
+    client_class = BleakClient
+
+    def __init__(self, key_mapping=None, key_output: Optional[KeyOutput] = None,
+                 device_ids: Tuple[int, ...] = (LEFT_DEVICE_ID, RIGHT_DEVICE_ID)):
+        # Key events are injected off the BLE callback
+        self.injector = KeyInjector(key_output or KeyboardOutput())
+        self.repeater = KeyRepeater(self.injector)
+        # Taps, long presses, double taps and chords, if the key mapping has any
+        self.gestures: Optional[GestureEngine] = None
+        # Macros, if the key mapping has any
+        self.macros: Optional[MacroEngine] = None
+        # Mouse actions, once enable_mouse() gave them an output
+        self.mouse: Optional[MouseEngine] = None
+        self._mouse_table: Optional[MouseTable] = None
+        # Optional channel turning the paddle values into axes, keys or mouse motion
+        self.paddles: Optional[AnalogChannel] = None
+        # Bitmask of pressed buttons (1 means pressed, unlike the raw button map), merged over the units
+        self.pressed_mask = 0
+        # Keep track of which keys are currently being held down
+        self.active_keys = set()
+        # Buttons that were held when the mapping was swapped, ignored until they are released
+        self._suppressed = 0
+        # Auto-repeat of held keys: first repeat after repeat_delay, then every repeat_interval
+        # (in seconds), unless the key mapping sets other timing for the button
+        self._repeat_delay = 0.2
+        self._repeat_interval = 0.2
+        # Profiles of the key mapping, the index of the active one, and the file it's saved to
+        self.profiles: Optional[Profiles] = None
+        self.profile = 0
+        self.profile_switches = 0
+        self.profile_file: Optional[str] = None
+        self._profile_save: Optional[asyncio.Future] = None
+        # Focused window, if a focus.FocusMonitor reports it
+        self.focused_window: Optional[Window] = None
+        self.key_mapping = key_mapping or DEFAULT_KEY_MAPPING
+        # Key mapping reloads, and how long the last one took from reading the file to the
+        # swap, and the swap alone (in seconds)
+        self.mapping_reloads = 0
+        self.reload_time = 0.0
+        self.swap_time = 0.0
+        # Pressed buttons reported by each unit
+        self.device_pressed: Dict[int, int] = {device_id: 0 for device_id in device_ids}
+        # Each unit's last 0x23 frame and its raw button map, to short-circuit frames that repeat them
+        self.last_frame: Dict[int, bytes] = {}
+        self.last_button_map: Dict[int, int] = {}
+        # 0x23 frames handled, how many repeated the previous button map, and how many the whole frame
+        self.button_frames = 0
+        self.unchanged_frames = 0
+        self.identical_frames = 0
+        # Latest analog value per location, decoded in place
+        self.analog_values = [0] * ANALOG_SLOTS
+        # One session per Ride unit, all running on the same loop
+        self.sessions: Dict[int, DeviceSession] = {device_id: DeviceSession(self, device_id) for device_id in device_ids}
+        # Address, name, device ID and characteristic handles of the last units, by side
+        self.device_cache: Dict[str, Dict[str, Any]] = {}
+        self.device_cache_file: Optional[str] = None
+        # One scanner serves every session that is scanning, each waiting on its own device ID
+        self._scanner = None
+        self._scan_lock = asyncio.Lock()
+        self._scan_waiters: Dict[int, asyncio.Future] = {}
+        # Addresses already reported during the current scan
+        self._discovered = set()
+        # Observers of the raw notifications, like replay.NotificationRecorder or
+        # analyzer.NotificationAnalyzer: anything with wrap(char_uuid, handler, device_id)
+        self.taps: List[Any] = []
+        # Optional per-stage latency instrumentation, see enable_latency()
+        self.latency: Optional[LatencyStats] = None
+
+    @property
+    def connected(self) -> bool:
+        """Whether every unit is connected"""
+        return all(session.connected for session in self.sessions.values())
+
+    def enable_mouse(self, output: MouseOutput) -> MouseEngine:
+        """Carry out the mouse actions of the key mapping through output"""
+        self.mouse = MouseEngine(self.injector, output, self.repeater.clock)
+        self.mouse.set_table(self._mouse_table)
+        return self.mouse
+
+    def enable_latency(self, capacity: int = 8192) -> LatencyStats:
+        """Record per-stage latency from notification to key injection"""
+        self.latency = self.injector.latency = LatencyStats(capacity)
+        return self.latency
+
+    @property
+    def key_mapping(self) -> Dict[str, Any]:
+        return self._key_mapping
+
+    @key_mapping.setter
+    def key_mapping(self, key_mapping: Dict[str, Any]) -> None:
+        # Compile once here so notifications only do table lookups
+        self.set_profiles(key_mapping, compile_profiles(key_mapping, self._repeat_delay, self._repeat_interval))
+
+    @property
+    def profile_name(self) -> Optional[str]:
+        return self.profiles.names[self.profile] if self.profiles else None
+
+    def set_profiles(self, source: Any, profiles: Profiles) -> None:
+        """Switch to compiled profiles: the focused window's, or else the active one if they still have it"""
+        index = profiles.names.index(self.profile_name) if self.profile_name in profiles.names else 0
+        if self.focused_window is not None:
+            window_profile = match_window(profiles.window_rules, self.focused_window)
+            if window_profile is not None:
+                index = window_profile
+        self._profile_source = source
+        self.profiles = profiles
+        self.profile = index
+        self.swap_mapping(profiles.mappings[index], profiles.compiled[index])
+
+    def switch_profile(self, index: int, save: bool = True) -> None:
+        """Swap in the precompiled mapping of another profile (wrapping around), and save it as the active one"""
+        profiles = self.profiles
+        self.profile = index % len(profiles.names)
+        self.swap_mapping(profiles.mappings[self.profile], profiles.compiled[self.profile])
+        self.profile_switches += 1
+        logger.info(f"Switched to profile {self.profile_name}")
+        if save:
+            self.save_active_profile()
+
+    def focus_window(self, window: Window) -> None:
+        """Switch to the profile of the first window rule matching the newly focused window, if any
+
+        Focus switches aren't saved, so the next start is still on the profile picked by hand.
+        """
+        self.focused_window = window
+        index = match_window(self.profiles.window_rules, window)
+        if index is not None and index != self.profile:
+            self.switch_profile(index, save=False)
+
+    def run_command(self, name: str) -> None:
+        """Carry out a command of the key mapping, see gestures.COMMANDS"""
+        if name == "next_profile":
+            self.switch_profile(self.profile + 1)
+        elif name == "previous_profile":
+            self.switch_profile(self.profile - 1)
+
+    def swap_mapping(self, key_mapping: Dict[str, Any], compiled: CompiledMapping) -> None:
+        """Switch to a compiled key mapping
+
+        Runs on the loop between two notifications, so none of them sees half of a mapping.
+        Keys held under the old mapping are released in one batch, and buttons still held
+        stay silent until they are released, so that the buttons of a profile switch don't
+        act again in the new profile. Likewise a paddle key is released, and the new one
+        only pressed once the paddle moves.
+        """
+        for key in self.active_keys:
+            self.injector.release(key)
+        self.active_keys.clear()
+        self.repeater.release_all()
+        if self.gestures is not None:
+            self.gestures.release_all()
+        if self.macros is not None:
+            self.macros.release_all()
+        self._suppressed |= self.pressed_mask
+        self.pressed_mask = 0
+
+        self._key_table = compiled.key_table
+        self._mapped_mask = compiled.mapped_mask
+        self._repeat_delays = compiled.repeat_delays
+        self._repeat_intervals = compiled.repeat_intervals
+        self._repeat_mask = compiled.repeat_mask
+        if compiled.gesture_table is None:
+            self.gestures = None
+        else:
+            self.gestures = GestureEngine(compiled.gesture_table, self.injector, self.repeater.clock)
+            self.gestures.on_command = self.run_command
+        if compiled.macro_table is None:
+            self.macros = None
+        else:
+            self.macros = MacroEngine(compiled.macro_table, self.injector, self.repeater.clock)
+        self._mouse_table = compiled.mouse_table
+        if self.mouse is not None:
+            self.mouse.set_table(compiled.mouse_table)
+        # Paddles bound to the mapping take its keys or actions; axes don't depend on it
+        paddles = self.paddles
+        if isinstance(paddles, PaddleKeys):
+            paddles.set_keys(dict(compiled.paddle_keys))
+        elif isinstance(paddles, PaddleMouse):
+            paddles.set_actions(dict(compiled.paddle_actions))
+        self._key_mapping = key_mapping
+        self.injector.flush()
+
+    @property
+    def repeat_delay(self) -> float:
+        return self._repeat_delay
+
+    @repeat_delay.setter
+    def repeat_delay(self, delay: float) -> None:
+        profiles = compile_profiles(self._profile_source, delay, self._repeat_interval)
+        self._repeat_delay = delay
+        self.set_profiles(self._profile_source, profiles)
+
+    @property
+    def repeat_interval(self) -> float:
+        return self._repeat_interval
+
+    @repeat_interval.setter
+    def repeat_interval(self, interval: float) -> None:
+        profiles = compile_profiles(self._profile_source, self._repeat_delay, interval)
+        self._repeat_interval = interval
+        self.set_profiles(self._profile_source, profiles)
+
+    def start_timers(self) -> None:
+        """Run key repeats and gesture deadlines on the running loop (must be called from the event loop)"""
+        self.repeater.start()
+        if self.gestures is not None:
+            self.gestures.start()
+        if self.macros is not None:
+            self.macros.start()
+        if self.mouse is not None:
+            self.mouse.start()
+
+    def load_key_mapping(self, json_file: str) -> None:
+        """Load key mapping from a JSON file"""
+        try:
+            self.set_profiles(*read_key_mapping(json_file, self._repeat_delay, self._repeat_interval))
+            logger.info(f"Loaded key mapping from {json_file}, profiles: {', '.join(self.profiles.names)}")
+        except Exception as e:
+            logger.error(f"Error loading key mapping: {e}")
+
+    async def reload_key_mapping(self, json_file: str) -> bool:
+        """Read and compile a key mapping file off the event loop, then swap it in
+
+        A file that can't be read or doesn't validate leaves the current mapping in place.
+        """
+        start = time.perf_counter()
+        try:
+            source, profiles = await asyncio.get_running_loop().run_in_executor(
+                None, read_key_mapping, json_file, self._repeat_delay, self._repeat_interval)
+        except Exception as e:
+            logger.error(f"Key mapping in {json_file} not reloaded: {e}")
+            return False
+        swap_start = time.perf_counter()
+        self.set_profiles(source, profiles)
+        done = time.perf_counter()
+        self.mapping_reloads += 1
+        self.reload_time = done - start
+        self.swap_time = done - swap_start
+        logger.info(f"Reloaded key mapping from {json_file} in {self.reload_time * 1000:.1f} ms "
+                    f"(swap {self.swap_time * 1e6:.0f} us)")
+        return True
+
+    def save_key_mapping(self, json_file: str) -> None:
+        """Save current key mapping to a JSON file"""
+        try:
+            with open(json_file, 'w') as f:
+                json.dump(self.key_mapping, f, indent=4)
+            logger.info(f"Saved key mapping to {json_file}")
+        except Exception as e:
+            logger.error(f"Error saving key mapping: {e}")
+
+    def load_active_profile(self, json_file: str) -> None:
+        """Switch to the profile saved in a JSON file, and save the active profile there from now on"""
+        self.profile_file = json_file
+        try:
+            with open(json_file, 'r') as f:
+                name = json.load(f).get("profile")
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Error loading active profile: {e}")
+            return
+        if name in self.profiles.names and name != self.profile_name:
+            self.profile = self.profiles.names.index(name)
+            self.swap_mapping(self.profiles.mappings[self.profile], self.profiles.compiled[self.profile])
+            logger.info(f"Restored profile {name}")
+
+    def save_active_profile(self) -> None:
+        """Save the active profile to the profile file, off the event loop if one is running"""
+        if not self.profile_file:
+            return
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._write_active_profile(self.profile_name)
+            return
+        # One write at a time; a switch during a write is saved once it's done
+        if self._profile_save is None or self._profile_save.done():
+            self._profile_save = loop.run_in_executor(None, self._write_active_profile, self.profile_name)
+            self._profile_save.add_done_callback(self._active_profile_saved)
+
+    def _active_profile_saved(self, future: asyncio.Future) -> None:
+        if not future.cancelled() and future.result() != self.profile_name:
+            self.save_active_profile()
+
+    def _write_active_profile(self, name: str) -> str:
+        try:
+            with open(self.profile_file, 'w') as f:
+                json.dump({"profile": name}, f, indent=4)
+        except Exception as e:
+            logger.error(f"Error saving active profile: {e}")
+        return name
+
+    def load_device_cache(self, json_file: str) -> None:
+        """Load the last connected units from a JSON file, so startup can skip scanning"""
+        self.device_cache_file = json_file
+        try:
+            with open(json_file, 'r') as f:
+                self.device_cache = json.load(f)
+        except FileNotFoundError:
+            return
+        except Exception as e:
+            logger.error(f"Error loading device cache: {e}")
+            return
+
+        for session in self.sessions.values():
+            cache = self.device_cache.get(session.side)
+            if cache:
+                session.last_address = cache.get("address")
+                logger.info(f"Loaded cached {session.side} controller {cache.get('name')} [{session.last_address}]")
+
+    def save_device_cache(self) -> None:
+        """Save the last connected units to the device cache file"""
+        if not self.device_cache_file:
+            return
+        try:
+            with open(self.device_cache_file, 'w') as f:
+                json.dump(self.device_cache, f, indent=4)
+        except Exception as e:
+            logger.error(f"Error saving device cache: {e}")
+
+    def get_device_id(self, adv_data: AdvertisementData) -> Optional[int]:
+        """Get the Zwift Ride device ID (8 left, 9 right) from manufacturer data"""
+        # Based on your logs, we're looking for manufacturer ID 2378 and the device ID in the first byte
+        manuf_data = adv_data.manufacturer_data.get(MANUFACTURER_ID)
+        if manuf_data:
+            return manuf_data[0]
+        return None
+
+    def _detection_callback(self, device: BLEDevice, advertisement_data: AdvertisementData) -> None:
+        # Runs for every advertisement the scanner lets through, so bail out as early as possible
+        device_id = self.get_device_id(advertisement_data)
+        if device_id is None:
+            return
+
+        # One discovery event per device and scan
+        if device.address not in self._discovered:
+            self._discovered.add(device.address)
+            logger.info("discovered address=%s name=%r device_id=%d rssi=%d",
+                        device.address, device.name, device_id, advertisement_data.rssi)
+
+        # Check if it's a unit some session is waiting for
+        found = self._scan_waiters.get(device_id)
+        if found is not None and not found.done():
+            logger.info(f"*** IDENTIFIED as {DEVICE_SIDES[device_id].upper()} controller! ***")
+            found.set_result(device)
+
+    async def scan_for_device(self, device_id: int = LEFT_DEVICE_ID) -> Optional[BLEDevice]:
+        """Scan for the Zwift Ride unit with device_id, sharing one scanner between concurrent scans"""
+        side = DEVICE_SIDES[device_id]
+        logger.info(f"Scanning for Zwift Ride {side} controller (device_id {device_id})...")
+        # Resolved by the detection callback the moment the unit advertises
+        found = self._scan_waiters.get(device_id)
+        if found is None:
+            found = self._scan_waiters[device_id] = asyncio.get_running_loop().create_future()
+
+        async with self._scan_lock:
+            if self._scanner is None:
+                self._discovered.clear()
+                # Let the OS drop everything that isn't a Zwift device before it reaches Python
+                self._scanner = self.scanner_class(detection_callback=self._detection_callback,
+                                                   service_uuids=[CUSTOM_SERVICE_UUID])
+                await self._scanner.start()
+
+        # Scan until we find the unit or timeout
+        try:
+            device = await asyncio.wait_for(asyncio.shield(found), SCAN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.error(f"No Zwift Ride {side} controller (device_id {device_id}) found")
+            return None
+        finally:
+            if self._scan_waiters.get(device_id) is found:
+                del self._scan_waiters[device_id]
+            async with self._scan_lock:
+                if not self._scan_waiters and self._scanner is not None:
+                    scanner, self._scanner = self._scanner, None
+                    await scanner.stop()
+
+        logger.info(f"Selected {side} controller: {device.name} [{device.address}]")
+        return device
+
+    async def reconnect(self) -> None:
+        """Connect every unit, in parallel"""
+        await asyncio.gather(*(session.reconnect() for session in self.sessions.values()))
+
+    async def disconnect(self) -> None:
+        """Disconnect from every unit"""
+        await asyncio.gather(*(session.disconnect() for session in self.sessions.values()))
+        self.release_all_keys()
+        self.injector.stop()
+
+    async def run(self) -> None:
+        """Keep a session with every unit alive, each reconnecting on its own after a dropout"""
+        await asyncio.gather(*(session.run() for session in self.sessions.values()))
+
+    def release_device(self, device_id: int) -> None:
+        """Release the buttons held on one unit, and every key once no unit holds any"""
+        self.device_pressed[device_id] = 0
+        # The unit's next frame has to be applied in full, even if it repeats the last one
+        self.last_frame.pop(device_id, None)
+        self.last_button_map.pop(device_id, None)
+        # Center the unit's paddle too
+        location = PADDLE_LOCATIONS.get(device_id)
+        if location is not None and self.analog_values[location]:
+            self.analog_values[location] = 0
+            if self.paddles is not None:
+                self.paddles.update(self.analog_values)
+        pressed = 0
+        for mask in self.device_pressed.values():
+            pressed |= mask
+        if pressed:
+            self.trigger_keystrokes(pressed)
+        elif self.active_keys or self.pressed_mask:
+            self.release_all_keys()
+
+    def release_all_keys(self) -> None:
+        """Release every key that might still be pressed"""
+        for key in self.active_keys:
+            self.injector.release(key)
+        if self.gestures is not None:
+            self.gestures.release_all()
+        if self.macros is not None:
+            self.macros.release_all()
+        if self.mouse is not None:
+            self.mouse.release_all()
+        self.injector.flush()
+        self.active_keys.clear()
+        self.pressed_mask = 0
+        self._suppressed = 0
+        for device_id in self.device_pressed:
+            self.device_pressed[device_id] = 0
+        self.last_frame.clear()
+        self.last_button_map.clear()
+        self.repeater.release_all()
+        for location in range(ANALOG_SLOTS):
+            self.analog_values[location] = 0
+        if self.paddles is not None:
+            self.paddles.update(self.analog_values)
 
     def response_handler(self, _: int, data: bytearray) -> None:
         """Handle responses from the device"""
@@ -223,258 +1248,340 @@ class ZwiftRideController:
         except Exception as e:
             logger.error(f"Error decoding response: {e}")
 
-    def notification_handler(self, _: int, data: bytearray) -> None:
-        """Handle incoming notifications from the device"""
+    def notification_handler(self, _: int, data: bytearray, device_id: int = LEFT_DEVICE_ID) -> None:
+        """Handle incoming notifications from the unit with device_id"""
+        latency = self.latency
+        if latency is not None:
+            perf_counter_ns = time.perf_counter_ns
+            start = perf_counter_ns()
+
         try:
             msg_type = data[0]
 
             if msg_type == 0x23:  # Button status
-                button_map = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
-                pressed_buttons = self.parse_button_state(button_map)
-
-                if pressed_buttons:
-                    logger.info(f"Buttons pressed: {', '.join(pressed_buttons)}")
-                    self.trigger_keystrokes(pressed_buttons)
+                self.button_frames += 1
+                if data == self.last_frame.get(device_id):
+                    # The unit re-sent its previous frame, analog values included: nothing to do
+                    self.unchanged_frames += 1
+                    self.identical_frames += 1
+                    return
+                # Copied, so a caller reusing its buffer can't change what we compare against
+                self.last_frame[device_id] = bytes(data)
 
-                # Process analog values if present
+                button_map = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
+                if button_map == self.last_button_map.get(device_id):
+                    # Same buttons as before, only the analog values changed
+                    self.unchanged_frames += 1
+                else:
+                    self.last_button_map[device_id] = button_map
+                    # Note: 0 means pressed in the protocol, so invert to get a mask of pressed buttons
+                    device_pressed = self.device_pressed
+                    device_pressed[device_id] = ~button_map & ALL_BUTTONS_MASK
+
+                    # Merge with the buttons held on the other unit
+                    pressed = 0
+                    for mask in device_pressed.values():
+                        pressed |= mask
+
+                    if device_pressed[device_id] and log_events.allow("buttons"):
+                        logger.info("buttons device=%d pressed=%s", device_id, ",".join(self.parse_button_state(button_map)))
+
+                    if latency is None:
+                        self.trigger_keystrokes(pressed)
+                    else:
+                        decoded = perf_counter_ns()
+                        self.injector.stamp = start
+                        self.trigger_keystrokes(pressed)
+                        latency.record_handler(start, decoded, perf_counter_ns())
+
+                # Process analog values if present, decoding in place into self.analog_values
                 start_index = 7
                 while start_index < len(data):
-                    analog_data = self.parse_analog_message(data[start_index:])
-                    if not analog_data:
+                    start_index = decode_key_group(data, start_index, self.analog_values)
+                    if start_index < 0:
                         break
 
-                    #logger.info(f"Analog left:{analog_data['left']} right:{analog_data['right']}")
-                    start_index = analog_data.get('next_index', len(data))
+                # Once per frame, so only the latest value of each location counts
+                if self.paddles is not None:
+                    self.paddles.update(self.analog_values)
 
             elif msg_type == 0x2a:  # Initial status
                 logger.info("Initial status received")
 
             elif msg_type == 0x15:  # Idle
-                # On idle, make sure all keys are released
-                if self.active_keys:
-                    for key in list(self.active_keys):
-                        keyboard.release(key)
-                    self.active_keys.clear()
-                    self.pressed_buttons.clear()
+                # On idle, make sure all keys of this unit are released
+                if self.active_keys or self.pressed_mask:
+                    self.release_device(device_id)
 
             elif msg_type == 0x19:  # Status update
                 pass  # Ignore regular status updates
 
-            else:
-                hex_data = ' '.join([f"{b:02x}" for b in data])
-                logger.debug(f"Unknown message: {hex_data}")
+            elif logger.isEnabledFor(logging.DEBUG):
+                logger.debug("unknown device=%d data=%s", device_id, data.hex(' '))
 
         except Exception as e:
-            logger.error(f"Error processing notification: {e}")
+            if log_events.allow("error", logging.ERROR):
+                logger.error("notification_error device=%d error=%r", device_id, e)
 
     def parse_button_state(self, button_map: int) -> List[str]:
         """Parse button state from button map"""
         pressed_buttons = []
-        for button, mask in BUTTON_MASKS.items():
-            # Note: 0 means pressed in the protocol (like JavaScript version)
-            if (button_map & mask) == 0:
-                pressed_buttons.append(button)
+        # Note: 0 means pressed in the protocol (like JavaScript version)
+        pressed = ~button_map & ALL_BUTTONS_MASK
+        while pressed:
+            low = pressed & -pressed
+            pressed ^= low
+            pressed_buttons.append(BUTTON_NAMES_BY_BIT[low.bit_length() - 1])
         return pressed_buttons
 
-    def parse_key_press(self, buffer: bytearray) -> Dict[str, Any]:
-        """Parse a key press from protobuf format"""
-        location = None
-        analog_value = None
-        offset = 0
-
-        while offset < len(buffer):
-            tag = buffer[offset]
-            field_num = tag >> 3
-            wire_type = tag & 0x7
-            offset += 1
-
-            if field_num == 1 and wire_type == 0:  # Location
-                value = 0
-                shift = 0
-                while True:
-                    byte = buffer[offset]
-                    offset += 1
-                    value |= (byte & 0x7f) << shift
-                    if (byte & 0x80) == 0:
-                        break
-                    shift += 7
-                location = value
-
-            elif field_num == 2 and wire_type == 0:  # AnalogValue
-                value = 0
-                shift = 0
-                while True:
-                    byte = buffer[offset]
-                    offset += 1
-                    value |= (byte & 0x7f) << shift
-                    if (byte & 0x80) == 0:
-                        break
-                    shift += 7
-                # ZigZag decode for sint32
-                analog_value = (value >> 1) ^ (-(value & 1))
-
-            else:
-                # Skip unknown fields
-                if wire_type == 0:  # Varint
-                    while buffer[offset] & 0x80:
-                        offset += 1
-                    offset += 1
-                elif wire_type == 2:  # Length-delimited
-                    length = buffer[offset]
-                    offset += 1 + length
-
-        return {"location": location, "value": analog_value}
-
-    def parse_key_group(self, buffer: bytearray) -> Dict[int, int]:
-        """Parse a group of key presses"""
-        group_status = {}
-        offset = 0
-
-        while offset < len(buffer):
-            tag = buffer[offset]
-            field_num = tag >> 3
-            wire_type = tag & 0x7
-            offset += 1
-
-            if field_num == 3 and wire_type == 2:  # KeyPress message
-                length = buffer[offset]
-                offset += 1
-                message_buffer = buffer[offset:offset + length]
-                res = self.parse_key_press(message_buffer)
-
-                if res["location"] is not None:
-                    group_status[res["location"]] = res["value"]
-
-                offset += length
-
-            else:
-                # Skip unknown fields
-                if wire_type == 0:  # Varint
-                    while offset < len(buffer) and buffer[offset] & 0x80:
-                        offset += 1
-                    if offset < len(buffer):
-                        offset += 1
-                elif wire_type == 2:  # Length-delimited
-                    if offset < len(buffer):
-                        length = buffer[offset]
-                        offset += 1 + length
-
-        return group_status
-
-    def parse_analog_message(self, data: bytearray) -> Optional[Dict[str, Any]]:
+    def parse_analog_message(self, data: bytearray, offset: int = 0) -> Optional[Dict[str, Any]]:
         """Parse an analog message"""
-        if not data or data[0] != 0x1a:
+        next_index = decode_key_group(data, offset, self.analog_values)
+        if next_index < 0:
             return None
 
-        res = self.parse_key_group(data)
         return {
-            "left": res.get(0, 0),
-            "right": res.get(1, 0),
-            "next_index": len(data)  # We'd need to calculate actual next index in a more complex case
+            "left": self.analog_values[0],
+            "right": self.analog_values[1],
+            "next_index": next_index
         }
 
-    def trigger_keystrokes(self, buttons: List[str]) -> None:
-        """Trigger keystrokes based on button presses"""
-        current_time = time.time()
-        current_buttons = set(buttons)
-
-        # For buttons that were pressed before and still pressed:
-        # We need to handle possible repeats
-        for button in current_buttons & self.pressed_buttons:
-            if button in self.key_mapping:
-                last_time = self.last_press_time.get(button, 0)
-                # Check if enough time has passed for a repeat
-                if current_time - last_time >= self.repeat_delay:
-                    key = self.key_mapping[button]
-
-                    # For repeat presses, we need to release and press again to simulate repeated keypresses
-                    logger.info(f"Repeat press: {key}")
-                    if key in self.active_keys:
-                        keyboard.release(key)
-                        self.active_keys.remove(key)
-
-                    # Small delay between release and press for repeat keys
-                    time.sleep(0.01)
-                    keyboard.press(key)
-                    self.active_keys.add(key)
-                    self.last_press_time[button] = current_time
-
-        # For buttons that are newly pressed:
-        # These are buttons in current_buttons but not in self.pressed_buttons
-        for button in current_buttons - self.pressed_buttons:
-            if button in self.key_mapping:
-                key = self.key_mapping[button]
-                logger.info(f"New press: {key}")
-                keyboard.press(key)
-                self.active_keys.add(key)
-                self.last_press_time[button] = current_time
-
-        # For buttons that are released:
-        # These are buttons in self.pressed_buttons but not in current_buttons
-        for button in self.pressed_buttons - current_buttons:
-            if button in self.key_mapping:
-                key = self.key_mapping[button]
-                logger.info(f"Releasing: {key}")
-                keyboard.release(key)
-                if key in self.active_keys:
-                    self.active_keys.remove(key)
-
-        # Update the pressed buttons state
-        self.pressed_buttons = current_buttons
-
-
-async def main():
+    def trigger_keystrokes(self, pressed: int) -> None:
+        """Trigger keystrokes based on a bitmask of pressed buttons
+
+        Held keys are repeated by the repeater's timers, not here.
+        """
+        if self._suppressed:
+            # Held through a mapping swap: silent until released
+            self._suppressed &= pressed
+            pressed &= ~self._suppressed
+        previous = self.pressed_mask
+        keys = self._key_table
+        mapped = self._mapped_mask
+
+        # XOR against the previous state gives the edges
+        changed = (pressed ^ previous) & mapped
+
+        # For buttons that are newly pressed
+        edges = changed & pressed
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            bit = low.bit_length() - 1
+            key = keys[bit]
+            if log_events.allow("press"):
+                logger.info("press key=%s", key)
+            self.injector.press(key)
+            self.active_keys.add(key)
+        repeating = changed & pressed & self._repeat_mask
+        if repeating:
+            self.repeater.press(repeating, keys, self._repeat_delays, self._repeat_intervals)
+
+        # For buttons that are released
+        edges = changed & previous
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            key = keys[low.bit_length() - 1]
+            if log_events.allow("release"):
+                logger.info("release key=%s", key)
+            self.injector.release(key)
+            self.active_keys.discard(key)
+        if changed & previous:
+            self.repeater.release(changed & previous)
+
+        # Macros only start here, their steps run from loop timers
+        macros = self.macros
+        if macros is not None and (pressed ^ previous) & macros.mask:
+            macros.update(pressed, previous)
+        # Mouse buttons only set velocities, the motion comes from the mouse engine's ticks
+        mouse = self.mouse
+        if mouse is not None and (pressed ^ previous) & mouse.mask:
+            mouse.update(pressed, previous)
+
+        # Update the pressed buttons state, before the gestures as they may swap the mapping
+        self.pressed_mask = pressed
+        gestures = self.gestures
+        if gestures is not None and (pressed ^ previous) & gestures.mask:
+            gestures.update(pressed)
+
+        # All edges of this notification go out together
+        self.injector.flush()
+
+
+async def report_periodically(analyzer: Any, interval: float) -> None:
+    """Print the analyzer's rolling report every interval seconds"""
+    while True:
+        await asyncio.sleep(interval)
+        print(analyzer.report(), end="\n\n")
+
+
+async def main(record_path: Optional[str] = None, output_name: str = "keyboard", left_only: bool = False,
+               latency: bool = False, analyze: bool = False, paddles: str = "off",
+               paddle_deadzone: float = DEFAULT_DEADZONE, paddle_curve: float = DEFAULT_CURVE,
+               repeat_delay: Optional[float] = None, repeat_interval: Optional[float] = None,
+               reload_mapping: bool = True, follow_focus: bool = False, mouse_output: Optional[str] = None):
     """Main function to run the controller"""
-    controller = ZwiftRideController()
+    device_ids = (LEFT_DEVICE_ID,) if left_only else (LEFT_DEVICE_ID, RIGHT_DEVICE_ID)
+    controller = ZwiftRideController(key_output=create_key_output(output_name), device_ids=device_ids)
+    if repeat_delay is not None:
+        controller.repeat_delay = repeat_delay
+    if repeat_interval is not None:
+        controller.repeat_interval = repeat_interval
+    if latency:
+        controller.enable_latency()
+
+    recorder = None
+    if record_path:
+        from replay import NotificationRecorder
+        recorder = NotificationRecorder(record_path)
+        controller.taps.append(recorder)
+
+    reporter = None
+    if analyze:
+        from analyzer import NotificationAnalyzer
+        analyzer = NotificationAnalyzer()
+        controller.taps.append(analyzer)
+        reporter = asyncio.ensure_future(report_periodically(analyzer, ANALYZER_REPORT_INTERVAL))
+
+    if mouse_output == "uinput" and not sys.platform.startswith("linux"):
+        raise ValueError("The uinput mouse is only available on Linux")
+    if mouse_output:
+        controller.enable_mouse(MOUSE_OUTPUTS[mouse_output]())
 
     # Optionally load custom key mapping from a file
     try:
-        controller.load_key_mapping("key_mapping.json")
+        controller.load_key_mapping(KEY_MAPPING_FILE)
     except:
         logger.info("Using default key mapping")
+    # Back on the profile of the last run
+    controller.load_active_profile(ACTIVE_PROFILE_FILE)
+    if controller.mouse is None and any(compiled.mouse_table for compiled in controller.profiles.compiled):
+        logger.warning("The key mapping has mouse actions, they need --mouse")
+
+    watcher = None
+    if reload_mapping:
+        from watcher import FileWatcher
+        watcher = asyncio.ensure_future(
+            FileWatcher(KEY_MAPPING_FILE, lambda: controller.reload_key_mapping(KEY_MAPPING_FILE)).run())
+
+    focus = None
+    if follow_focus:
+        focus = asyncio.ensure_future(FocusMonitor(controller.focus_window).run())
+
+    if paddles == "axis":
+        if not sys.platform.startswith("linux"):
+            raise ValueError("The paddle joystick is only available on Linux")
+        controller.paddles = PaddleAxes(controller.injector, UinputJoystick(),
+                                        deadzone=paddle_deadzone, curve=paddle_curve)
+    elif paddles == "keys":
+        # Bound to the keys of the current profile, and rebound by every swap
+        compiled = controller.profiles.compiled[controller.profile]
+        if not any(mapping.paddle_keys for mapping in controller.profiles.compiled):
+            logger.warning(f"No keys mapped to {' or '.join(PADDLE_NAMES)}, the paddles won't press anything")
+        controller.paddles = PaddleKeys(controller.injector, dict(compiled.paddle_keys), deadzone=paddle_deadzone,
+                                        curve=paddle_curve)
+    elif paddles == "mouse":
+        if controller.mouse is None:
+            raise ValueError("Moving the mouse with the paddles needs --mouse")
+        compiled = controller.profiles.compiled[controller.profile]
+        if not any(mapping.paddle_actions for mapping in controller.profiles.compiled):
+            logger.warning(f"No mouse actions mapped to {' or '.join(PADDLE_NAMES)}, the paddles won't move anything")
+        controller.paddles = PaddleMouse(controller.mouse, dict(compiled.paddle_actions), deadzone=paddle_deadzone,
+                                         curve=paddle_curve)
+
+    # Connect straight to the last units if we know them
+    controller.load_device_cache(DEVICE_CACHE_FILE)
 
     try:
-        # Keep attempting to connect if needed
-        connected = False
-        max_attempts = 3
-        attempts = 0
-
-        while not connected and attempts < max_attempts:
-            attempts += 1
-            logger.info(f"Connection attempt {attempts}/{max_attempts}")
-
-            if await controller.scan_for_device():
-                if await controller.connect():
-                    connected = True
-                    logger.info("Connected to left controller and listening for input. Press Ctrl+C to exit.")
-
-                    try:
-                        # Keep the program running
-                        while True:
-                            await asyncio.sleep(1)
-                    except KeyboardInterrupt:
-                        logger.info("Interrupted by user")
-                    finally:
-                        await controller.disconnect()
-
-            if not connected and attempts < max_attempts:
-                logger.info(f"Failed to connect. Retrying in 5 seconds...")
-                await asyncio.sleep(5)
-
-        if not connected:
-            logger.error(f"Failed to connect after {max_attempts} attempts.")
+        # Runs until interrupted, reconnecting whenever a unit drops out
+        await controller.run()
+
+    except asyncio.CancelledError:
+        logger.info("Interrupted by user")
 
     except Exception as e:
         logger.error(f"Error: {e}")
 
+    finally:
+        await controller.disconnect()
+        if watcher:
+            watcher.cancel()
+        if focus:
+            focus.cancel()
+        if reporter:
+            reporter.cancel()
+        if recorder:
+            recorder.close()
+        controller.injector.output.close()
+        if controller.paddles:
+            controller.paddles.close()
+        if controller.mouse:
+            controller.mouse.close()
+        if controller.button_frames:
+            logger.info(f"Button frames: {controller.button_frames}, {controller.unchanged_frames} with unchanged "
+                        f"buttons short-circuited ({controller.identical_frames} identical to the previous frame)")
+        if controller.gestures:
+            logger.info("Gestures: " + ", ".join(f"{gesture}={count}" for gesture, count in controller.gestures.counts.items()))
+        if controller.macros:
+            logger.info("Macros: " + ", ".join(f"{name}={count}" for name, count in controller.macros.counts.items()))
+        if controller.mouse and controller.mouse.ticks:
+            logger.info(f"Mouse: {controller.mouse.ticks} ticks, moved {controller.mouse.moved[0]},"
+                        f"{controller.mouse.moved[1]} px, scrolled {controller.mouse.moved[2]},"
+                        f"{controller.mouse.moved[3]} notches")
+        if controller.latency:
+            print(controller.latency.report())
+        if log_events.suppressed:
+            # Shown at WARNING too when errors were dropped
+            logger.log(logging.WARNING if "error" in log_events.suppressed else logging.INFO,
+                       "Log events suppressed by rate limiting: "
+                       + ", ".join(f"{event}={count}" for event, count in log_events.suppressed.items()))
+
 
 if __name__ == "__main__":
     # Save the default mapping as an example
     #with open("key_mapping.json", "w") as f:
     #    json.dump(DEFAULT_KEY_MAPPING, f, indent=4)
 
-    print("Starting Zwift Ride Controller (automatically connecting to LEFT controller)...")
+    parser = argparse.ArgumentParser(description="Map Zwift Ride buttons to keystrokes")
+    parser.add_argument("--record", metavar="FILE", help="append every raw notification to FILE for replay.py")
+    parser.add_argument("--output", choices=sorted(KEY_OUTPUTS), default="keyboard",
+                        help="key output backend (uinput: batched virtual keyboard, Linux only)")
+    parser.add_argument("--left-only", action="store_true", help="only connect the left unit")
+    parser.add_argument("--log-level", default="INFO", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="log level (WARNING keeps logging off the notification path)")
+    parser.add_argument("--latency", action="store_true",
+                        help="measure notification-to-keypress latency per stage and print it on exit")
+    parser.add_argument("--analyze", action="store_true",
+                        help="print notification timing (jitter, drops, connection interval) every few seconds")
+    parser.add_argument("--no-reload", action="store_true",
+                        help="don't reload key_mapping.json when it changes")
+    parser.add_argument("--follow-focus", action="store_true",
+                        help="switch to the profile of the focused window, see window_profiles (X11 only)")
+    parser.add_argument("--repeat-delay", type=float, help="seconds a button is held before its key repeats")
+    parser.add_argument("--repeat-interval", type=float, help="seconds between repeats of a held button's key")
+    parser.add_argument("--mouse", choices=sorted(MOUSE_OUTPUTS),
+                        help="mouse output backend for move, click and scroll actions (uinput: Linux only, "
+                             "mouse: needs pip install mouse)")
+    parser.add_argument("--paddles", choices=["off", "axis", "keys", "mouse"], default="off",
+                        help="analog paddles as joystick axes (Linux only), as the keys mapped to PADDLE_L/PADDLE_R, "
+                             "or as their mouse actions")
+    parser.add_argument("--paddle-deadzone", type=float, default=DEFAULT_DEADZONE,
+                        help="share of the paddle travel that is ignored around the center")
+    parser.add_argument("--paddle-curve", type=float, default=DEFAULT_CURVE,
+                        help="response curve exponent, above 1 for finer control near the center")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(getattr(logging, args.log_level))
+
+    print("Starting Zwift Ride Controller (automatically connecting to the LEFT and RIGHT controllers)...")
     print("Default key mapping saved to key_mapping.json")
     print("Press Ctrl+C to exit")
 
-    asyncio.run(main())
\ No newline at end of file
+    try:
+        asyncio.run(main(args.record, args.output, args.left_only, args.latency, args.analyze,
+                         args.paddles, args.paddle_deadzone, args.paddle_curve,
+                         args.repeat_delay, args.repeat_interval, not args.no_reload, args.follow_focus,
+                         args.mouse))
+    finally:
+        log_listener.stop()
\ No newline at end of file
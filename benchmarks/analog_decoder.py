@@ -0,0 +1,163 @@
+"""In-place KeyGroup decoder against the original slicing parser, with a fuzz check
+
+Run from the repository root:
+
+    python -m benchmarks.analog_decoder [frames]
+"""
+import random
+import sys
+import time
+
+import app
+
+FUZZ_ROUNDS = 50_000
+
+
+class SlicingParser:
+    """The original parser, trimmed to the fields used here: slices at every level and returns dicts"""
+
+    def parse_key_press(self, buffer):
+        location = None
+        analog_value = None
+        offset = 0
+        while offset < len(buffer):
+            tag = buffer[offset]
+            field_num = tag >> 3
+            wire_type = tag & 0x7
+            offset += 1
+            if wire_type == 0:
+                value = 0
+                shift = 0
+                while True:
+                    byte = buffer[offset]
+                    offset += 1
+                    value |= (byte & 0x7f) << shift
+                    if (byte & 0x80) == 0:
+                        break
+                    shift += 7
+                if field_num == 1:
+                    location = value
+                elif field_num == 2:
+                    analog_value = (value >> 1) ^ (-(value & 1))
+            elif wire_type == 2:
+                length = buffer[offset]
+                offset += 1 + length
+        return {"location": location, "value": analog_value}
+
+    def parse_key_group(self, buffer):
+        group_status = {}
+        offset = 0
+        while offset < len(buffer):
+            tag = buffer[offset]
+            offset += 1
+            if tag == 0x1a:
+                length = buffer[offset]
+                offset += 1
+                res = self.parse_key_press(buffer[offset:offset + length])
+                if res["location"] is not None:
+                    group_status[res["location"]] = res["value"]
+                offset += length
+            else:
+                break
+        return group_status
+
+    def parse_frame(self, data):
+        start_index = 7
+        result = None
+        while start_index < len(data):
+            if data[start_index] != 0x1a:
+                break
+            res = self.parse_key_group(data[start_index:])
+            result = {"left": res.get(0, 0), "right": res.get(1, 0)}
+            start_index = len(data)
+        return result
+
+
+def zigzag(value):
+    return (value << 1) ^ (value >> 31)
+
+
+def varint(value):
+    out = bytearray()
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return out
+
+
+def key_group(location, value):
+    press = b"\x08" + varint(location) + b"\x10" + varint(zigzag(value))
+    return b"\x1a" + varint(len(press)) + press
+
+
+def analog_frame(left, right):
+    return bytearray([0x23, 0x08, 0xff, 0xff, 0xff, 0xff, 0x0f]) + key_group(0, left) + key_group(1, right)
+
+
+def decode_frame(data, slots):
+    offset = 7
+    while offset < len(data):
+        offset = app.decode_key_group(data, offset, slots)
+        if offset < 0:
+            break
+
+
+def fuzz(rng):
+    """Valid frames must decode like the original parser, garbage must never raise"""
+    slots = [0] * app.ANALOG_SLOTS
+    for _ in range(FUZZ_ROUNDS):
+        left = rng.randint(-100, 100)
+        right = rng.randint(-100, 100)
+        decode_frame(analog_frame(left, right), slots)
+        assert slots[0] == left and slots[1] == right, (left, right, slots)
+
+        # Multi-byte length varint: a KeyPress padded with a skipped length-delimited field
+        padding = bytes(rng.randrange(256) for _ in range(rng.randint(120, 300)))
+        press = b"\x08\x01\x10" + varint(zigzag(right)) + b"\x22" + varint(len(padding)) + padding
+        data = bytearray(b"\x1a") + varint(len(press)) + press
+        assert app.decode_key_group(data, 0, slots) == len(data)
+        assert slots[1] == right
+
+        garbage = bytearray(rng.randrange(256) for _ in range(rng.randint(0, 40)))
+        if garbage:
+            garbage[0] = 0x1a
+        next_index = app.decode_key_group(garbage, 0, slots)
+        assert next_index == -1 or 0 < next_index <= len(garbage)
+        decode_frame(analog_frame(left, right)[:rng.randint(0, 20)], slots)
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    rng = random.Random(1)
+    fuzz(rng)
+    print(f"fuzz:       {FUZZ_ROUNDS} rounds passed")
+
+    frames = [analog_frame(rng.randint(-100, 100), rng.randint(-100, 100)) for _ in range(1024)]
+    loops = total // len(frames)
+
+    parser = SlicingParser()
+    start = time.perf_counter()
+    for _ in range(loops):
+        for data in frames:
+            parser.parse_frame(data)
+    old = (time.perf_counter() - start) / (loops * len(frames))
+
+    slots = [0] * app.ANALOG_SLOTS
+    start = time.perf_counter()
+    for _ in range(loops):
+        for data in frames:
+            decode_frame(data, slots)
+    new = (time.perf_counter() - start) / (loops * len(frames))
+
+    print(f"frames:     {loops * len(frames)}")
+    print(f"slicing:    {old * 1e9:8.0f} ns/frame")
+    print(f"in place:   {new * 1e9:8.0f} ns/frame")
+    print(f"speedup:    {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
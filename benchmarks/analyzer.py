@@ -0,0 +1,106 @@
+"""Notification analyzer: statistics of a synthetic log with known faults, and the cost per notification
+
+The log has the left unit sending button frames every LEFT_INTERVAL with frames dropped,
+duplicated within one connection event and repeated one interval later, and the right
+unit sending them every RIGHT_INTERVAL without faults, plus a response that isn't
+analyzed. analyze_log() has to report exactly the frames, repeats, duplicates and missing
+frames put in, and the connection interval of each unit. Run from the repository root:
+
+    python -m benchmarks.analyzer [notifications]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import app
+from analyzer import NotificationAnalyzer, analyze_log
+from replay import CHARACTERISTICS, LOG_MAGIC, RECORD_HEADER
+from simulator import button_frame
+
+LEFT = app.LEFT_DEVICE_ID
+RIGHT = app.RIGHT_DEVICE_ID
+LEFT_INTERVAL = 10_000_000
+RIGHT_INTERVAL = 15_000_000
+FRAMES = 1000
+# Left frames sent twice in one connection event, or again one interval later with the same payload
+DUPLICATED = range(105, 600, 50)
+REPEATED = range(700, 800, 20)
+# Left frames never sent
+DROPPED = (*range(300, 303), *range(850, 855))
+
+
+def frame(n):
+    """A different payload from the previous frame's"""
+    return bytes(button_frame(1 << (n % 8)))
+
+
+def synthetic_log():
+    """(timestamp_ns, device ID, characteristic index, data) in time order"""
+    records = [(0, LEFT, CHARACTERISTICS.index(app.RESPONSE_CHAR_UUID), b"RideOn")]
+    for n in range(FRAMES):
+        if n not in DROPPED:
+            data = frame(n - 1) if n in REPEATED else frame(n)
+            records.append((1_000_000 + n * LEFT_INTERVAL, LEFT, 0, data))
+            if n in DUPLICATED:
+                records.append((1_000_000 + n * LEFT_INTERVAL + 500_000, LEFT, 0, data))
+        records.append((2_000_000 + n * RIGHT_INTERVAL, RIGHT, 0, frame(n)))
+    records.sort()
+    return records
+
+
+def write_log(path, records):
+    with open(path, "wb") as f:
+        f.write(LOG_MAGIC)
+        for timestamp, device_id, index, data in records:
+            f.write(RECORD_HEADER.pack(timestamp, device_id, index, len(data)))
+            f.write(data)
+
+
+def check_statistics(analyzer):
+    failures = []
+    expected = {
+        LEFT: (FRAMES - len(DROPPED) + len(DUPLICATED), len(DUPLICATED) + len(REPEATED), len(DUPLICATED),
+               len(DROPPED), LEFT_INTERVAL),
+        RIGHT: (FRAMES, 0, 0, 0, RIGHT_INTERVAL),
+    }
+    if set(analyzer.streams) != {(LEFT, 0x23), (RIGHT, 0x23)}:
+        failures.append(f"streams {sorted(analyzer.streams)}, expected the button frames of both units")
+    for device_id, (count, repeats, duplicates, missing, interval) in expected.items():
+        stream = analyzer.streams.get((device_id, 0x23))
+        if stream is None:
+            continue
+        found = (stream.count, stream.repeats, stream.duplicates, stream.missing, stream.typical)
+        if found != (count, repeats, duplicates, missing, interval):
+            failures.append(f"unit {device_id}: (count, repeats, duplicates, missing, typical ns) {found}, "
+                            f"expected {(count, repeats, duplicates, missing, interval)}")
+        connection_interval = analyzer.connection_interval_ms(device_id)
+        if connection_interval != interval / 1e6:
+            failures.append(f"unit {device_id}: connection interval {connection_interval} ms, expected {interval / 1e6}")
+    return failures
+
+
+def measure(count):
+    analyzer = NotificationAnalyzer()
+    frames = [frame(n) for n in range(8)]
+    start = time.perf_counter_ns()
+    for n in range(count):
+        analyzer.observe(n * LEFT_INTERVAL, LEFT, frames[n % 8])
+    cost = (time.perf_counter_ns() - start) / count
+    print(f"observe:           {cost:8.0f} ns/notification")
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.zrl")
+        write_log(path, synthetic_log())
+        # One report, at the end of the log
+        failures = check_statistics(analyze_log(path, every=3600))
+    measure(count)
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    main()
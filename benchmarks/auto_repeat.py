@@ -0,0 +1,150 @@
+"""Auto-repeat timing: deadlines against a fake clock, then jitter on a real loop
+
+The fake clock fires every timer late by a random amount, with an occasional long stall,
+and checks that:
+
+    repeats land on press + delay + k * interval, with no drift from the lateness
+    a stall skips the missed repeats instead of sending them in a burst
+    per-button timing from the key mapping is applied, and timing that isn't a number refused
+    a release stops the repeats, and no timer is left once the armed one has run
+    keys of a chord each keep their own timing
+
+The real-loop part holds a button on a simulated unit that goes quiet after the press,
+while the other unit streams frames, and reports how late each repeat reached the key
+output (after the REPEAT_GAP between the release and the new press). Run from the
+repository root:
+
+    python -m benchmarks.auto_repeat [seconds held]
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+import app
+from benchmarks.fakes import FakeClock, NullKeyOutput, RecordingInjector, TimestampingKeyOutput
+from simulator import SimulatedRide, button_frame
+
+# Repeats may not land further than this from their deadline (fake clock, in seconds)
+DEADLINE_TOLERANCE = 1e-9
+
+
+def check_invalid_timing():
+    """Bad timing has to be refused when the mapping is loaded, not on the first press with the key down"""
+    failures = []
+    for bad in ({"key": "up", "repeat_delay": "x"}, {"key": "up", "repeat_delay": -1},
+                {"key": "up", "repeat_interval": "0.1"}, {"key": "up", "repeat_interval": app.REPEAT_GAP},
+                {"key": "up", "repeat": "no"}):
+        try:
+            app.compile_profiles({"UP_BTN": bad}, 0.5, 0.1)
+        except ValueError:
+            continue
+        failures.append(f"invalid repeat timing {bad!r} was accepted")
+    return failures
+
+
+def check_fake_clock(seconds):
+    failures = []
+    up = app.BUTTON_MASKS["UP_BTN"]
+    enter = app.BUTTON_MASKS["ONOFF_R_BTN"]
+    controller = app.ZwiftRideController(key_output=NullKeyOutput())
+    controller.injector = injector = RecordingInjector()
+    controller.repeater.injector = injector
+    clock = controller.repeater.clock = FakeClock(random.Random(1))
+    mapping = dict(app.DEFAULT_KEY_MAPPING)
+    mapping["DOWN_BTN"] = {"key": "down", "repeat_delay": 0.5, "repeat_interval": 0.05}
+    mapping["ONOFF_R_BTN"] = {"key": "enter", "repeat": False}
+    controller.key_mapping = mapping
+
+    # UP with the default timing
+    controller.notification_handler(0, button_frame(up | enter))
+    clock.advance(seconds)
+    delay, interval = controller.repeat_delay, controller.repeat_interval
+    drift = max(abs((deadline - delay) / interval - round((deadline - delay) / interval)) * interval
+                for deadline, _ in clock.fired)
+    if drift > DEADLINE_TOLERANCE:
+        failures.append(f"repeats drifted {drift * 1000:.3f} ms off their deadlines")
+    deadlines = [deadline for deadline, _ in clock.fired]
+    gaps = [b - a for a, b in zip(deadlines, deadlines[1:])]
+    bursts = sum(gap < interval - DEADLINE_TOLERANCE for gap in gaps)
+    if bursts:
+        failures.append(f"{bursts} repeats came less than an interval after the previous one")
+    skipped = sum(round(gap / interval) - 1 for gap in gaps)
+    if injector.repeats.count("enter"):
+        failures.append("the button without repeat repeated")
+    lateness = [(fired - deadline) * 1000 for deadline, fired in clock.fired]
+    print(f"fake clock, {seconds:.0f} s held: {len(deadlines)} repeats, {skipped} skipped after stalls, "
+          f"max lateness {max(lateness):.1f} ms")
+
+    # A release stops the repeats; the armed timer runs once more and isn't re-armed
+    controller.notification_handler(0, button_frame(0))
+    count = len(injector.repeats)
+    clock.advance(clock.now + 5)
+    if len(injector.repeats) != count or clock.pending():
+        failures.append("repeats went on after the release")
+
+    # DOWN with its own timing from the key mapping
+    clock.fired.clear()
+    pressed_at = clock.now
+    controller.notification_handler(0, button_frame(app.BUTTON_MASKS["DOWN_BTN"]))
+    clock.advance(pressed_at + 1.0)
+    first = clock.fired[0][0] - pressed_at
+    if abs(first - 0.5) > DEADLINE_TOLERANCE:
+        failures.append(f"DOWN_BTN repeated after {first:.3f} s instead of 0.5 s")
+    controller.release_all_keys()
+
+    # UP and DOWN held together, each on its own timing, fired on time
+    injector.repeats.clear()
+    pressed_at = clock.now
+    controller.notification_handler(0, button_frame(up | app.BUTTON_MASKS["DOWN_BTN"]))
+    clock.advance(pressed_at + 10.0 + 1e-6, jitter=False)
+    counts = (injector.repeats.count("up"), injector.repeats.count("down"))
+    expected = (int((10.0 - delay) / interval) + 1, int((10.0 - 0.5) / 0.05) + 1)
+    if counts != expected:
+        failures.append(f"chord repeated (up, down) {counts} times instead of {expected}")
+    controller.release_all_keys()
+    return failures
+
+
+async def measure_real_loop(seconds):
+    ride = SimulatedRide(button_rate=1000, seed=1)
+    # Monotonic, like the loop
+    output = TimestampingKeyOutput(clock=time.monotonic)
+    controller = app.ZwiftRideController(key_output=output)
+    ride.install(controller)
+    await controller.reconnect()
+
+    # The left unit goes quiet right after the press; the right one keeps streaming
+    left = controller.sessions[app.LEFT_DEVICE_ID]
+    ride.units[app.LEFT_DEVICE_ID].stop_streaming()
+    await asyncio.sleep(0.05)
+    pressed_at = time.monotonic()
+    left.client.notify(app.MEASUREMENT_CHAR_UUID, button_frame(app.BUTTON_MASKS["UP_BTN"]))
+    await asyncio.sleep(seconds)
+    await controller.disconnect()
+
+    delay, interval = controller.repeat_delay, controller.repeat_interval
+    # The first press is the button itself, every later one a repeat, pressed again
+    # REPEAT_GAP after its deadline
+    repeats = output.press_times[1:]
+    lateness = [(at - (pressed_at + delay + k * interval + app.REPEAT_GAP)) * 1000 for k, at in enumerate(repeats)]
+    print(f"real loop, {seconds:.0f} s held on a quiet unit: {len(repeats)} repeats "
+          f"(expected {int((seconds - delay) / interval) + 1})")
+    if lateness:
+        print(f"  lateness: p50 {statistics.median(lateness):.2f} ms, max {max(lateness):.2f} ms")
+    return [] if repeats else ["no repeats while the unit was quiet"]
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    failures = check_invalid_timing()
+    failures += check_fake_clock(600)
+    failures += asyncio.run(measure_real_loop(seconds))
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
@@ -0,0 +1,104 @@
+"""Compiled button-mask decoder against the original dict walk
+
+Run from the repository root:
+
+    python -m benchmarks.button_decoder [frames]
+"""
+import random
+import sys
+import time
+
+import app
+from benchmarks.fakes import NullInjector
+
+UNIQUE_FRAMES = 4096
+
+
+class DictWalkController(app.ZwiftRideController):
+    """The original decoder: a dict walk, a list of names and set differences per frame"""
+
+    def __init__(self):
+        super().__init__()
+        self.pressed_buttons = set()
+        self.last_press_by_name = {}
+
+    def parse_button_state(self, button_map):
+        pressed_buttons = []
+        for button, mask in app.BUTTON_MASKS.items():
+            if (button_map & mask) == 0:
+                pressed_buttons.append(button)
+        return pressed_buttons
+
+    def trigger_keystrokes(self, buttons):
+        current_time = time.time()
+        current_buttons = set(buttons)
+        for button in current_buttons & self.pressed_buttons:
+            if button in self.key_mapping:
+                if current_time - self.last_press_by_name.get(button, 0) >= self.repeat_delay:
+                    key = self.key_mapping[button]
+                    self.injector.repeat(key)
+                    self.active_keys.add(key)
+                    self.last_press_by_name[button] = current_time
+        for button in current_buttons - self.pressed_buttons:
+            if button in self.key_mapping:
+                key = self.key_mapping[button]
+                self.injector.press(key)
+                self.active_keys.add(key)
+                self.last_press_by_name[button] = current_time
+        for button in self.pressed_buttons - current_buttons:
+            if button in self.key_mapping:
+                key = self.key_mapping[button]
+                self.injector.release(key)
+                self.active_keys.discard(key)
+        self.pressed_buttons = current_buttons
+
+    def decode(self, data):
+        button_map = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
+        self.trigger_keystrokes(self.parse_button_state(button_map))
+
+
+class CompiledController(app.ZwiftRideController):
+    def decode(self, data):
+        button_map = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
+        self.trigger_keystrokes(~button_map & app.ALL_BUTTONS_MASK)
+
+
+def synthetic_frames(count):
+    """Frames where each one toggles one or two random buttons, like real riding"""
+    rng = random.Random(1)
+    masks = list(app.BUTTON_MASKS.values())
+    button_map = 0xFFFFFFFF
+    frames = []
+    for _ in range(count):
+        for mask in rng.sample(masks, rng.choice((1, 1, 2))):
+            button_map ^= mask
+        frames.append(bytearray([0x23, 0x08]) + button_map.to_bytes(4, "little"))
+    return frames
+
+
+def run(controller_class, frames, total):
+    controller = controller_class()
+    controller.injector = NullInjector()
+    decode = controller.decode
+    loops = total // len(frames)
+    start = time.perf_counter()
+    for _ in range(loops):
+        for data in frames:
+            decode(data)
+    return (time.perf_counter() - start) / (loops * len(frames))
+
+
+def main():
+    total = int(sys.argv[1]) if len(sys.argv) > 1 else 2_000_000
+    app.logger.disabled = True
+    frames = synthetic_frames(UNIQUE_FRAMES)
+    old = run(DictWalkController, frames, total)
+    new = run(CompiledController, frames, total)
+    print(f"frames:     {total}")
+    print(f"dict walk:  {old * 1e9:8.0f} ns/frame")
+    print(f"compiled:   {new * 1e9:8.0f} ns/frame")
+    print(f"speedup:    {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
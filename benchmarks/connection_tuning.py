@@ -0,0 +1,134 @@
+"""Press-to-keypress latency at the default and the tuned connection interval
+
+A simulated unit streams its buttons BUTTON_RATE times a second, through a client with
+a WinRT-style backend that only delivers notifications at connection events, like a
+real link: 45 ms apart by default, 15 ms once throughput-optimized parameters are
+requested. Buttons are pressed at random moments and the time until the key output
+sees the press is measured. Run from the repository root:
+
+    python -m benchmarks.connection_tuning [presses]
+"""
+import asyncio
+import functools
+import random
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+import app
+import connection_tuning
+from key_output import KeyOutput
+from simulator import SimulatedClient, SimulatedRide
+
+DEFAULT_INTERVAL_UNITS = 36  # 45 ms
+TUNED_INTERVAL_UNITS = 12  # 15 ms
+THROUGHPUT_OPTIMIZED = object()
+BUTTON_RATE = 1000
+
+
+class FakeBluetoothLEDevice:
+    def __init__(self):
+        self.interval_units = DEFAULT_INTERVAL_UNITS
+
+    def request_preferred_connection_parameters(self, preset):
+        if preset is THROUGHPUT_OPTIMIZED:
+            self.interval_units = TUNED_INTERVAL_UNITS
+        return SimpleNamespace(status=0)
+
+    def get_connection_parameters(self):
+        return SimpleNamespace(connection_interval=self.interval_units, connection_latency=0, link_timeout=200)
+
+
+class ConnectionEventClient(SimulatedClient):
+    """Simulated client with a WinRT-style backend, delivering notifications only at connection events"""
+
+    def __init__(self, ride, address_or_device, disconnected_callback=None):
+        super().__init__(ride, address_or_device, disconnected_callback)
+        self.device = FakeBluetoothLEDevice()
+        self._backend = SimpleNamespace(_requester=self.device)
+        # Notifications waiting for the next connection event
+        self._queued = []
+        self._events = None
+
+    async def connect(self, **kwargs):
+        await super().connect(**kwargs)
+        self._events = asyncio.ensure_future(self._connection_events())
+        return True
+
+    def _lose_link(self):
+        if self._events is not None:
+            self._events.cancel()
+        super()._lose_link()
+
+    def notify(self, uuid, frame):
+        self._queued.append((uuid, frame))
+
+    async def _connection_events(self):
+        loop = asyncio.get_running_loop()
+        next_event = loop.time()
+        while True:
+            next_event += self.device.interval_units * connection_tuning.WINRT_INTERVAL_UNIT_MS / 1000
+            await asyncio.sleep(next_event - loop.time())
+            queued, self._queued = self._queued, []
+            for uuid, frame in queued:
+                super().notify(uuid, frame)
+
+
+class PressTimes(KeyOutput):
+    def __init__(self):
+        self.pressed = asyncio.Event()
+        self.loop = None
+
+    def press(self, key):
+        self.loop.call_soon_threadsafe(self.pressed.set)
+
+    def release(self, key):
+        pass
+
+
+async def measure(tune, presses):
+    # Without a preset to request, tuning only reads back the default parameters
+    connection_tuning._winrt_low_latency_preset = lambda: THROUGHPUT_OPTIMIZED if tune else None
+    output = PressTimes()
+    output.loop = asyncio.get_running_loop()
+    controller = app.ZwiftRideController(key_output=output, device_ids=(app.LEFT_DEVICE_ID,))
+    # Connecting takes no time, so the setup time is the handshake and the tuning
+    ride = SimulatedRide(device_ids=(app.LEFT_DEVICE_ID,), button_rate=BUTTON_RATE, connect_time=0, seed=1)
+    unit = ride.units[app.LEFT_DEVICE_ID]
+    controller.client_class = functools.partial(ConnectionEventClient, ride)
+    session = controller.sessions[app.LEFT_DEVICE_ID]
+    session.last_address = unit.address
+
+    start = time.perf_counter()
+    await controller.reconnect()
+    setup_ms = (time.perf_counter() - start) * 1000
+
+    latencies = []
+    for _ in range(presses):
+        await asyncio.sleep(random.uniform(0.01, 0.05))
+        output.pressed.clear()
+        pressed_at = time.perf_counter()
+        unit.pressed = app.BUTTON_MASKS["LEFT_BTN"]
+        await output.pressed.wait()
+        latencies.append((time.perf_counter() - pressed_at) * 1000)
+        unit.pressed = 0
+        await asyncio.sleep(0.1)
+
+    await controller.disconnect()
+    return session.connection_parameters, setup_ms, latencies
+
+
+async def run(presses):
+    for tune in (False, True):
+        params, setup_ms, latencies = await measure(tune, presses)
+        label = "tuned" if tune else "default"
+        print(f"{label:8} {params}")
+        print(f"{'':8} connect {setup_ms:.2f} ms, press to keypress mean {statistics.mean(latencies):.1f} ms, "
+              f"max {max(latencies):.1f} ms")
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    random.seed(1)
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 30))
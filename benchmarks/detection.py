@@ -0,0 +1,71 @@
+"""Time from the left controller's first advertisement to scan_for_device returning,
+and from a link drop to the session supervisor waking up
+
+Scans for a simulated Ride, so it runs without Bluetooth. Both units advertise, only
+the left one is looked for. Run from the repository root:
+
+    python -m benchmarks.detection [rounds]
+"""
+import asyncio
+import functools
+import statistics
+import sys
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from simulator import SimulatedRide, SimulatedScanner
+
+TARGET_MS = 10.0
+ADVERTISING_INTERVAL = 0.05
+
+
+class TimedScanner(SimulatedScanner):
+    """Simulated scanner noting when the left unit last advertised"""
+
+    left_seen_at = 0.0
+
+    def __init__(self, ride, detection_callback, service_uuids=None):
+        super().__init__(ride, self._detected, service_uuids)
+        self.left_address = ride.units[app.LEFT_DEVICE_ID].address
+        self.callback = detection_callback
+
+    def _detected(self, device, adv):
+        if device.address == self.left_address:
+            TimedScanner.left_seen_at = time.perf_counter()
+        self.callback(device, adv)
+
+
+async def time_to_detect(controller):
+    assert await controller.scan_for_device()
+    return (time.perf_counter() - TimedScanner.left_seen_at) * 1000
+
+
+async def time_to_wake(controller):
+    session = controller.sessions[app.LEFT_DEVICE_ID]
+    session.disconnected = asyncio.Event()
+    waiter = asyncio.ensure_future(session.wait_disconnected())
+    await asyncio.sleep(0)
+    dropped_at = time.perf_counter()
+    session._on_disconnect(None)
+    await waiter
+    return (time.perf_counter() - dropped_at) * 1000
+
+
+async def run(rounds):
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput(), device_ids=(app.LEFT_DEVICE_ID,))
+    ride = SimulatedRide(advertising_interval=ADVERTISING_INTERVAL)
+    controller.scanner_class = functools.partial(TimedScanner, ride)
+    detect = [await time_to_detect(controller) for _ in range(rounds)]
+    wake = [await time_to_wake(controller) for _ in range(rounds)]
+
+    for label, samples in (("time to detect", detect), ("time to wake", wake)):
+        p99 = statistics.quantiles(samples, n=100)[98]
+        print(f"{label}: p50 {statistics.median(samples):.3f} ms, p99 {p99:.3f} ms, max {max(samples):.3f} ms")
+        if max(samples) >= TARGET_MS:
+            sys.exit(f"{label} exceeded {TARGET_MS} ms")
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
@@ -0,0 +1,73 @@
+"""Cost of 0x23 frames that repeat the previous button map, with and without the short-circuit
+
+The full path is forced by forgetting the last frame and button map before every frame. Both
+paths must produce the same key events. Run from the repository root:
+
+    python -m benchmarks.duplicate_frames [frames]
+"""
+import random
+import sys
+import time
+
+import app
+from benchmarks.fakes import RecordingInjector
+from key_output import RecordingKeyOutput
+from simulator import button_frame
+
+# Frames per button map on average: the Ride re-sends its state far more often than it changes
+RUN_LENGTH = 20
+
+
+def frames_with_duplicates(count, rng):
+    """Runs of repeated frames; in some runs the paddle moves while the buttons stay the same"""
+    buttons = list(app.BUTTON_MASKS.values())
+    frames = []
+    while len(frames) < count:
+        pressed = sum(rng.sample(buttons, rng.randint(0, 2)))
+        moving = rng.random() < 0.2
+        for _ in range(rng.randint(1, 2 * RUN_LENGTH)):
+            # Fresh buffers, as every BLE notification brings its own
+            frames.append(button_frame(pressed, {0: rng.randint(-100, 100) if moving else 0}))
+    return frames[:count]
+
+
+def run(frames, short_circuit):
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput())
+    # Without a running loop nothing repeats, so the events don't depend on how fast each path runs
+    controller.injector = RecordingInjector()
+    handler = controller.notification_handler
+    last_frame = controller.last_frame
+    last_button_map = controller.last_button_map
+    start = time.perf_counter_ns()
+    if short_circuit:
+        for data in frames:
+            handler(0, data)
+    else:
+        for data in frames:
+            last_frame.clear()
+            last_button_map.clear()
+            handler(0, data)
+    elapsed = (time.perf_counter_ns() - start) / len(frames)
+    return elapsed, controller
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    frames = frames_with_duplicates(count, random.Random(1))
+    full, full_controller = min((run(frames, False) for _ in range(3)), key=lambda r: r[0])
+    fast, fast_controller = min((run(frames, True) for _ in range(3)), key=lambda r: r[0])
+    if fast_controller.injector.events != full_controller.injector.events:
+        sys.exit("The short-circuit changed the key events")
+    if fast_controller.analog_values != full_controller.analog_values:
+        sys.exit("The short-circuit changed the analog values")
+    print(f"frames:            {count}")
+    print(f"short-circuited:   {fast_controller.unchanged_frames} ({fast_controller.unchanged_frames / count:.0%}), "
+          f"{fast_controller.identical_frames} identical frames")
+    print(f"full path:         {full:8.0f} ns/frame")
+    print(f"short-circuit:     {fast:8.0f} ns/frame")
+    print(f"speedup:           {full / fast:8.2f}x")
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
@@ -0,0 +1,140 @@
+"""Test doubles shared by the benchmarks
+
+Stand-ins for the key injector, the key output and the event loop's clock. For the BLE
+side, use simulator.SimulatedRide: it plays the units, their scanner and their client.
+"""
+import heapq
+import time
+
+from key_output import KeyOutput
+
+# Lateness FakeClock.advance() fires timers with: up to LATENESS, and STALL more on a
+# STALL_CHANCE share of them
+LATENESS = 0.005
+STALL = 0.35
+STALL_CHANCE = 0.02
+
+
+class NullInjector:
+    """Key injector that drops every event"""
+
+    def press(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+    def repeat(self, key):
+        pass
+
+    def flush(self):
+        pass
+
+    def call(self, fn):
+        pass
+
+
+class RecordingInjector:
+    """Key injector that keeps every event and runs calls at once, instead of on a thread
+
+    Presses and releases go to events as (pressed, key), like RecordingKeyOutput, and
+    repeats to repeats.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.repeats = []
+
+    def press(self, key):
+        self.events.append((True, key))
+
+    def release(self, key):
+        self.events.append((False, key))
+
+    def repeat(self, key):
+        self.repeats.append(key)
+
+    def flush(self):
+        pass
+
+    def call(self, fn):
+        fn()
+
+
+class NullKeyOutput(KeyOutput):
+    """Key output that drops every event"""
+
+    def press(self, key):
+        pass
+
+    def release(self, key):
+        pass
+
+
+class TimestampingKeyOutput(KeyOutput):
+    """Key output that timestamps every press, or only those of key if given
+
+    clock is time.perf_counter_ns unless given; time.monotonic compares with the loop's time.
+    """
+
+    def __init__(self, key=None, clock=time.perf_counter_ns):
+        self.key = key
+        self.clock = clock
+        self.press_times = []
+
+    def press(self, key):
+        if self.key is None or key == self.key:
+            self.press_times.append(self.clock())
+
+    def release(self, key):
+        pass
+
+
+class FakeHandle:
+    def __init__(self, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return self.when < other.when
+
+
+class FakeClock:
+    """time() and call_at() like an event loop, with timers fired late on purpose by advance()"""
+
+    def __init__(self, rng):
+        self.now = 0.0
+        self.rng = rng
+        self._timers = []
+        # (deadline, fired at) of every timer that ran
+        self.fired = []
+
+    def time(self):
+        return self.now
+
+    def call_at(self, when, callback, *args):
+        handle = FakeHandle(when, callback, args)
+        heapq.heappush(self._timers, handle)
+        return handle
+
+    def advance(self, until, jitter=True):
+        """Run every timer due before until, each fired late by a random amount unless jitter is False"""
+        while self._timers and self._timers[0].when <= until:
+            handle = heapq.heappop(self._timers)
+            if handle.cancelled:
+                continue
+            late = self.rng.uniform(0, LATENESS) if jitter else 0.0
+            if jitter and self.rng.random() < STALL_CHANCE:
+                late += STALL
+            self.now = max(self.now, handle.when + late)
+            self.fired.append((handle.when, self.now))
+            handle.callback(*handle.args)
+        self.now = max(self.now, until)
+
+    def pending(self):
+        return sum(not handle.cancelled for handle in self._timers)
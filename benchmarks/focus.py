@@ -0,0 +1,150 @@
+"""Profiles following the focused window, through a stub focus source
+
+Window rules are checked for class and title matches, case, and order. Then a simulated
+Ride streams frames with Y_BTN pressed and released while the stub moves the focus
+between applications, and the check is that:
+
+    each focus change switches to its window's profile, once, and Y_BTN sends its key
+    a window no rule matches leaves the profile alone
+    a key mapping reload applies the rules to the focused window again
+    the monitor only wakes up for focus changes, never for notifications
+
+It reports how long a focus change took to reach the controller and the switch itself.
+Run from the repository root:
+
+    python -m benchmarks.focus
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import app
+from focus import FocusMonitor, StubFocusSource, Window, compile_window_rules, match_window
+from key_output import RecordingKeyOutput
+from simulator import SimulatedRide
+
+Y = app.BUTTON_MASKS["Y_BTN"]
+NAMES = ["MyWhoosh", "Zwift", "Browser"]
+RULES = [
+    {"class": "mywhoosh", "profile": "MyWhoosh"},
+    {"class": "firefox", "title": "zwift", "profile": "Zwift"},
+    {"class": "zwift", "profile": "Zwift"},
+    {"title": "- Mozilla Firefox", "profile": "Browser"},
+]
+SOURCE = {
+    "profiles": {name: {"Y_BTN": key} for name, key in zip(NAMES, ("f1", "f2", "f3"))},
+    "window_profiles": RULES,
+}
+# (window, profile it should select)
+FOCUS_CHANGES = [
+    (Window("MyWhoosh", "MyWhoosh"), "MyWhoosh"),
+    (Window("ZwiftApp", "Zwift"), "Zwift"),
+    (Window("firefox", "News - Mozilla Firefox"), "Browser"),
+    (Window("firefox", "Zwift Companion - Mozilla Firefox"), "Zwift"),
+    (Window("xterm", "bash"), "Zwift"),
+    (Window("MyWhoosh", "MyWhoosh"), "MyWhoosh"),
+    (Window("firefox", "Maps - Mozilla Firefox"), "Browser"),
+]
+# Time on each window, and frames per second per unit
+DWELL = 0.3
+BUTTON_RATE = 500
+
+
+def check_rules():
+    failures = []
+    rules = compile_window_rules(RULES, NAMES)
+    for window, profile in FOCUS_CHANGES[:4]:
+        index = match_window(rules, window)
+        if index is None or NAMES[index] != profile:
+            failures.append(f"{window} matched {index}, expected {profile}")
+    if match_window(rules, Window("xterm", "bash")) is not None:
+        failures.append("a window without a rule matched one")
+    for bad in ([{"class": "x", "profile": "Nope"}], [{"profile": "Zwift"}], {"class": "x"}):
+        try:
+            compile_window_rules(bad, NAMES)
+        except ValueError:
+            continue
+        failures.append(f"invalid rules {bad!r} were accepted")
+    return failures
+
+
+async def check_live():
+    failures = []
+
+    def toggle_y(unit, n):
+        # Pressed for 40 ms out of every 80 on the left unit
+        unit.pressed = Y if unit.device_id == app.LEFT_DEVICE_ID and n // 20 % 2 == 0 else 0
+
+    ride = SimulatedRide(button_rate=BUTTON_RATE, script=toggle_y, seed=1)
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_mapping=SOURCE, key_output=output)
+    ride.install(controller)
+    await controller.reconnect()
+
+    # When each switch happened, and how long it took
+    switched = []
+    switch_profile = controller.switch_profile
+
+    def timed_switch_profile(index, save=True):
+        start = time.perf_counter()
+        switch_profile(index, save)
+        switched.append((start, time.perf_counter() - start))
+
+    controller.switch_profile = timed_switch_profile
+    source = StubFocusSource()
+    monitor = FocusMonitor(controller.focus_window, source)
+    task = asyncio.ensure_future(monitor.run())
+
+    delays = []
+    frames_before = controller.button_frames
+    profile_changes = 0
+    for window, profile in FOCUS_CHANGES:
+        count = len(switched)
+        profile_changes += profile != controller.profile_name
+        output.events.clear()
+        focused = time.perf_counter()
+        source.focus(*window)
+        await asyncio.sleep(DWELL)
+        if controller.profile_name != profile:
+            failures.append(f"{window} left the profile on {controller.profile_name}, expected {profile}")
+        if len(switched) > count:
+            delays.append(switched[count][0] - focused)
+        key = SOURCE["profiles"][profile]["Y_BTN"]
+        pressed = {k for down, k in output.events if down}
+        if pressed != {key}:
+            failures.append(f"Y_BTN on {window} pressed {sorted(pressed)}, expected {key}")
+    frames = controller.button_frames - frames_before
+
+    if len(switched) != profile_changes:
+        failures.append(f"{len(switched)} profile switches for {profile_changes} changes of profile")
+    if monitor.changes != len(FOCUS_CHANGES) or source.delivered != len(FOCUS_CHANGES):
+        failures.append(f"the monitor woke up {monitor.changes} times for {len(FOCUS_CHANGES)} focus changes")
+
+    # After a switch by hand, a reload goes back to the focused window's profile
+    controller.run_command("next_profile")
+    controller.key_mapping = SOURCE
+    if controller.profile_name != FOCUS_CHANGES[-1][1]:
+        failures.append(f"a reload went to {controller.profile_name}, expected {FOCUS_CHANGES[-1][1]}")
+
+    task.cancel()
+    await controller.disconnect()
+    switch_times = [duration for _, duration in switched]
+    print(f"focus changes {len(FOCUS_CHANGES)}, profile switches {len(switched)}, "
+          f"button frames meanwhile {frames}, monitor wake-ups {monitor.changes}")
+    print(f"focus to switch p50 {statistics.median(delays) * 1e6:6.0f} us, max {max(delays) * 1e6:6.0f} us")
+    print(f"switch          p50 {statistics.median(switch_times) * 1e6:6.0f} us, "
+          f"max {max(switch_times) * 1e6:6.0f} us")
+    return failures
+
+
+def main():
+    failures = check_rules()
+    failures += asyncio.run(check_live())
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
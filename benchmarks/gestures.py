@@ -0,0 +1,202 @@
+"""Gesture engine: expected keys per gesture, determinism, and cost per event
+
+Scripted button streams with timestamps check each gesture's keys. A long random stream
+is then played twice, once with the deadlines handled only when the next event arrives
+and once with expire() called at random times in between, as a loop timer would: both
+must give the same keys. Last, a long press on a simulated unit that goes quiet after the
+press has to come out from the engine's loop timer alone. Given a recording from app.py --record, its button frames are
+played through the engine at their recorded times instead. Run from the repository root:
+
+    python -m benchmarks.gestures [ride.zrl]
+"""
+import asyncio
+import random
+import sys
+import time
+
+import app
+from benchmarks.fakes import RecordingInjector
+from gestures import GestureEngine, compile_gesture_table
+from key_output import RecordingKeyOutput
+from replay import read_log
+from simulator import SimulatedRide, button_frame
+
+MAPPING = {
+    "A_BTN": {"tap": "a", "double_tap": "b", "long_press": ["ctrl", "a"]},
+    "B_BTN": {"tap": "x"},
+    "Y_BTN": {"tap": "y", "hold": "shift"},
+    "SHFT_UP_L_BTN": "w",
+    "SHFT_UP_R_BTN": "k",
+    "SHFT_UP_L_BTN+SHFT_UP_R_BTN": "tab",
+    "ONOFF_L_BTN+ONOFF_R_BTN": ["ctrl", "s"],
+}
+
+A = app.BUTTON_MASKS["A_BTN"]
+B = app.BUTTON_MASKS["B_BTN"]
+Y = app.BUTTON_MASKS["Y_BTN"]
+UP_L = app.BUTTON_MASKS["SHFT_UP_L_BTN"]
+UP_R = app.BUTTON_MASKS["SHFT_UP_R_BTN"]
+ONOFF = app.BUTTON_MASKS["ONOFF_L_BTN"] | app.BUTTON_MASKS["ONOFF_R_BTN"]
+
+
+def tap(*keys):
+    events = []
+    for key in keys:
+        events += [(True, key), (False, key)]
+    return events
+
+
+# (name, [(time, pressed buttons)], keys expected)
+SCENARIOS = [
+    ("tap", [(0.0, A), (0.1, 0), (1.0, 0)], tap("a")),
+    ("double tap", [(0.0, A), (0.1, 0), (0.2, A), (0.3, 0), (1.0, 0)], tap("b")),
+    ("too slow for a double tap", [(0.0, A), (0.1, 0), (0.5, A), (0.6, 0), (2.0, 0)], tap("a") + tap("a")),
+    ("long press", [(0.0, A), (0.7, 0), (2.0, 0)], tap("ctrl", "a")),
+    ("tap only, on press", [(0.0, B), (0.01, 0)], tap("x")),
+    ("hold", [(0.0, Y), (0.6, Y), (0.9, 0)], [(True, "shift"), (False, "shift")]),
+    ("short hold is a tap", [(0.0, Y), (0.2, 0)], tap("y")),
+    ("chord", [(0.0, UP_L), (0.02, UP_L | UP_R), (0.5, UP_R), (0.6, 0)], [(True, "tab"), (False, "tab")]),
+    ("chord button alone", [(0.0, UP_L), (0.3, 0)], [(True, "w"), (False, "w")]),
+    ("chord button tapped quickly", [(0.0, UP_R), (0.01, 0)], [(True, "k"), (False, "k")]),
+    ("chord too slow", [(0.0, UP_L), (0.1, UP_L | UP_R), (0.2, 0)],
+     [(True, "w"), (True, "k"), (False, "w"), (False, "k")]),
+    ("chord holding a combination", [(0.0, ONOFF), (0.1, 0)],
+     [(True, "ctrl"), (True, "s"), (False, "s"), (False, "ctrl")]),
+    ("chord while tapping", [(0.0, A), (0.01, A | UP_L), (0.02, A | UP_L | UP_R), (0.05, UP_L | UP_R), (0.1, 0),
+                             (1.0, 0)],
+     [(True, "tab"), (False, "tab")] + tap("a")),
+]
+
+
+def make_engine():
+    injector = RecordingInjector()
+    return GestureEngine(compile_gesture_table(MAPPING, app.BUTTON_MASKS), injector), injector
+
+
+def check_scenarios():
+    failures = []
+    for name, stream, expected in SCENARIOS:
+        engine, injector = make_engine()
+        for at, pressed in stream:
+            engine.update(pressed, at)
+        if injector.events != expected:
+            failures.append(f"{name}: {injector.events}, expected {expected}")
+    return failures
+
+
+def check_invalid_times():
+    failures = []
+    for bad in ({"tap": "a", "long_press_time": "1"}, {"tap": "a", "double_tap_time": -0.1},
+                {"tap": "a", "double_tap_time": True}):
+        try:
+            compile_gesture_table({"A_BTN": bad}, app.BUTTON_MASKS)
+        except ValueError:
+            continue
+        failures.append(f"invalid gesture times {bad!r} were accepted")
+    return failures
+
+
+def random_stream(count, rng):
+    """Presses and releases of the gesture buttons, at human and faster than human speeds"""
+    buttons = [A, B, Y, UP_L, UP_R, *app.BUTTON_MASKS.values()]
+    stream = []
+    at = 0.0
+    pressed = 0
+    for _ in range(count):
+        at += rng.choice((0.005, 0.02, 0.05, 0.2, 0.4, 0.8)) * rng.random()
+        pressed ^= rng.choice(buttons)
+        stream.append((at, pressed))
+    return stream
+
+
+def check_determinism(stream, rng):
+    engine, events_only = make_engine()
+    for at, pressed in stream:
+        engine.update(pressed, at)
+    engine.expire(stream[-1][0] + 10)
+
+    engine, with_timer = make_engine()
+    previous = 0.0
+    for at, pressed in stream:
+        # A timer firing at some point between the events, late or not
+        if rng.random() < 0.5:
+            engine.expire(rng.uniform(previous, at))
+        engine.update(pressed, at)
+        previous = at
+    engine.expire(stream[-1][0] + 10)
+
+    if events_only.events != with_timer.events:
+        return ["the keys depend on when deadlines were handled"]
+    engine.release_all()
+    return []
+
+
+def measure(stream):
+    engine, _ = make_engine()
+    start = time.perf_counter_ns()
+    for at, pressed in stream:
+        engine.update(pressed, at)
+    elapsed = time.perf_counter_ns() - start
+    print(f"events:        {len(stream)}")
+    print(f"per event:     {elapsed / len(stream):8.0f} ns")
+    print("gestures:      " + ", ".join(f"{gesture}={count}" for gesture, count in engine.counts.items()))
+
+
+async def check_live():
+    """Long press on a unit that sends nothing after the press, through the whole controller"""
+    ride = SimulatedRide(seed=1)
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_mapping=MAPPING, key_output=output)
+    ride.install(controller)
+    await controller.reconnect()
+    ride.units[app.LEFT_DEVICE_ID].stop_streaming()
+    await asyncio.sleep(0.05)
+    session = controller.sessions[app.LEFT_DEVICE_ID]
+    session.client.notify(app.MEASUREMENT_CHAR_UUID, button_frame(A))
+    await asyncio.sleep(0.7)
+    events = list(output.events)
+    await controller.disconnect()
+    expected = [(True, "ctrl"), (False, "ctrl"), (True, "a"), (False, "a")]
+    if events != expected:
+        return [f"live long press gave {events}, expected {expected}"]
+    return []
+
+
+def play_recording(path):
+    """Button frames of a recording through the engine, at their recorded times"""
+    engine, injector = make_engine()
+    device_pressed = {}
+    at = 0.0
+    for timestamp, device_id, char_uuid, data in read_log(path):
+        if char_uuid != app.MEASUREMENT_CHAR_UUID or data[0] != 0x23 or len(data) < 6:
+            continue
+        button_map = data[2] | (data[3] << 8) | (data[4] << 16) | (data[5] << 24)
+        device_pressed[device_id] = ~button_map & app.ALL_BUTTONS_MASK
+        pressed = 0
+        for mask in device_pressed.values():
+            pressed |= mask
+        at = timestamp / 1e9
+        engine.update(pressed, at)
+    engine.expire(at + 10)
+    print(f"{path}: {len(injector.events)} key events")
+    print("gestures:      " + ", ".join(f"{gesture}={count}" for gesture, count in engine.counts.items()))
+
+
+def main():
+    if len(sys.argv) > 1:
+        play_recording(sys.argv[1])
+        return
+    rng = random.Random(1)
+    stream = random_stream(200_000, rng)
+    failures = check_scenarios()
+    failures += check_invalid_times()
+    failures += check_determinism(stream, rng)
+    failures += asyncio.run(check_live())
+    measure(stream)
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
@@ -0,0 +1,164 @@
+"""Key mapping hot reload: time from saving key_mapping.json to the new mapping being in use
+
+A simulated Ride streams frames with UP_BTN pressed and released every 100 ms while the
+mapping file is rewritten over and over, alternating UP_BTN between two keys, both in
+place and by renaming a new file over it like most editors do. For each file watcher backend it reports:
+
+    reload      file written until the new mapping was swapped in (watcher, read, compile)
+    swap        time the swap itself held up the event loop
+    loop lag    worst delay of a 1 ms timer during the run
+
+and checks that UP_BTN's key follows the mapping without both keys ever being down
+together, that nothing is left held, and that an invalid file leaves the mapping alone.
+Run from the repository root:
+
+    python -m benchmarks.hot_reload [reloads]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from simulator import SimulatedRide
+from watcher import FileWatcher
+
+POLL_INTERVAL = 0.1
+# Time between rewrites of the file
+REWRITE_INTERVAL = 0.25
+TIMEOUT = 3.0
+
+UP = app.BUTTON_MASKS["UP_BTN"]
+
+
+def mapping_with(key):
+    mapping = dict(app.DEFAULT_KEY_MAPPING)
+    mapping["UP_BTN"] = key
+    return mapping
+
+
+def write_mapping(path, mapping, replace):
+    if replace:
+        with open(path + ".tmp", "w") as f:
+            json.dump(mapping, f)
+        os.replace(path + ".tmp", path)
+    else:
+        with open(path, "w") as f:
+            json.dump(mapping, f)
+
+
+def held_keys_problems(events):
+    """Replay key events, reporting "up" and "w" held together and keys left held"""
+    held = set()
+    problems = []
+    for pressed, key in events:
+        if pressed:
+            held.add(key)
+            if {"up", "w"} <= held and not problems:
+                problems.append("the old and the new key were held together")
+        else:
+            held.discard(key)
+    if held:
+        problems.append(f"keys left held: {sorted(held)}")
+    return problems
+
+
+async def measure_lag(stop, lags):
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(0.001)
+        lags.append(loop.time() - start - 0.001)
+
+
+async def run(backend, reloads, directory):
+    path = os.path.join(directory, f"key_mapping_{backend}.json")
+    write_mapping(path, mapping_with("up"), replace=False)
+
+    def toggle_up(unit, n):
+        # 50 frames at 500 Hz: pressed for 100 ms, then released for 100 ms
+        unit.pressed = UP if unit.device_id == app.LEFT_DEVICE_ID and n // 50 % 2 == 0 else 0
+
+    ride = SimulatedRide(button_rate=500, script=toggle_up, seed=1)
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_output=output)
+    controller.load_key_mapping(path)
+    ride.install(controller)
+    await controller.reconnect()
+
+    # Time at which each swap finished
+    swapped = []
+    swap_mapping = controller.swap_mapping
+
+    def timed_swap_mapping(key_mapping, compiled):
+        swap_mapping(key_mapping, compiled)
+        swapped.append(time.perf_counter())
+
+    controller.swap_mapping = timed_swap_mapping
+
+    watcher = FileWatcher(path, lambda: controller.reload_key_mapping(path), poll_interval=POLL_INTERVAL,
+                          use_inotify=backend == "inotify")
+    watch = asyncio.ensure_future(watcher.run())
+    await watcher.ready.wait()
+    stop = asyncio.Event()
+    lags = []
+    lag_task = asyncio.ensure_future(measure_lag(stop, lags))
+
+    failures = []
+    reload_times = []
+    swap_times = []
+    for n in range(reloads):
+        await asyncio.sleep(REWRITE_INTERVAL)
+        key = "w" if n % 2 == 0 else "up"
+        count = len(swapped)
+        written = time.perf_counter()
+        write_mapping(path, mapping_with(key), replace=n % 4 >= 2)
+        deadline = written + TIMEOUT
+        while len(swapped) == count and time.perf_counter() < deadline:
+            await asyncio.sleep(0.001)
+        if len(swapped) == count:
+            failures.append(f"{backend}: rewrite {n} wasn't picked up")
+            continue
+        reload_times.append((swapped[-1] - written) * 1000)
+        swap_times.append(controller.swap_time * 1e6)
+        if controller.key_mapping["UP_BTN"] != key:
+            failures.append(f"{backend}: rewrite {n} left UP_BTN on {controller.key_mapping['UP_BTN']}")
+
+    # A broken file keeps the current mapping
+    count = controller.mapping_reloads
+    with open(path, "w") as f:
+        f.write('{"UP_BTN": ')
+    await asyncio.sleep(POLL_INTERVAL * 3)
+    if controller.mapping_reloads != count:
+        failures.append(f"{backend}: an invalid mapping was swapped in")
+
+    stop.set()
+    await lag_task
+    watch.cancel()
+    await controller.disconnect()
+    failures += [f"{backend}: {problem}" for problem in held_keys_problems(output.events)]
+    if (True, "w") not in output.events:
+        failures.append(f"{backend}: the reloaded mapping never pressed its key")
+
+    print(f"{backend:8} reloads {len(reload_times):3}   reload p50 {statistics.median(reload_times):7.1f} ms, "
+          f"max {max(reload_times):7.1f} ms   swap p50 {statistics.median(swap_times):5.0f} us, "
+          f"max {max(swap_times):5.0f} us   loop lag max {max(lags) * 1000:5.1f} ms")
+    return failures
+
+
+async def main(reloads):
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in ("inotify", "poll"):
+            failures += await run(backend, reloads, directory)
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    asyncio.run(main(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
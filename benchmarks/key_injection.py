@@ -0,0 +1,58 @@
+"""Notification-to-keypress latency under bursty input
+
+Run from the repository root:
+
+    python -m benchmarks.key_injection
+"""
+import asyncio
+import statistics
+import time
+
+import app
+from benchmarks.fakes import TimestampingKeyOutput
+
+BURSTS = 200
+BURST_SIZE = 16
+IDLE_MAP = 0xFFFFFFFF
+
+
+def button_frame(button_map: int) -> bytearray:
+    """Build a 0x23 button status frame"""
+    return bytearray([0x23, 0x08]) + button_map.to_bytes(4, "little") + b"\x00"
+
+
+async def run():
+    sink = TimestampingKeyOutput()
+    controller = app.ZwiftRideController(key_output=sink)
+    controller.injector.start()
+
+    masks = list(app.BUTTON_MASKS.values())
+    sent = []
+    handler_ns = []
+    for _ in range(BURSTS):
+        # A burst presses and releases every button back to back, as fast as the link delivers them
+        for mask in masks[:BURST_SIZE // 2]:
+            for button_map in (IDLE_MAP & ~mask, IDLE_MAP):
+                start = time.perf_counter_ns()
+                controller.notification_handler(0, button_frame(button_map))
+                end = time.perf_counter_ns()
+                handler_ns.append(end - start)
+                if button_map != IDLE_MAP:
+                    sent.append(start)
+        await asyncio.sleep(0.005)
+
+    controller.injector.stop()
+    latencies = [(p - s) / 1000 for s, p in zip(sent, sink.press_times)]
+    handler_us = [ns / 1000 for ns in handler_ns]
+
+    print(f"events:              {len(handler_us)}")
+    print(f"callback median:     {statistics.median(handler_us):8.1f} us")
+    print(f"callback max:        {max(handler_us):8.1f} us")
+    print(f"press latency p50:   {statistics.median(latencies):8.1f} us")
+    print(f"press latency p99:   {statistics.quantiles(latencies, n=100)[98]:8.1f} us")
+    print(f"press latency max:   {max(latencies):8.1f} us")
+
+
+if __name__ == "__main__":
+    app.logger.setLevel("WARNING")
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+"""Per-notification injection cost of the uinput key output, batched against one write per key
+
+Writes to /dev/null so it runs without a uinput device. Run from the repository root:
+
+    python -m benchmarks.key_output [notifications]
+"""
+import os
+import sys
+import time
+
+from key_output import UinputKeyOutput
+
+# Edges of one notification: both shift-up buttons chorded, then released
+CHORD = (("i", 1), ("k", 1))
+RELEASE = (("i", 0), ("k", 0))
+
+
+class UnbatchedUinputKeyOutput(UinputKeyOutput):
+    """Write and SYN_REPORT every key on its own, like calling the keyboard module per key"""
+
+    def press(self, key):
+        super().press(key)
+        self.flush()
+
+    def release(self, key):
+        super().release(key)
+        self.flush()
+
+
+def run(output, notifications):
+    start = time.perf_counter()
+    for i in range(notifications):
+        for key, value in (CHORD if i % 2 == 0 else RELEASE):
+            if value:
+                output.press(key)
+            else:
+                output.release(key)
+        output.flush()
+    return (time.perf_counter() - start) / notifications
+
+
+def main():
+    notifications = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    fd = os.open(os.devnull, os.O_WRONLY)
+    try:
+        unbatched = run(UnbatchedUinputKeyOutput(fd), notifications)
+        batched = run(UinputKeyOutput(fd), notifications)
+    finally:
+        os.close(fd)
+    print(f"notifications: {notifications}")
+    print(f"per key:       {unbatched * 1e9:8.0f} ns/notification, 2 writes")
+    print(f"batched:       {batched * 1e9:8.0f} ns/notification, 1 write")
+    print(f"speedup:       {unbatched / batched:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+"""Cost of the latency instrumentation on the notification path and the injection thread
+
+The real KeyInjector drains every batch into a key output that drops it, so the time
+stamps and records of the injection thread are counted along with those of the loop.
+The cost is CPU time of the whole process, both threads included, per frame and per key
+event; the budget is per key event. Run from the repository root:
+
+    python -m benchmarks.latency_overhead [frames]
+"""
+import asyncio
+import sys
+import time
+
+import app
+from benchmarks.button_decoder import synthetic_frames
+from benchmarks.fakes import NullKeyOutput
+from key_output import RecordingKeyOutput
+from latency import OUTPUT
+
+# Per key event, as the instrumentation's budget is set
+BUDGET_NS = 1000
+
+
+async def run(frames, instrumented):
+    controller = app.ZwiftRideController(key_output=NullKeyOutput())
+    controller.injector.start()
+    if instrumented:
+        # After start(): the injection thread picks it up with the next batch
+        controller.enable_latency()
+    handler = controller.notification_handler
+    start = time.process_time_ns()
+    for data in frames:
+        handler(0, data)
+    # Drains the queue before the thread stops
+    controller.injector.stop()
+    cost = (time.process_time_ns() - start) / len(frames)
+    if instrumented and not controller.latency.counts[OUTPUT]:
+        sys.exit("the injection thread recorded no latency")
+    return cost
+
+
+async def measure(frames):
+    # Interleave the runs and keep the best of each, to keep machine noise out of the difference
+    plain = []
+    instrumented = []
+    for _ in range(5):
+        plain.append(await run(frames, False))
+        instrumented.append(await run(frames, True))
+    return min(plain), min(instrumented)
+
+
+async def key_events(frames):
+    """Key presses and releases the frames send, counted untimed"""
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_output=output)
+    controller.injector.start()
+    for data in frames:
+        controller.notification_handler(0, data)
+    controller.injector.stop()
+    return len(output.events)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    frames = synthetic_frames(count)
+    events = asyncio.run(key_events(frames)) / count
+    plain, instrumented = asyncio.run(measure(frames))
+    if (instrumented - plain) / events >= BUDGET_NS:
+        # Confirm with a second measurement, so a noisy run doesn't fail on its own
+        plain, instrumented = min((plain, instrumented), asyncio.run(measure(frames)), key=lambda p: p[1] - p[0])
+    overhead = instrumented - plain
+    print(f"frames:        {count}, {events:.2f} key events each")
+    print(f"plain:         {plain:8.0f} ns/frame")
+    print(f"instrumented:  {instrumented:8.0f} ns/frame")
+    print(f"overhead:      {overhead:8.0f} ns/frame, {overhead / events:6.0f} ns/key event")
+    if overhead / events >= BUDGET_NS:
+        sys.exit(f"instrumentation overhead above {BUDGET_NS} ns per key event")
+
+
+if __name__ == "__main__":
+    main()
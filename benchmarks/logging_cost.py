@@ -0,0 +1,58 @@
+"""notification_handler cost with logging off, on through the queue, and on written synchronously
+
+Every frame presses or releases a button, the worst case for the log. Output goes to
+/dev/null. Run from the repository root:
+
+    python -m benchmarks.logging_cost [frames]
+"""
+import logging
+import os
+import sys
+import time
+
+import app
+from benchmarks.button_decoder import synthetic_frames
+from benchmarks.fakes import NullInjector
+from key_output import RecordingKeyOutput
+
+
+def run(frames):
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput())
+    controller.injector = NullInjector()
+    handler = controller.notification_handler
+    start = time.perf_counter()
+    for data in frames:
+        handler(0, data)
+    return (time.perf_counter() - start) / len(frames)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    frames = synthetic_frames(count)
+    root = logging.getLogger()
+    devnull = open(os.devnull, "w")
+    unlimited = float("inf")
+    results = []
+
+    root.setLevel(logging.WARNING)
+    results.append(("off", run(frames)))
+
+    listener = app.setup_logging(logging.INFO)
+    listener.handlers[0].stream = devnull
+    results.append(("queue, rate limited", run(frames)))
+    app.log_events.rate = app.log_events.burst = unlimited
+    results.append(("queue, unlimited", run(frames)))
+    listener.stop()
+
+    sync_handler = logging.StreamHandler(devnull)
+    sync_handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s: %(message)s', datefmt='%H:%M:%S'))
+    root.handlers = [sync_handler]
+    results.append(("synchronous, unlimited", run(frames)))
+
+    print(f"frames: {count}")
+    for label, seconds in results:
+        print(f"{label:24} {seconds * 1e9:8.0f} ns/frame")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""Macros: the keys they send, stopping them, and what they cost the buttons pressed meanwhile
+
+Macros are run through the controller on a real loop and checked for:
+
+    typed text, with shift for capitals and symbols
+    a new press starting the macro over, and until_release stopping it on release
+    keys held by a stopped macro being released, and a mapping swap stopping every macro
+
+Then B_BTN is tapped every few milliseconds, once on its own and once while A_BTN keeps
+a 50-step macro running, and the time from each B_BTN notification to its key reaching
+the output is compared: the macro must not delay the button. Run from the repository root:
+
+    python -m benchmarks.macros [taps]
+"""
+import asyncio
+import statistics
+import sys
+import time
+
+import app
+from benchmarks.fakes import TimestampingKeyOutput
+from key_output import RecordingKeyOutput
+from macros import compile_macro
+from simulator import button_frame
+
+A = app.BUTTON_MASKS["A_BTN"]
+B = app.BUTTON_MASKS["B_BTN"]
+Y = app.BUTTON_MASKS["Y_BTN"]
+Z = app.BUTTON_MASKS["Z_BTN"]
+
+# 50 steps: taps of x with waits in between, about 100 ms in all
+LONG_MACRO = [step for _ in range(25) for step in ("x", {"wait": 0.004})]
+MAPPING = {
+    "A_BTN": {"macro": LONG_MACRO},
+    "B_BTN": "b",
+    "Y_BTN": {"macro": [{"type": "Hi!"}, "enter"]},
+    "Z_BTN": {"macro": [{"press": "shift"}, "z", {"wait": 0.05}, "z", {"wait": 0.05}, "z"], "until_release": True},
+}
+TAP_INTERVAL = 0.002
+
+
+def tap(*keys):
+    events = []
+    for key in keys:
+        events += [(True, key), (False, key)]
+    return events
+
+
+def check_compile():
+    failures = []
+    steps = compile_macro([{"wait": 0.1}, {"wait": 0.2}, {"press": "ctrl"}, "c"], "A_BTN")
+    expected = ((2, 0.1 + 0.2), (0, "ctrl"), (0, "c"), (1, "c"), (1, "ctrl"))
+    if steps != expected:
+        failures.append(f"compiled {steps}, expected {expected}")
+    for bad in ([], ["a", {"release": "b"}], [{"type": "é"}], [{"wait": -1}], [{"wait": True}],
+                [{"jump": "a"}]):
+        try:
+            compile_macro(bad, "A_BTN")
+        except ValueError:
+            continue
+        failures.append(f"invalid macro {bad!r} was accepted")
+    return failures
+
+
+async def check_keys():
+    failures = []
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_mapping=MAPPING, key_output=output)
+    controller.injector.start()
+    controller.start_timers()
+    handler = controller.notification_handler
+
+    handler(0, button_frame(Y))
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.05)
+    expected = [(True, "shift"), (True, "h"), (False, "h"), (False, "shift")] + tap("i")
+    expected += [(True, "shift"), (True, "1"), (False, "1"), (False, "shift")] + tap("enter")
+    if output.events != expected:
+        failures.append(f"typing gave {output.events}, expected {expected}")
+
+    # Released after the second z: the rest of the macro is dropped and shift let go
+    output.events.clear()
+    handler(0, button_frame(Z))
+    await asyncio.sleep(0.075)
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.1)
+    expected = [(True, "shift")] + tap("z", "z") + [(False, "shift")]
+    if output.events != expected:
+        failures.append(f"until_release gave {output.events}, expected {expected}")
+
+    # Pressed again halfway, A_BTN's macro starts over
+    output.events.clear()
+    handler(0, button_frame(A))
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.05)
+    handler(0, button_frame(A))
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.15)
+    presses = sum(1 for pressed, key in output.events if pressed and key == "x")
+    if not 25 < presses < 50 or controller.macros.counts["cancelled"] != 2:
+        failures.append(f"a restarted macro pressed x {presses} times, {controller.macros.counts}")
+
+    # A new mapping stops what's running
+    output.events.clear()
+    handler(0, button_frame(Z))
+    await asyncio.sleep(0.01)
+    controller.key_mapping = MAPPING
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.1)
+    if output.events != [(True, "shift"), (True, "z"), (False, "z"), (False, "shift")]:
+        failures.append(f"a swap during a macro gave {output.events}")
+
+    controller.injector.stop()
+    return failures
+
+
+async def measure(taps, with_macro):
+    output = TimestampingKeyOutput("b")
+    controller = app.ZwiftRideController(key_mapping=MAPPING, key_output=output)
+    controller.injector.start()
+    controller.start_timers()
+    handler = controller.notification_handler
+    sent = []
+    for n in range(taps):
+        # Keep the macro running: A_BTN again as soon as it ends
+        if with_macro and not controller.macros.running:
+            handler(0, button_frame(A), app.RIGHT_DEVICE_ID)
+            handler(0, button_frame(0), app.RIGHT_DEVICE_ID)
+        sent.append(time.perf_counter_ns())
+        handler(0, button_frame(B))
+        await asyncio.sleep(TAP_INTERVAL / 2)
+        handler(0, button_frame(0))
+        await asyncio.sleep(TAP_INTERVAL / 2)
+    await asyncio.sleep(0.01)
+    controller.release_all_keys()
+    controller.injector.stop()
+    latencies = sorted((pressed - start) / 1000 for start, pressed in zip(sent, output.press_times))
+    steps = controller.macros.counts["steps"]
+    if len(latencies) != taps:
+        return None
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.99)], steps
+
+
+async def check_delay(taps):
+    failures = []
+    alone = await measure(taps, False)
+    beside = await measure(taps, True)
+    if alone is None or beside is None:
+        return ["some B_BTN presses never reached the output"]
+    for name, (p50, p99, steps) in (("alone", alone), ("with macro", beside)):
+        print(f"B_BTN {name:11} p50 {p50:7.1f} us   p99 {p99:7.1f} us   macro key steps {steps}")
+    if beside[2] < taps // 2:
+        failures.append(f"the macro only ran {beside[2]} key steps")
+    # The loop runs one macro step at a time between notifications, which may cost a few
+    # microseconds; anything like a whole macro's worth would be milliseconds
+    if beside[0] > alone[0] + 50:
+        failures.append(f"the macro delayed B_BTN by {beside[0] - alone[0]:.1f} us at p50")
+    return failures
+
+
+def main():
+    taps = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    failures = check_compile()
+    failures += asyncio.run(check_keys())
+    failures += asyncio.run(check_delay(taps))
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
@@ -0,0 +1,198 @@
+"""Mouse actions: distances against a fake clock, then the tick rate on a real loop
+
+Against the fake clock of benchmarks.fakes, the mouse engine is checked for:
+
+    the distance of a held button, within a pixel of the integral of its accelerating speed
+    slow motion, a fraction of a pixel per tick, adding up instead of being rounded away
+    late and stalled timers, moving no further than MAX_TICK_TIME allows in one tick
+    clicks holding their mouse button, and a mapping swap letting it go
+    scroll notches, and paddle velocities
+    the timer stopping once nothing moves
+
+Then RIGHT_BTN is held on a real loop while frames come in at very different rates, and
+the ticks and distance are compared: they must not depend on the frame rate. Run from
+the repository root:
+
+    python -m benchmarks.mouse [seconds held]
+"""
+import asyncio
+import random
+import sys
+
+import app
+from analog import AXIS_MAX
+from benchmarks.fakes import FakeClock, RecordingInjector
+from pointer import (
+    MAX_TICK_TIME,
+    MouseEngine,
+    PaddleMouse,
+    RecordingMouseOutput,
+    compile_mouse_table,
+    parse_mouse_action,
+)
+from simulator import button_frame
+
+LEFT = app.BUTTON_MASKS["LEFT_BTN"]
+RIGHT = app.BUTTON_MASKS["RIGHT_BTN"]
+A = app.BUTTON_MASKS["A_BTN"]
+SHIFT_UP = app.BUTTON_MASKS["SHFT_UP_R_BTN"]
+MAPPING = {
+    "RIGHT_BTN": {"move": "right", "speed": 400, "acceleration": 3},
+    "LEFT_BTN": {"move": "left", "speed": 30, "acceleration": 0},
+    "A_BTN": {"click": "left"},
+    "SHFT_UP_R_BTN": {"scroll": "up", "speed": 8, "acceleration": 0},
+}
+PADDLE = {"move": "x", "speed": 200, "acceleration": 1}
+# Frames per second sent while RIGHT_BTN is held on the real loop
+FRAME_RATES = (10, 1000)
+
+
+def engine(clock, mapping=MAPPING):
+    output = RecordingMouseOutput()
+    mouse = MouseEngine(RecordingInjector(), output, clock)
+    mouse.set_table(compile_mouse_table(mapping, app.BUTTON_MASKS))
+    return mouse, output
+
+
+def hold(mouse, clock, mask, seconds, jitter=False):
+    start = clock.time()
+    mouse.update(mask, 0)
+    clock.advance(start + seconds, jitter)
+    mouse.update(0, mask)
+
+
+def check_compile():
+    failures = []
+    for bad in ({"A_BTN": {"move": "sideways"}}, {"A_BTN": {"click": "fourth"}}, {"A_BTN": {"move": "up", "speed": 0}},
+                {"A_BTN": {"move": "up", "speed": True}}, {"A_BTN": {"scroll": "up", "acceleration": False}},
+                {"A_BTN": {"move": "up", "key": "w"}}, {"A_BTN": {"scroll": "up", "click": "left"}}):
+        try:
+            compile_mouse_table(bad, app.BUTTON_MASKS)
+        except ValueError:
+            continue
+        failures.append(f"invalid mouse action {bad!r} was accepted")
+    try:
+        app.compile_mapping({"A_BTN": {"click": "left"}, "A_BTN+B_BTN": "x"}, 0.5, 0.1)
+        failures.append("a click in a chord was accepted")
+    except ValueError:
+        pass
+    return failures
+
+
+def check_motion():
+    failures = []
+    clock = FakeClock(random.Random(1))
+
+    # Integral of speed * (1 + acceleration * t^2) up to the last tick, which is a right Riemann
+    # sum of it at the tick rate
+    mouse, output = engine(clock)
+    hold(mouse, clock, RIGHT, 1.0)
+    moving = mouse.ticks * mouse.period
+    expected = 400 * (moving + moving ** 3)
+    slack = 400 * 3 * mouse.period
+    if not expected - 1 <= mouse.moved[0] <= expected + slack or mouse.moved[1]:
+        failures.append(f"RIGHT_BTN held 1 s moved {mouse.moved[:2]}, expected about {expected:.0f},0")
+    print(f"RIGHT_BTN 1 s: moved {mouse.moved[0]} px in {mouse.ticks} ticks, {len(output.events)} events")
+    clock.advance(clock.time() + 0.1, False)
+    if clock.pending() or mouse.ticking:
+        failures.append("the timer kept running after the release")
+
+    # 0.24 px per tick
+    mouse, output = engine(clock)
+    hold(mouse, clock, LEFT, 1.0)
+    if not -31 <= mouse.moved[0] <= -29:
+        failures.append(f"LEFT_BTN at 30 px/s for 1 s moved {mouse.moved[0]} px")
+
+    mouse, output = engine(clock)
+    hold(mouse, clock, SHIFT_UP, 1.0)
+    if not 7 <= mouse.moved[2] <= 9 or any(kind != "scroll" for kind, _, _ in output.events):
+        failures.append(f"SHFT_UP_R_BTN at 8 notches/s for 1 s scrolled {mouse.moved[2]}")
+
+    # Late timers and stalls: no tick moves further than the top speed for MAX_TICK_TIME
+    mouse, output = engine(clock)
+    hold(mouse, clock, RIGHT, 3.0, jitter=True)
+    largest = max(dx for kind, dx, _ in output.events if kind == "move")
+    if largest > 400 * 4 * MAX_TICK_TIME + 1:
+        failures.append(f"a late tick moved {largest} px at once")
+    print(f"RIGHT_BTN 3 s with late timers: {mouse.ticks} ticks, largest step {largest} px")
+    return failures
+
+
+def check_clicks_and_paddles():
+    failures = []
+    clock = FakeClock(random.Random(2))
+    mouse, output = engine(clock)
+    mouse.update(A, 0)
+    mouse.update(0, A)
+    mouse.update(A, 0)
+    mouse.set_table(compile_mouse_table(MAPPING, app.BUTTON_MASKS))
+    expected = [("press", "left", None), ("release", "left", None)] * 2
+    if output.events != expected or clock.pending():
+        failures.append(f"clicks gave {output.events}, expected {expected}")
+
+    # Full travel moves at speed * (1 + acceleration), and the timer stops when the paddle is let go
+    output.events.clear()
+    paddles = PaddleMouse(mouse, {0: parse_mouse_action(PADDLE, "PADDLE_L", paddle=True)})
+    paddles.update([100, 0])
+    clock.advance(clock.time() + 0.5, False)
+    paddles.update([-50, 0])
+    clock.advance(clock.time() + 0.5, False)
+    paddles.update([0, 0])
+    clock.advance(clock.time() + 0.1, False)
+    # -50 is halfway back, through the deadzone and curve
+    expected = 400 * 0.5 + 400 * paddles.table[-50 + 100] / AXIS_MAX * 0.5
+    if abs(mouse.moved[0] - expected) > 400 * mouse.period + 1 or clock.pending():
+        failures.append(f"the paddle moved {mouse.moved[0]} px, expected about {expected:.0f}, "
+                        f"{clock.pending()} timers left")
+    return failures
+
+
+async def hold_on_loop(frame_rate, seconds):
+    output = RecordingMouseOutput()
+    controller = app.ZwiftRideController(key_mapping=MAPPING)
+    controller.enable_mouse(output)
+    controller.injector.start()
+    controller.start_timers()
+    handler = controller.notification_handler
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    frames = 0
+    while loop.time() < end:
+        handler(0, button_frame(RIGHT))
+        frames += 1
+        await asyncio.sleep(1 / frame_rate)
+    handler(0, button_frame(0))
+    await asyncio.sleep(0.05)
+    controller.injector.stop()
+    return frames, controller.mouse.ticks, output.frames, controller.mouse.moved[0], controller.mouse.ticking
+
+
+async def check_frame_rates(seconds):
+    failures = []
+    results = {}
+    for frame_rate in FRAME_RATES:
+        frames, ticks, delivered, moved, ticking = results[frame_rate] = await hold_on_loop(frame_rate, seconds)
+        print(f"{frame_rate:5} frames/s: {frames:5} frames, {ticks} ticks, {delivered} output flushes, moved {moved} px")
+        if ticking:
+            failures.append(f"the timer kept running after the release at {frame_rate} frames/s")
+    (_, slow_ticks, _, slow_moved, _), (_, fast_ticks, _, fast_moved, _) = results.values()
+    if abs(slow_ticks - fast_ticks) > 0.1 * max(slow_ticks, fast_ticks):
+        failures.append(f"{slow_ticks} ticks at {FRAME_RATES[0]} frames/s, {fast_ticks} at {FRAME_RATES[1]}")
+    if abs(slow_moved - fast_moved) > 0.1 * max(slow_moved, fast_moved):
+        failures.append(f"moved {slow_moved} px at {FRAME_RATES[0]} frames/s, {fast_moved} at {FRAME_RATES[1]}")
+    return failures
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 1.0
+    failures = check_compile()
+    failures += check_motion()
+    failures += check_clicks_and_paddles()
+    failures += asyncio.run(check_frame_rates(seconds))
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
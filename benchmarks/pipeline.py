@@ -0,0 +1,295 @@
+"""End-to-end cost of a notification: decode, state diff and key output, per kind of frame stream
+
+Every case feeds notification_handler a pre-built stream of frames, with the real
+injector thread delivering into a null key output. Three passes per case:
+
+    throughput   frames/s from the first frame until the injector thread has drained
+    latency      p50/p99 of each notification_handler call
+    allocations  most bytes the loop side has allocated at once during a frame, freed
+                 again by its end or not: tracemalloc's peak, reset before every call
+
+The results are compared against benchmarks/pipeline_baseline.json; a case that got
+slower than the tolerances or allocates more fails the run. A p50 latency has to grow
+by a share and by a number of nanoseconds, as a share alone is noise for the cases that
+only take a few hundred. Timings are compared relative to a fixed pure-Python
+calibration loop timed next to each case, so that CPU frequency changes and slower
+machines don't read as regressions. Record new baselines with --update after a
+deliberate change. Run from the repository root:
+
+    python -m benchmarks.pipeline [--frames N] [--update]
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+
+import app
+from analog import ANALOG_MAX, PaddleAxes, UinputJoystick
+from benchmarks.fakes import NullKeyOutput
+from simulator import IDLE_FRAME, button_frame, status_frame
+
+BASELINE_FILE = os.path.join(os.path.dirname(__file__), "pipeline_baseline.json")
+
+# A case fails when throughput drops or p50 latency grows by more than this share. Loose,
+# because throughput includes the injector thread, which competes for the GIL
+SLOWDOWN_TOLERANCE = 0.4
+# ...and, for p50 latency, by more than this many nanoseconds. The cheapest cases take a few
+# hundred, where a share of it is within timer resolution and the noise of a busy machine
+LATENCY_FLOOR_NS = 300
+# ...or when it allocates more bytes per frame than this above the baseline. Objects taken
+# from the interpreter's free lists aren't traced, so the bytes vary slightly between runs;
+# one more object per frame, 32 bytes or more, is still well above this
+ALLOCATION_TOLERANCE = 8
+
+CALIBRATION_LOOPS = 200_000
+ROUNDS = 5
+# Extra runs of a case that looks slower than its baseline
+CONFIRM_RUNS = 2
+
+BUTTONS = list(app.BUTTON_MASKS.values())
+
+
+def idle_frames(count, rng):
+    """What units send while nobody touches them: empty button frames, idle and status updates"""
+    frames = []
+    for n in range(count):
+        if n % 50 == 0:
+            frames.append(status_frame(90))
+        elif n % 10 == 0:
+            frames.append(IDLE_FRAME)
+        else:
+            frames.append(button_frame(0, {0: 0}))
+    return frames
+
+
+def tap_frames(count, rng):
+    """Single-button taps: a random button pressed for one frame, then released"""
+    return [button_frame(rng.choice(BUTTONS) if n % 2 == 0 else 0, {0: 0}) for n in range(count)]
+
+
+def held_frames(count, rng):
+    """One button held throughout, in fresh buffers that repeat the same frame"""
+    return [button_frame(app.BUTTON_MASKS["UP_BTN"], {0: 0}) for _ in range(count)]
+
+
+def chord_frames(count, rng):
+    """All 16 buttons pressed and released together, every frame"""
+    return [button_frame(app.ALL_BUTTONS_MASK if n % 2 == 0 else 0, {0: 0}) for n in range(count)]
+
+
+def analog_frames(count, rng):
+    """No buttons, but every analog location moving, with values needing the longest varints"""
+    return [
+        button_frame(0, {location: rng.randint(-2 ** 31, 2 ** 31 - 1) for location in range(app.ANALOG_SLOTS)})
+        for _ in range(count)
+    ]
+
+
+def paddle_frames(count, rng):
+    """Both paddles swept through their whole travel, so nearly every frame moves an axis"""
+    return [
+        button_frame(0, {0: rng.randint(-ANALOG_MAX, ANALOG_MAX), 1: rng.randint(-ANALOG_MAX, ANALOG_MAX)})
+        for _ in range(count)
+    ]
+
+
+# name: (frame builder, paddles as joystick axes)
+CASES = {
+    "idle": (idle_frames, False),
+    "taps": (tap_frames, False),
+    "held": (held_frames, False),
+    "chords": (chord_frames, False),
+    "analog": (analog_frames, False),
+    "paddle_axes": (paddle_frames, True),
+}
+
+
+def calibrate():
+    """Nanoseconds per iteration of a fixed loop of the operations the handler is made of"""
+    table = tuple(range(32))
+    start = time.perf_counter_ns()
+    for n in range(CALIBRATION_LOOPS):
+        mask = ~n & 0x3ffff
+        low = mask & -mask
+        table[low.bit_length() - 1 if low else 0]
+    return (time.perf_counter_ns() - start) / CALIBRATION_LOOPS
+
+
+def make_controller(paddles):
+    controller = app.ZwiftRideController(key_output=NullKeyOutput())
+    # Presses arm repeat timers as in a live session, though the passes are over before any fires
+    controller.start_timers()
+    if paddles:
+        joystick = UinputJoystick(fd=os.open(os.devnull, os.O_WRONLY))
+        controller.paddles = PaddleAxes(controller.injector, joystick)
+    return controller
+
+
+def measure_throughput(frames, paddles):
+    controller = make_controller(paddles)
+    handler = controller.notification_handler
+    controller.injector.start()
+    start = time.perf_counter_ns()
+    for data in frames:
+        handler(0, data)
+    controller.release_all_keys()
+    # Joins the injector thread once it has delivered everything
+    controller.injector.stop()
+    return len(frames) * 1e9 / (time.perf_counter_ns() - start)
+
+
+def measure_latency(frames, paddles):
+    controller = make_controller(paddles)
+    handler = controller.notification_handler
+    perf_counter_ns = time.perf_counter_ns
+    samples = []
+    controller.injector.start()
+    for data in frames:
+        start = perf_counter_ns()
+        handler(0, data)
+        samples.append(perf_counter_ns() - start)
+    controller.release_all_keys()
+    controller.injector.stop()
+    percentiles = statistics.quantiles(samples, n=100)
+    return percentiles[49], percentiles[98]
+
+
+def peak_bytes(handler, frames):
+    """Sum over the frames of the peak traced memory during handler(0, frame), above that before it"""
+    get_traced_memory = tracemalloc.get_traced_memory
+    reset_peak = tracemalloc.reset_peak
+    total = 0
+    for data in frames:
+        before = get_traced_memory()[0]
+        reset_peak()
+        handler(0, data)
+        total += get_traced_memory()[1] - before
+    return total
+
+
+def null_handler(sender, data):
+    pass
+
+
+def measure_allocations(frames, paddles):
+    controller = make_controller(paddles)
+    handler = controller.notification_handler
+    # Warm up caches (interned ints, method caches) before tracing
+    for data in frames[:100]:
+        handler(0, data)
+    # Collections would free unrelated garbage in the middle of the pass
+    gc.disable()
+    tracemalloc.start()
+    # What reading the traced memory itself allocates, the same for every frame
+    probe = peak_bytes(null_handler, frames)
+    allocated = peak_bytes(handler, frames)
+    tracemalloc.stop()
+    gc.enable()
+    controller.release_all_keys()
+    controller.injector.stop()
+    return max(allocated - probe, 0) / len(frames)
+
+
+def on_loop(measure, *args):
+    """measure(*args) on a running event loop of its own, which the injector and timers start on"""
+    async def call():
+        return measure(*args)
+    return asyncio.run(call())
+
+
+def run_case(name, count, rng):
+    builder, paddles = CASES[name]
+    frames = builder(count, rng)
+    # Best of five rounds, to keep machine noise out of the comparison. Every round is
+    # calibrated on its own, so a slow stretch of the machine affects both alike
+    throughput = p50 = p99 = 0
+    relative_throughput = relative_p50 = None
+    for _ in range(ROUNDS):
+        calibration = calibrate()
+        round_throughput = on_loop(measure_throughput, frames, paddles)
+        round_p50, round_p99 = on_loop(measure_latency, frames, paddles)
+        calibration = min(calibration, calibrate())
+        if relative_throughput is None or round_throughput * calibration > relative_throughput:
+            throughput = round_throughput
+            relative_throughput = round_throughput * calibration
+        if relative_p50 is None or round_p50 / calibration < relative_p50:
+            p50, p99 = round_p50, round_p99
+            relative_p50 = round_p50 / calibration
+    allocated = on_loop(measure_allocations, frames, paddles)
+    return {"frames_per_sec": round(throughput), "p50_ns": round(p50), "p99_ns": round(p99),
+            "bytes_per_frame": round(allocated, 1),
+            # Frames per calibration loop iteration, and the p50 in calibration loop iterations
+            "relative_throughput": round(relative_throughput / 1e9, 4), "relative_p50": round(relative_p50, 2)}
+
+
+def best_of(result, other):
+    """Best throughput, p50 and allocations of two runs of a case"""
+    best = dict(result)
+    if other["relative_throughput"] > result["relative_throughput"]:
+        best.update(frames_per_sec=other["frames_per_sec"], relative_throughput=other["relative_throughput"])
+    if other["relative_p50"] < result["relative_p50"]:
+        best.update(p50_ns=other["p50_ns"], p99_ns=other["p99_ns"], relative_p50=other["relative_p50"])
+    best["bytes_per_frame"] = min(result["bytes_per_frame"], other["bytes_per_frame"])
+    return best
+
+
+def regressions(name, result, baseline):
+    failures = []
+    change = result["relative_throughput"] / baseline["relative_throughput"] - 1
+    if change < -SLOWDOWN_TOLERANCE:
+        failures.append(f"{name}: throughput {change:+.0%} against the baseline")
+    change = result["relative_p50"] / baseline["relative_p50"] - 1
+    # The change in nanoseconds of the baseline's machine
+    if change > SLOWDOWN_TOLERANCE and change * baseline["p50_ns"] > LATENCY_FLOOR_NS:
+        failures.append(f"{name}: p50 latency {change:+.0%} against the baseline")
+    if result["bytes_per_frame"] > baseline["bytes_per_frame"] + ALLOCATION_TOLERANCE:
+        failures.append(f"{name}: {result['bytes_per_frame']} bytes/frame, baseline {baseline['bytes_per_frame']}")
+    return failures
+
+
+def run(count, update):
+    baselines = {}
+    if os.path.exists(BASELINE_FILE):
+        with open(BASELINE_FILE) as f:
+            baselines = json.load(f)
+
+    print(f"{'case':14} {'frames/s':>10} {'p50 ns':>8} {'p99 ns':>8} {'bytes/frame':>12} {'baseline frames/s':>18}")
+    results = {}
+    failures = []
+    for name in CASES:
+        baseline = None if update else baselines.get(name)
+        result = run_case(name, count, random.Random(1))
+        # A slowdown has to show up in every run before it counts, so a noisy moment doesn't
+        # fail the run: a real one shows in the best of them too
+        for _ in range(CONFIRM_RUNS):
+            if not baseline or not regressions(name, result, baseline):
+                break
+            result = best_of(result, run_case(name, count, random.Random(1)))
+        results[name] = result
+        print(f"{name:14} {result['frames_per_sec']:10} {result['p50_ns']:8} {result['p99_ns']:8} "
+              f"{result['bytes_per_frame']:12.1f} {baseline['frames_per_sec'] if baseline else '-':>18}")
+        if baseline:
+            failures.extend(regressions(name, result, baseline))
+
+    if update:
+        with open(BASELINE_FILE, "w") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        print(f"Baselines written to {BASELINE_FILE}")
+    elif failures:
+        sys.exit("Regressions:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--frames", type=int, default=20_000, help="Frames per case")
+    parser.add_argument("--update", action="store_true", help="Record the results as the new baselines")
+    args = parser.parse_args()
+    app.logger.disabled = True
+    run(args.frames, args.update)
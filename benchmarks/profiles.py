@@ -0,0 +1,220 @@
+"""Mapping profiles: switching through the chord, what the switch leaves behind, and its cost
+
+A key mapping with several profiles is driven through the notification handler, and the
+ONOFF_L_BTN+ONOFF_R_BTN chord has to:
+
+    move to the next profile, wrapping around after the last one
+    release the keys held under the old profile, and keep buttons held through the switch
+    (the chord's own included) silent in the new one until they are released
+    leave the file I/O of saving the active profile to the executor, off the event loop
+    release the key of a paddle held through the switch, and press the new profile's
+    PADDLE_L key once the paddle moves; likewise for the mouse action of PADDLE_L
+
+The saved profile must be the one a new controller starts on, and a reload of the file
+must keep the active profile. Last, the switch is timed with more and more profiles, as
+it only swaps in tables compiled when the file was read. Run from the repository root:
+
+    python -m benchmarks.profiles
+"""
+import asyncio
+import builtins
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import app
+from analog import PaddleKeys
+from benchmarks.fakes import FakeClock, RecordingInjector
+from key_output import RecordingKeyOutput
+from pointer import PaddleMouse, RecordingMouseOutput
+from simulator import button_frame
+
+ONOFF_L = app.BUTTON_MASKS["ONOFF_L_BTN"]
+ONOFF_R = app.BUTTON_MASKS["ONOFF_R_BTN"]
+Y = app.BUTTON_MASKS["Y_BTN"]
+LEFT = app.LEFT_DEVICE_ID
+RIGHT = app.RIGHT_DEVICE_ID
+SWITCHES = 2000
+
+
+def profiles_source(count):
+    """count profiles, each sending its own key for Y_BTN"""
+    return {"profiles": {f"profile{n}": {"Y_BTN": f"f{n + 1}", "ONOFF_L_BTN": "enter", "ONOFF_R_BTN": "enter"}
+                         for n in range(count)}}
+
+
+def make_controller(source):
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput())
+    controller.injector = RecordingInjector()
+    # Compiled again for the recording injector
+    controller.key_mapping = source
+    return controller
+
+
+def send(controller, left, right=0):
+    controller.notification_handler(0, button_frame(left), LEFT)
+    controller.notification_handler(0, button_frame(right), RIGHT)
+
+
+def switch_with_chord(controller):
+    send(controller, ONOFF_L, ONOFF_R)
+    send(controller, 0, 0)
+
+
+def check_cycling():
+    failures = []
+    controller = make_controller(profiles_source(3))
+    events = controller.injector.events
+    for n in range(1, 7):
+        switch_with_chord(controller)
+        if events:
+            failures.append(f"switch {n} sent {events}")
+        if controller.profile_name != f"profile{n % 3}":
+            failures.append(f"switch {n} went to {controller.profile_name}, expected profile{n % 3}")
+        send(controller, Y)
+        send(controller, 0)
+        if events != [(True, f"f{n % 3 + 1}"), (False, f"f{n % 3 + 1}")]:
+            failures.append(f"Y_BTN in profile{n % 3} sent {events}")
+        events.clear()
+    return failures
+
+
+def check_held_buttons():
+    failures = []
+    controller = make_controller(profiles_source(2))
+    events = controller.injector.events
+    send(controller, Y)
+    # The chord while Y_BTN is still held, then everything released one button at a time
+    send(controller, Y | ONOFF_L, ONOFF_R)
+    send(controller, Y | ONOFF_L, 0)
+    send(controller, Y, 0)
+    send(controller, 0, 0)
+    if events != [(True, "f1"), (False, "f1")]:
+        failures.append(f"held through a switch: {events}, expected only the old key pressed and released")
+    # Pressed again after the release, the buttons act in the new profile
+    events.clear()
+    send(controller, Y)
+    send(controller, 0)
+    send(controller, ONOFF_L)
+    send(controller, 0)
+    if events != [(True, "f2"), (False, "f2"), (True, "enter"), (False, "enter")]:
+        failures.append(f"pressed again after a switch: {events}")
+    return failures
+
+
+def check_paddles():
+    failures = []
+    source = {"profiles": {"keys_a": {"PADDLE_L": "a"}, "keys_b": {"PADDLE_L": "b"}}}
+    controller = make_controller(source)
+    events = controller.injector.events
+    controller.paddles = PaddleKeys(controller.injector, dict(controller.profiles.compiled[0].paddle_keys))
+    controller.paddles.update([100, 0])
+    controller.switch_profile(1, save=False)
+    controller.paddles.update([100, 0])
+    if events != [(True, "a"), (False, "a")]:
+        failures.append(f"a paddle held through a switch: {events}, expected only the old key pressed and released")
+    controller.paddles.update([90, 0])
+    controller.paddles.update([0, 0])
+    if events[2:] != [(True, "b"), (False, "b")]:
+        failures.append(f"the paddle moved after a switch: {events[2:]}, expected the new key")
+
+    # Paddle mouse actions follow the switch at once, as a held paddle keeps moving
+    source = {"profiles": {"moves_x": {"PADDLE_L": {"move": "x"}}, "moves_y": {"PADDLE_L": {"move": "y"}}}}
+    controller = make_controller(source)
+    clock = FakeClock(random.Random(1))
+    controller.repeater.clock = clock
+    controller.enable_mouse(RecordingMouseOutput())
+    controller.paddles = PaddleMouse(controller.mouse, dict(controller.profiles.compiled[0].paddle_actions))
+    controller.paddles.update([100, 0])
+    clock.advance(0.5, False)
+    controller.key_mapping = {"profiles": {"moves_y": source["profiles"]["moves_y"]}}
+    clock.advance(1.0, False)
+    controller.paddles.update([0, 0])
+    clock.advance(1.1, False)
+    moved_x, moved_y = controller.mouse.moved[:2]
+    if not moved_x > 0 or not moved_y > 0 or clock.pending():
+        failures.append(f"a paddle held through a reload moved {moved_x},{moved_y}, expected along x then y")
+    return failures
+
+
+async def check_persistence(directory):
+    failures = []
+    path = os.path.join(directory, app.ACTIVE_PROFILE_FILE)
+    source = profiles_source(3)
+    controller = make_controller(source)
+    controller.load_active_profile(path)
+    controller.start_timers()
+
+    # Files opened on the loop's thread during the switches
+    loop_thread = threading.get_ident()
+    opened = []
+    real_open = builtins.open
+
+    def tracking_open(*args, **kwargs):
+        if threading.get_ident() == loop_thread:
+            opened.append(args[0])
+        return real_open(*args, **kwargs)
+
+    builtins.open = tracking_open
+    try:
+        switch_with_chord(controller)
+        switch_with_chord(controller)
+        await asyncio.sleep(0.1)
+    finally:
+        builtins.open = real_open
+    if opened:
+        failures.append(f"the switch opened {opened} on the event loop")
+
+    restarted = make_controller(source)
+    restarted.load_active_profile(path)
+    if restarted.profile_name != "profile2":
+        failures.append(f"a new controller started on {restarted.profile_name}, expected profile2")
+
+    # A reload with one more profile stays on the active one, a reload without it falls back to the first
+    restarted.key_mapping = profiles_source(4)
+    if restarted.profile_name != "profile2":
+        failures.append(f"a reload moved to {restarted.profile_name}, expected profile2")
+    restarted.key_mapping = profiles_source(2)
+    if restarted.profile_name != "profile0":
+        failures.append(f"a reload without the active profile went to {restarted.profile_name}, expected profile0")
+    return failures
+
+
+def measure(count):
+    source = profiles_source(count)
+    start = time.perf_counter()
+    app.compile_profiles(source, 0.2, 0.2)
+    compile_time = time.perf_counter() - start
+    controller = make_controller(source)
+    times = []
+    for _ in range(SWITCHES):
+        start = time.perf_counter_ns()
+        controller.run_command("next_profile")
+        times.append(time.perf_counter_ns() - start)
+    switch = statistics.median(times)
+    print(f"profiles {count:5}   compile {compile_time * 1000:8.2f} ms   switch p50 {switch / 1000:6.1f} us")
+    return switch
+
+
+def main():
+    failures = check_cycling()
+    failures += check_held_buttons()
+    failures += check_paddles()
+    with tempfile.TemporaryDirectory() as directory:
+        failures += asyncio.run(check_persistence(directory))
+    fewest = measure(2)
+    for count in (10, 100, 1000):
+        switch = measure(count)
+        if switch > fewest * 2:
+            failures.append(f"switching with {count} profiles took {switch / fewest:.1f}x as long as with 2")
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    main()
@@ -0,0 +1,68 @@
+"""Mean time to recover after a mid-ride dropout, with a simulated Ride
+
+The simulated unit drops the link on demand and fails a share of connection attempts,
+so both the direct reconnect and the backoff paths are exercised. A button is held
+at every dropout, and the benchmark fails if its key isn't released at once. Run
+from the repository root:
+
+    python -m benchmarks.reconnect [dropouts]
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from simulator import SimulatedRide
+
+CONNECT_TIME = 0.005
+CONNECT_JITTER = 0.015
+CONNECT_FAILURE_RATE = 0.3
+HELD = app.BUTTON_MASKS["LEFT_BTN"]
+
+
+async def wait_until(condition):
+    while not condition():
+        await asyncio.sleep(0.0005)
+
+
+async def run(dropouts):
+    ride = SimulatedRide(device_ids=(app.LEFT_DEVICE_ID,), connect_time=CONNECT_TIME, connect_jitter=CONNECT_JITTER,
+                         connect_failure_rate=CONNECT_FAILURE_RATE, seed=1)
+    unit = ride.units[app.LEFT_DEVICE_ID]
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_output=output, device_ids=(app.LEFT_DEVICE_ID,))
+    ride.install(controller)
+    supervisor = asyncio.ensure_future(controller.run())
+
+    recover = []
+    stuck = 0
+    for _ in range(dropouts):
+        await wait_until(lambda: controller.connected)
+        # Hold a button, then pull the link out from under it
+        unit.pressed = HELD
+        await wait_until(lambda: controller.active_keys)
+        dropped_at = time.perf_counter()
+        ride.drop(app.LEFT_DEVICE_ID)
+        if controller.active_keys:
+            stuck += 1
+        unit.pressed = 0
+        await wait_until(lambda: controller.connected)
+        recover.append((time.perf_counter() - dropped_at) * 1000)
+
+    supervisor.cancel()
+    await controller.disconnect()
+    print(f"dropouts:          {dropouts}")
+    print(f"mean to recover:   {statistics.mean(recover):8.1f} ms")
+    print(f"p95 to recover:    {statistics.quantiles(recover, n=20)[18]:8.1f} ms")
+    print(f"keys left held:    {stuck}")
+    if stuck:
+        sys.exit(f"{stuck} dropouts left keys held")
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    random.seed(1)
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 100))
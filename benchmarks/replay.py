@@ -0,0 +1,147 @@
+"""Recording and replay: a simulated session recorded, then played back into a new controller
+
+A simulated Ride presses a scripted set of buttons on both units while a
+NotificationRecorder taps the controller. The log has to:
+
+    hold every notification in the order it was received, with non-decreasing timestamps
+    replay into a new controller as the exact key events the live session sent
+    play back at the recorded pace at speed 1, and faster at speed 0
+    survive a record torn anywhere in its header or payload, as an interrupted recording
+    leaves it, by playing every whole record before it
+
+Run from the repository root:
+
+    python -m benchmarks.replay
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from replay import LOG_MAGIC, RECORD_HEADER, NotificationRecorder, play, read_log
+from simulator import SimulatedRide
+
+A = app.BUTTON_MASKS["A_BTN"]
+Y = app.BUTTON_MASKS["Y_BTN"]
+# No repeats, so the key events don't depend on how fast the log is played
+MAPPING = {"A_BTN": {"key": "a", "repeat": False}, "Y_BTN": {"key": "y", "repeat": False}}
+BUTTON_RATE = 200
+# Button frames the script presses buttons for, before leaving everything released
+SCRIPTED_FRAMES = 80
+# a pressed for 4 windows of the left unit's frames, y for 3 of the right unit's
+EXPECTED_PRESSES = {"a": 4, "y": 3}
+
+
+def script(unit, n):
+    if n >= SCRIPTED_FRAMES:
+        unit.pressed = 0
+    elif unit.device_id == app.LEFT_DEVICE_ID:
+        unit.pressed = A if n % 20 < 5 else 0
+    else:
+        unit.pressed = Y if 10 <= n % 30 < 15 else 0
+
+
+def make_controller():
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_output=output)
+    controller.key_mapping = MAPPING
+    return controller, output
+
+
+async def record(path):
+    ride = SimulatedRide(button_rate=BUTTON_RATE, status_rate=5, idle_rate=5, script=script, seed=1)
+    controller, output = make_controller()
+    recorder = NotificationRecorder(path)
+    controller.taps.append(recorder)
+    ride.install(controller)
+    await controller.reconnect()
+    # Long enough for the scripted frames and some idle ones after them
+    await asyncio.sleep(SCRIPTED_FRAMES / BUTTON_RATE + 0.2)
+    await controller.disconnect()
+    recorder.close()
+    return output.events
+
+
+async def replay(path, speed):
+    controller, output = make_controller()
+    controller.injector.start()
+    controller.start_timers()
+    start = time.perf_counter()
+    try:
+        count = await play(path, controller, speed)
+    finally:
+        controller.injector.stop()
+    return count, output.events, time.perf_counter() - start
+
+
+def check_log(path):
+    failures = []
+    records = list(read_log(path))
+    timestamps = [timestamp for timestamp, _, _, _ in records]
+    if timestamps != sorted(timestamps):
+        failures.append("the recorded timestamps go backwards")
+    devices = {device_id for _, device_id, char_uuid, _ in records if char_uuid == app.MEASUREMENT_CHAR_UUID}
+    if devices != {app.LEFT_DEVICE_ID, app.RIGHT_DEVICE_ID}:
+        failures.append(f"measurements recorded from devices {sorted(devices)}, expected both units")
+    print(f"recorded:          {len(records)} notifications over {(timestamps[-1] - timestamps[0]) / 1e6:.0f} ms")
+    return failures, records
+
+
+async def check_replay(path, records, live):
+    failures = []
+    presses = {key: sum(1 for pressed, k in live if pressed and k == key) for key in EXPECTED_PRESSES}
+    if presses != EXPECTED_PRESSES:
+        failures.append(f"the live session pressed {presses}, expected {EXPECTED_PRESSES}")
+    span = (records[-1][0] - records[0][0]) / 1e9
+    for speed in (1.0, 0):
+        count, events, elapsed = await replay(path, speed)
+        print(f"speed {speed:<3}:         {count} notifications in {elapsed * 1000:6.1f} ms, {len(events)} key events")
+        if count != len(records):
+            failures.append(f"speed {speed} played {count} of {len(records)} notifications")
+        if events != live:
+            failures.append(f"speed {speed} replayed {events}, the live session sent {live}")
+        if speed and not span * 0.95 <= elapsed <= span + 0.2:
+            failures.append(f"speed {speed} took {elapsed * 1000:.0f} ms to play {span * 1000:.0f} ms")
+    return failures
+
+
+async def check_truncated(path, records, directory):
+    failures = []
+    with open(path, "rb") as f:
+        data = f.read()
+    last = RECORD_HEADER.size + len(records[-1][3])
+    torn = os.path.join(directory, "torn.zrl")
+    # Cut inside the last header, then inside its payload
+    for cut in (last - 1, 1):
+        with open(torn, "wb") as f:
+            f.write(data[:-cut])
+        count, _, _ = await replay(torn, 0)
+        if count != len(records) - 1:
+            failures.append(f"a log cut {cut} bytes short played {count} notifications, expected {len(records) - 1}")
+    with open(torn, "wb") as f:
+        f.write(data[len(LOG_MAGIC):])
+    try:
+        list(read_log(torn))
+        failures.append("a log without its magic was read")
+    except ValueError:
+        pass
+    return failures
+
+
+async def main():
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "ride.zrl")
+        live = await record(path)
+        failures, records = check_log(path)
+        failures += await check_replay(path, records, live)
+        failures += await check_truncated(path, records, directory)
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    asyncio.run(main())
@@ -0,0 +1,85 @@
+"""Detection callback cost per advertisement in a crowded room
+
+Feeds synthetic advertisements (mostly other trainers and phones, a few Zwift Ride
+units advertising repeatedly) through the original per-advertisement logging callback
+and the filtering one, with logging going to /dev/null. Run from the repository root:
+
+    python -m benchmarks.scan_filter [advertisements]
+"""
+import logging
+import os
+import random
+import sys
+import time
+from types import SimpleNamespace
+
+import app
+from key_output import RecordingKeyOutput
+
+OTHER_MANUFACTURERS = (0x004C, 0x0006, 0x0075, 0x0087, 0x0103)
+
+
+def synthetic_advertisements(count):
+    rng = random.Random(1)
+    ads = []
+    for _ in range(count):
+        if rng.random() < 0.05:
+            device_id = rng.choice((app.LEFT_DEVICE_ID, app.RIGHT_DEVICE_ID, 3))
+            device = SimpleNamespace(name=app.RIDE_NAME, address=f"BB:{device_id:02X}")
+            manufacturer_data = {app.MANUFACTURER_ID: bytes([device_id, 0x13, 0x37])}
+        else:
+            i = rng.randrange(60)
+            device = SimpleNamespace(name=f"Trainer {i}" if i % 3 else None, address=f"AA:{i:02X}")
+            manufacturer_data = {rng.choice(OTHER_MANUFACTURERS): bytes(rng.randrange(256) for _ in range(8))}
+        ads.append((device, SimpleNamespace(rssi=rng.randint(-90, -40), manufacturer_data=manufacturer_data)))
+    return ads
+
+
+def original_callback(device, advertisement_data):
+    """The original detection callback, logging every Zwift advertisement"""
+    if device.name and app.RIDE_NAME in device.name:
+        app.logger.info(f"Found device: {device.name} [{device.address}]")
+        app.logger.info(f"  RSSI: {advertisement_data.rssi if hasattr(advertisement_data, 'rssi') else 'Unknown'}")
+        if hasattr(advertisement_data, 'manufacturer_data'):
+            app.logger.info(f"  Manufacturer data: {advertisement_data.manufacturer_data}")
+        if hasattr(advertisement_data, 'manufacturer_data') and advertisement_data.manufacturer_data:
+            manuf_data = advertisement_data.manufacturer_data.get(app.MANUFACTURER_ID)
+            if manuf_data is not None and len(manuf_data) >= 1:
+                app.logger.info(f"Device {device.name} [{device.address}] has device ID: {manuf_data[0]}")
+
+
+def run(callback, ads):
+    start = time.perf_counter()
+    for device, adv in ads:
+        callback(device, adv)
+    return (time.perf_counter() - start) / len(ads)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    devnull = open(os.devnull, "w")
+    logging.getLogger().handlers = [logging.StreamHandler(devnull)]
+    # app.py only sets the level when run, and both callbacks log at INFO
+    app.logger.setLevel(logging.INFO)
+    ads = synthetic_advertisements(count)
+
+    records = []
+    counter = logging.Handler()
+    counter.emit = records.append
+    app.logger.addHandler(counter)
+
+    old = run(original_callback, ads)
+    old_records = len(records)
+    records.clear()
+
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput())
+    new = run(controller._detection_callback, ads)
+
+    print(f"advertisements: {count}")
+    print(f"original:       {old * 1e9:8.0f} ns/advertisement, {old_records} log records")
+    print(f"filtered:       {new * 1e9:8.0f} ns/advertisement, {len(records)} log records")
+    print(f"speedup:        {old / new:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
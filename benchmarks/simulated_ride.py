@@ -0,0 +1,80 @@
+"""Whole-controller throughput against a simulated Ride: scan, connect, stream, disconnect
+
+Both simulated units stream random chords and paddle values at the given rate, so the
+numbers include the scanner, the handshake and the injector thread. Run from the
+repository root:
+
+    python -m benchmarks.simulated_ride [frames per second per unit] [seconds]
+"""
+import asyncio
+import sys
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from simulator import SimulatedRide
+
+# Buttons the random script holds, so every frame has some edges to decode
+SCRIPT_BUTTONS = [app.BUTTON_MASKS[name] for name in ("A_BTN", "B_BTN", "Y_BTN", "Z_BTN", "LEFT_BTN", "RIGHT_BTN", "UP_BTN", "DOWN_BTN")]
+
+
+class CountingTap:
+    """Counts the measurement frames that reach the controller"""
+
+    def __init__(self):
+        self.frames = 0
+
+    def wrap(self, char_uuid, handler, device_id):
+        if char_uuid != app.MEASUREMENT_CHAR_UUID:
+            return handler
+
+        def counted(sender, data):
+            self.frames += 1
+            handler(sender, data)
+        return counted
+
+
+def random_chords(unit, n):
+    rng = unit.ride.rng
+    # Change the chord every few frames, like a rider would, and move the paddle every frame
+    if n % 8 == 0:
+        unit.pressed = sum(rng.sample(SCRIPT_BUTTONS, rng.randint(0, 3)))
+    for location in unit.analog:
+        unit.analog[location] = rng.randint(-100, 100)
+
+
+async def run(rate, seconds):
+    ride = SimulatedRide(button_rate=rate, status_rate=1, idle_rate=1, script=random_chords, seed=1)
+    output = RecordingKeyOutput()
+    tap = CountingTap()
+    controller = app.ZwiftRideController(key_output=output)
+    controller.taps.append(tap)
+    ride.install(controller)
+
+    start = time.perf_counter()
+    await controller.reconnect()
+    connected_ms = (time.perf_counter() - start) * 1000
+
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    await asyncio.sleep(seconds)
+    cpu = time.process_time() - cpu
+    wall = time.perf_counter() - wall
+    await controller.disconnect()
+
+    sent = ride.frames_sent()
+    print(f"connected both units:  {connected_ms:8.1f} ms")
+    print(f"frames sent:           {sent:8d} ({sent / wall:,.0f}/s)")
+    print(f"frames handled:        {tap.frames:8d}")
+    print(f"key events:            {len(output.events):8d}")
+    print(f"CPU per frame:         {cpu / max(tap.frames, 1) * 1e6:8.1f} us")
+    print(f"CPU load:              {cpu / wall:8.0%}")
+    if controller.active_keys:
+        sys.exit(f"keys left held after disconnect: {sorted(controller.active_keys)}")
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    rate = float(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 5
+    asyncio.run(run(rate, seconds))
@@ -0,0 +1,98 @@
+"""Cold start to first keypress, scanning against connecting straight from the device cache
+
+Both simulated units advertise once per ADVERTISING_INTERVAL, from a random point of
+the first one, and stream a pressed button as soon as the handshake is done. They are
+set up in parallel, so the time to first keypress is also close to the time until both
+are connected.
+
+It also checks that a cache with stale GATT handles (as after a firmware update) falls
+back to a scan: the failed direct connection must not leave the unit linked to a client
+the controller dropped, which would stop it advertising. Run from the repository root:
+
+    python -m benchmarks.startup [rounds]
+"""
+import asyncio
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import app
+from key_output import RecordingKeyOutput
+from simulator import HANDLES, SimulatedRide
+
+ADVERTISING_INTERVAL = 0.1
+CONNECT_TIME = 0.02
+BUTTON_RATE = 1000
+STALE_HANDLES = {"control": 99, "measurement": 98, "response": 97}
+# Time a scan and connection may take once the stale handles failed
+STALE_TIMEOUT = 5.0
+
+
+async def start_to_first_keypress(cache_file):
+    start = time.perf_counter()
+    output = RecordingKeyOutput()
+    controller = app.ZwiftRideController(key_output=output)
+    ride = SimulatedRide(button_rate=BUTTON_RATE, advertising_interval=ADVERTISING_INTERVAL, connect_time=CONNECT_TIME)
+    for unit in ride.units.values():
+        unit.pressed = app.BUTTON_MASKS["LEFT_BTN"]
+    ride.install(controller)
+    controller.load_device_cache(cache_file)
+    await controller.reconnect()
+    while not output.events:
+        await asyncio.sleep(0.0002)
+    elapsed = (time.perf_counter() - start) * 1000
+    assert controller.connected
+    await controller.disconnect()
+    return elapsed
+
+
+async def check_stale_handles(cache_file):
+    ride = SimulatedRide(device_ids=(app.LEFT_DEVICE_ID,), seed=1)
+    unit = ride.units[app.LEFT_DEVICE_ID]
+    with open(cache_file, "w") as f:
+        json.dump({"left": {"address": unit.address, "name": app.RIDE_NAME, "device_id": app.LEFT_DEVICE_ID,
+                            "handles": STALE_HANDLES}}, f)
+    controller = app.ZwiftRideController(key_output=RecordingKeyOutput(), device_ids=(app.LEFT_DEVICE_ID,))
+    ride.install(controller)
+    controller.load_device_cache(cache_file)
+    try:
+        await asyncio.wait_for(controller.reconnect(), STALE_TIMEOUT)
+    except asyncio.TimeoutError:
+        controller.injector.stop()
+        return [f"no connection within {STALE_TIMEOUT:.0f} s of failing on stale handles "
+                f"(unit still linked: {unit.connected})"]
+    handles = controller.device_cache["left"].get("handles")
+    await controller.disconnect()
+    expected = {"control": HANDLES[app.CONTROL_CHAR_UUID],
+                "measurement": HANDLES[app.MEASUREMENT_CHAR_UUID],
+                "response": HANDLES[app.RESPONSE_CHAR_UUID]}
+    if handles != expected:
+        return [f"the cache kept handles {handles} after reconnecting, expected {expected}"]
+    return []
+
+
+async def run(rounds):
+    with tempfile.TemporaryDirectory() as tmp:
+        failures = await check_stale_handles(os.path.join(tmp, "stale_" + app.DEVICE_CACHE_FILE))
+        cache_file = os.path.join(tmp, app.DEVICE_CACHE_FILE)
+        cold = []
+        cached = []
+        for _ in range(rounds):
+            if os.path.exists(cache_file):
+                os.remove(cache_file)
+            cold.append(await start_to_first_keypress(cache_file))
+            cached.append(await start_to_first_keypress(cache_file))
+
+    print(f"advertising interval: {ADVERTISING_INTERVAL * 1000:.0f} ms, connect: {CONNECT_TIME * 1000:.0f} ms")
+    print(f"scan + connect:       {statistics.median(cold):8.1f} ms to first keypress")
+    print(f"cached address:       {statistics.median(cached):8.1f} ms to first keypress")
+    if failures:
+        sys.exit("Failures:\n  " + "\n  ".join(failures))
+
+
+if __name__ == "__main__":
+    app.logger.disabled = True
+    asyncio.run(run(int(sys.argv[1]) if len(sys.argv) > 1 else 20))
@@ -0,0 +1,93 @@
+"""Ask for a low-latency BLE connection and report what was negotiated
+
+Default connection intervals of 30-50 ms add visible lag to shifting, so after the
+RideOn handshake we ask the OS for the shortest interval it offers and the largest MTU,
+then read back what the link actually runs at. How much can be asked for depends on
+the bleak backend:
+
+    WinRT (Windows 11)   throughput-optimized connection parameters, interval read back
+    BlueZ (Linux)        MTU exchange only, the interval is chosen by the kernel
+    CoreBluetooth        nothing to request, MTU read back
+
+Everything here is best effort: a backend or OS version without an API just reports
+the values as unknown.
+"""
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# WinRT reports the interval in units of 1.25 ms and the supervision timeout in units of 10 ms
+WINRT_INTERVAL_UNIT_MS = 1.25
+WINRT_TIMEOUT_UNIT_MS = 10
+
+
+@dataclass
+class ConnectionParameters:
+    """Negotiated link parameters, None when the backend can't tell"""
+    backend: str
+    mtu: Optional[int] = None
+    interval_ms: Optional[float] = None
+    latency: Optional[int] = None
+    timeout_ms: Optional[int] = None
+    requested: bool = False
+    # WinRT drops the preference when the request object is disposed, so it lives as long as these parameters
+    request: Any = field(default=None, repr=False, compare=False)
+
+    def __str__(self) -> str:
+        def show(value: Any, unit: str = "") -> str:
+            return "unknown" if value is None else f"{value}{unit}"
+        return (f"backend={self.backend} mtu={show(self.mtu)} interval={show(self.interval_ms, 'ms')} "
+                f"latency={show(self.latency)} timeout={show(self.timeout_ms, 'ms')} requested={self.requested}")
+
+
+def _winrt_low_latency_preset() -> Any:
+    """The WinRT preset with the shortest connection interval, None if this Windows can't request one"""
+    try:
+        from winrt.windows.devices.bluetooth import BluetoothLEPreferredConnectionParameters
+    except ImportError:
+        try:
+            from bleak_winrt.windows.devices.bluetooth import BluetoothLEPreferredConnectionParameters
+        except ImportError:
+            return None
+    return getattr(BluetoothLEPreferredConnectionParameters, "throughput_optimized", None)
+
+
+async def tune_connection(client: Any) -> ConnectionParameters:
+    """Request the lowest latency connection the backend allows and read back the negotiated values"""
+    backend = getattr(client, "_backend", None)
+    params = ConnectionParameters(backend=type(backend).__name__ if backend is not None else type(client).__name__)
+
+    # BlueZ only learns the real MTU after an explicit exchange
+    acquire_mtu = getattr(backend, "_acquire_mtu", None)
+    if acquire_mtu is not None:
+        try:
+            await acquire_mtu()
+        except Exception as e:
+            logger.debug("mtu_exchange_failed error=%r", e)
+
+    try:
+        params.mtu = client.mtu_size
+    except Exception as e:
+        logger.debug("mtu_unavailable error=%r", e)
+
+    # WinRT exposes the BluetoothLEDevice, which can request and report connection parameters
+    device = getattr(backend, "_requester", None)
+    if device is not None and hasattr(device, "request_preferred_connection_parameters"):
+        preset = _winrt_low_latency_preset()
+        if preset is not None:
+            try:
+                params.request = device.request_preferred_connection_parameters(preset)
+                params.requested = True
+            except Exception as e:
+                logger.debug("connection_parameters_request_failed error=%r", e)
+        try:
+            current = device.get_connection_parameters()
+            params.interval_ms = current.connection_interval * WINRT_INTERVAL_UNIT_MS
+            params.latency = current.connection_latency
+            params.timeout_ms = current.link_timeout * WINRT_TIMEOUT_UNIT_MS
+        except Exception as e:
+            logger.debug("connection_parameters_unavailable error=%r", e)
+
+    return params
@@ -0,0 +1,288 @@
+"""Follow the focused window, to select the key mapping profile of each application
+
+On X11 the root window's _NET_ACTIVE_WINDOW property changes whenever another window gets
+the focus, and the focused window's own WM_NAME and _NET_WM_NAME whenever its title does
+(a browser switching tabs). Both are watched as PropertyNotify events read from the X
+connection through loop.add_reader, so nothing runs until the window manager changes one
+of them. libX11 is loaded with ctypes; without it, or without a display, there is nothing
+to follow.
+
+Profiles pick windows with rules in key_mapping.json, the first matching one winning:
+
+    "window_profiles": [
+        {"class": "MyWhoosh", "profile": "MyWhoosh"},
+        {"title": "Zwift", "profile": "Zwift"}
+    ]
+
+"class" and "title" match any part of the window's WM_CLASS class and of its title,
+ignoring case; a rule with both needs both. Windows no rule matches leave the profile as is.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import sys
+from typing import Any, AsyncIterator, Callable, NamedTuple, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Window(NamedTuple):
+    """Focused window: its WM_CLASS class and its title"""
+    wm_class: str
+    title: str
+
+
+class WindowRule(NamedTuple):
+    """Lowercased parts of the class and title a window needs (None for any), and its profile"""
+    wm_class: Optional[str]
+    title: Optional[str]
+    profile: int
+
+
+def compile_window_rules(rules: Any, profile_names: Sequence[str]) -> Tuple[WindowRule, ...]:
+    """Validate the window_profiles rules of a key mapping; raises ValueError if one can't be used"""
+    if not isinstance(rules, list):
+        raise ValueError(f"window_profiles must be a list of rules, got {type(rules).__name__}")
+    compiled = []
+    for rule in rules:
+        if not isinstance(rule, dict) or rule.get("profile") not in profile_names:
+            raise ValueError(f"Window rule {rule!r} must name one of the profiles: {', '.join(profile_names)}")
+        wm_class = rule.get("class")
+        title = rule.get("title")
+        if not (wm_class or title) or not all(isinstance(part, (str, type(None))) for part in (wm_class, title)):
+            raise ValueError(f"Window rule {rule!r} needs a class or a title to match")
+        compiled.append(WindowRule(wm_class.lower() if wm_class else None, title.lower() if title else None,
+                                   profile_names.index(rule["profile"])))
+    return tuple(compiled)
+
+
+def match_window(rules: Sequence[WindowRule], window: Window) -> Optional[int]:
+    """Profile of the first rule matching window, or None"""
+    wm_class = window.wm_class.lower()
+    title = window.title.lower()
+    for rule in rules:
+        if (rule.wm_class is None or rule.wm_class in wm_class) and (rule.title is None or rule.title in title):
+            return rule.profile
+    return None
+
+
+# Xlib constants (X11/X.h)
+PROPERTY_CHANGE_MASK = 1 << 22
+PROPERTY_NOTIFY = 28
+ANY_PROPERTY_TYPE = 0
+SUCCESS = 0
+
+
+class XPropertyEvent(ctypes.Structure):
+    _fields_ = [("type", ctypes.c_int), ("serial", ctypes.c_ulong), ("send_event", ctypes.c_int),
+                ("display", ctypes.c_void_p), ("window", ctypes.c_ulong), ("atom", ctypes.c_ulong),
+                ("time", ctypes.c_ulong), ("state", ctypes.c_int)]
+
+
+class XEvent(ctypes.Union):
+    _fields_ = [("type", ctypes.c_int), ("xproperty", XPropertyEvent), ("pad", ctypes.c_long * 24)]
+
+
+# Called by Xlib for protocol errors, mostly a window that closed before we read it;
+# the default handler would exit the process
+X_ERROR_HANDLER = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.c_void_p, ctypes.c_void_p)
+
+
+@X_ERROR_HANDLER
+def ignore_x_error(display, error):
+    return 0
+
+
+def load_xlib() -> Optional[Any]:
+    """libX11 with the prototypes used here, or None where it isn't available"""
+    if not sys.platform.startswith("linux"):
+        return None
+    name = ctypes.util.find_library("X11")
+    if name is None:
+        return None
+    try:
+        xlib = ctypes.CDLL(name)
+    except OSError:
+        return None
+    xlib.XOpenDisplay.restype = ctypes.c_void_p
+    xlib.XOpenDisplay.argtypes = [ctypes.c_char_p]
+    xlib.XDefaultRootWindow.restype = ctypes.c_ulong
+    xlib.XDefaultRootWindow.argtypes = [ctypes.c_void_p]
+    xlib.XInternAtom.restype = ctypes.c_ulong
+    xlib.XInternAtom.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+    xlib.XSelectInput.argtypes = [ctypes.c_void_p, ctypes.c_ulong, ctypes.c_long]
+    xlib.XConnectionNumber.argtypes = [ctypes.c_void_p]
+    xlib.XPending.argtypes = [ctypes.c_void_p]
+    xlib.XNextEvent.argtypes = [ctypes.c_void_p, ctypes.POINTER(XEvent)]
+    xlib.XFlush.argtypes = [ctypes.c_void_p]
+    xlib.XFree.argtypes = [ctypes.c_void_p]
+    xlib.XCloseDisplay.argtypes = [ctypes.c_void_p]
+    xlib.XSetErrorHandler.argtypes = [X_ERROR_HANDLER]
+    xlib.XGetWindowProperty.argtypes = [
+        ctypes.c_void_p, ctypes.c_ulong, ctypes.c_ulong, ctypes.c_long, ctypes.c_long, ctypes.c_int, ctypes.c_ulong,
+        ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_int), ctypes.POINTER(ctypes.c_ulong),
+        ctypes.POINTER(ctypes.c_ulong), ctypes.POINTER(ctypes.c_void_p)]
+    return xlib
+
+
+class X11FocusSource:
+    """Focused window of an X11 display, followed through PropertyNotify events"""
+
+    def __init__(self, xlib: Any, display: int):
+        self.xlib = xlib
+        self.display = display
+        self.root = xlib.XDefaultRootWindow(display)
+        self.active_atom = xlib.XInternAtom(display, b"_NET_ACTIVE_WINDOW", False)
+        self.title_atoms = (xlib.XInternAtom(display, b"_NET_WM_NAME", False),
+                            xlib.XInternAtom(display, b"WM_NAME", False))
+        self.class_atom = xlib.XInternAtom(display, b"WM_CLASS", False)
+        # Window whose title is watched, 0 for none
+        self.window = 0
+        xlib.XSetErrorHandler(ignore_x_error)
+        xlib.XSelectInput(display, self.root, PROPERTY_CHANGE_MASK)
+        xlib.XFlush(display)
+
+    @classmethod
+    def open(cls, display_name: Optional[str] = None) -> Optional["X11FocusSource"]:
+        """Source for display_name ($DISPLAY unless given), or None if there is no X11 display"""
+        display_name = display_name or os.environ.get("DISPLAY")
+        if not display_name:
+            return None
+        xlib = load_xlib()
+        if xlib is None:
+            return None
+        display = xlib.XOpenDisplay(display_name.encode())
+        if not display:
+            return None
+        return cls(xlib, display)
+
+    def close(self) -> None:
+        self.xlib.XCloseDisplay(self.display)
+
+    def __aiter__(self) -> AsyncIterator[Window]:
+        return self._windows()
+
+    async def _windows(self) -> AsyncIterator[Window]:
+        loop = asyncio.get_running_loop()
+        readable = asyncio.Event()
+        fd = self.xlib.XConnectionNumber(self.display)
+        loop.add_reader(fd, readable.set)
+        try:
+            window = self.focused()
+            yield window
+            while True:
+                # Events Xlib already read while waiting for replies don't make the socket readable
+                if not self.xlib.XPending(self.display):
+                    await readable.wait()
+                    readable.clear()
+                if self._focus_events():
+                    focused = self.focused()
+                    if focused != window:
+                        window = focused
+                        yield window
+        finally:
+            loop.remove_reader(fd)
+            self.close()
+
+    def _focus_events(self) -> bool:
+        """Read every pending event, telling whether the focus or the focused window's title changed"""
+        xlib = self.xlib
+        event = XEvent()
+        changed = False
+        while xlib.XPending(self.display):
+            xlib.XNextEvent(self.display, ctypes.byref(event))
+            if event.type != PROPERTY_NOTIFY:
+                continue
+            prop = event.xproperty
+            if prop.window == self.root and prop.atom == self.active_atom:
+                changed = True
+            elif prop.window == self.window and prop.atom in self.title_atoms:
+                changed = True
+        return changed
+
+    def focused(self) -> Window:
+        """The focused window, watching its title from now on"""
+        xlib = self.xlib
+        data = self._property(self.root, self.active_atom, 1)
+        window = int.from_bytes(data[:ctypes.sizeof(ctypes.c_ulong)], sys.byteorder) if data else 0
+        if window != self.window:
+            if self.window:
+                xlib.XSelectInput(self.display, self.window, 0)
+            if window:
+                xlib.XSelectInput(self.display, window, PROPERTY_CHANGE_MASK)
+            xlib.XFlush(self.display)
+            self.window = window
+        if not window:
+            return Window("", "")
+        # WM_CLASS is the instance name then the class name, each ending in a NUL
+        names = self._property(window, self.class_atom, 256).split(b"\0")
+        wm_class = names[1] if len(names) > 1 and names[1] else names[0]
+        title = self._property(window, self.title_atoms[0], 1024) or self._property(window, self.title_atoms[1], 1024)
+        return Window(wm_class.decode("utf-8", "replace"), title.decode("utf-8", "replace"))
+
+    def _property(self, window: int, atom: int, length: int) -> bytes:
+        """Raw value of a window property, up to length 32-bit units, empty if it isn't set"""
+        actual_type = ctypes.c_ulong()
+        actual_format = ctypes.c_int()
+        items = ctypes.c_ulong()
+        remaining = ctypes.c_ulong()
+        value = ctypes.c_void_p()
+        status = self.xlib.XGetWindowProperty(
+            self.display, window, atom, 0, length, False, ANY_PROPERTY_TYPE, ctypes.byref(actual_type),
+            ctypes.byref(actual_format), ctypes.byref(items), ctypes.byref(remaining), ctypes.byref(value))
+        if status != SUCCESS or not value.value:
+            return b""
+        try:
+            # Format 32 items are C longs, whatever their size
+            size = ctypes.sizeof(ctypes.c_ulong) if actual_format.value == 32 else actual_format.value // 8
+            return ctypes.string_at(value.value, items.value * size)
+        finally:
+            self.xlib.XFree(value)
+
+
+class StubFocusSource:
+    """Focus changes made by calling focus(), in place of a display for tests and benchmarks"""
+
+    def __init__(self):
+        self._windows: asyncio.Queue = asyncio.Queue()
+        # Windows handed out so far
+        self.delivered = 0
+
+    def focus(self, wm_class: str, title: str = "") -> None:
+        self._windows.put_nowait(Window(wm_class, title))
+
+    def __aiter__(self) -> AsyncIterator[Window]:
+        return self
+
+    async def __anext__(self) -> Window:
+        window = await self._windows.get()
+        self.delivered += 1
+        return window
+
+
+class FocusMonitor:
+    """Call on_focus(window) whenever another window gets the focus or the focused one is retitled"""
+
+    def __init__(self, on_focus: Callable[[Window], Any], source: Optional[Any] = None):
+        self.on_focus = on_focus
+        # Anything iterating asynchronously over Window tuples; X11FocusSource.open() unless given
+        self.source = source
+        # Last window seen, and how many focus changes came in
+        self.window: Optional[Window] = None
+        self.changes = 0
+
+    async def run(self) -> None:
+        """Follow the focus until cancelled, or return at once if there is no display to follow"""
+        source = self.source if self.source is not None else X11FocusSource.open()
+        if source is None:
+            logger.warning("No X11 display, profiles won't follow the focused window")
+            return
+        async for window in source:
+            self.window = window
+            self.changes += 1
+            try:
+                self.on_focus(window)
+            except Exception as e:
+                logger.error(f"Error handling the focus of {window}: {e}")
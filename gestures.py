@@ -0,0 +1,441 @@
+"""Button gestures: taps, double taps, long presses, holds and chords, each mapped to its own keys
+
+A key_mapping.json entry can describe gestures instead of mirroring one key:
+
+    "A_BTN": {"tap": "a", "double_tap": ["ctrl", "a"], "long_press": "f1"},
+    "Y_BTN": {"tap": "y", "hold": "shift"},
+    "SHFT_UP_L_BTN+SHFT_UP_R_BTN": "tab",
+    "ONOFF_L_BTN+ONOFF_R_BTN": {"command": "next_profile"}
+
+tap, double_tap and long_press tap their keys one after the other; hold keeps its keys
+down from the long press time until the button is released, and so does a chord (two or
+more button names joined by "+") while all of its buttons are held. Instead of keys, any
+of them can run one of the COMMANDS, through the engine's on_command callback once the
+engine is done with the event. A button used in a chord waits up to CHORD_TIME for the
+rest of the chord before acting on its own entry, a plain key included. A button that
+only has a tap acts on the press; one with a double tap waits DOUBLE_TAP_TIME after the
+release before tapping.
+
+The engine is a state machine per button driven by the timestamps it is given, so a
+recorded stream always gives the same keys. Deadlines due before an event are handled
+first, at their own time. Each event costs one pass over the buttons that changed and,
+when a chord button went down, over the chords.
+"""
+import asyncio
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+LONG_PRESS_TIME = 0.5
+DOUBLE_TAP_TIME = 0.3
+CHORD_TIME = 0.05
+
+INFINITY = float("inf")
+
+# Gesture kinds, as counted by the engine
+GESTURES = ("tap", "double_tap", "long_press", "hold", "chord")
+
+# Commands an action can run instead of pressing keys, carried out by the controller
+COMMANDS = ("next_profile", "previous_profile")
+
+# Gesture states of a button
+IDLE = 0
+# Down, not held long enough for a long press yet
+PRESSED = 1
+# Down, waiting for the rest of a chord
+CHORDING = 2
+# Released once, waiting for a second tap
+RELEASED = 3
+# Down with its keys held (a hold, a plain key, or a long press that fired)
+HELD = 4
+# Down with its gesture done (a tap on press, a double tap or a chord), until released
+DONE = 5
+
+Keys = Tuple[str, ...]
+
+
+class Command(NamedTuple):
+    """Action that runs a command instead of pressing keys"""
+    name: str
+
+
+Action = Union[Keys, Command]
+
+
+class ButtonGestures(NamedTuple):
+    """Action of each gesture of one button (None where not mapped), and its timing"""
+    tap: Optional[Action] = None
+    double_tap: Optional[Action] = None
+    long_press: Optional[Action] = None
+    hold: Optional[Action] = None
+    long_press_time: float = LONG_PRESS_TIME
+    double_tap_time: float = DOUBLE_TAP_TIME
+
+
+class GestureTable(NamedTuple):
+    """A key mapping's gestures, compiled once per mapping"""
+    # Bits handled by the engine instead of mirrored as keys
+    mask: int
+    # Gestures per bit of the button map
+    buttons: Tuple[Optional[ButtonGestures], ...]
+    # (mask, action) per chord, the ones with the most buttons first
+    chords: Tuple[Tuple[int, Action], ...]
+    # Bits used in any chord
+    chord_mask: int
+    chord_time: float = CHORD_TIME
+
+
+def is_seconds(value: Any) -> bool:
+    """Whether a key mapping value is a time: a number of seconds, not negative (and not a bool)"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value >= 0
+
+
+def parse_action(value: Any, name: str) -> Action:
+    """Action of a gesture or chord: a key name, a list of them, or {"command": name}"""
+    if isinstance(value, dict):
+        if value.get("command") not in COMMANDS:
+            raise ValueError(f"Unknown command in {name}: {value.get('command')!r}, "
+                             f"expected one of {', '.join(COMMANDS)}")
+        return Command(value["command"])
+    keys = (value,) if isinstance(value, str) else tuple(value) if isinstance(value, list) else ()
+    if not keys or not all(isinstance(key, str) and key for key in keys):
+        raise ValueError(f"Keys of {name} must be a key name or a list of key names, got {value!r}")
+    return keys
+
+
+def compile_gesture_table(key_mapping: Dict[str, Any], button_masks: Dict[str, int],
+                          chord_time: float = CHORD_TIME) -> Optional[GestureTable]:
+    """Compile the gestures and chords of a key mapping, or None if it has neither"""
+    buttons: List[Optional[ButtonGestures]] = [None] * 32
+    mask = 0
+    chords = []
+    chord_mask = 0
+
+    for name, value in key_mapping.items():
+        if "+" in name:
+            members = name.split("+")
+            unknown = [member for member in members if member not in button_masks]
+            if unknown:
+                raise ValueError(f"Unknown button {unknown[0]} in chord {name}")
+            chord = 0
+            for member in members:
+                chord |= button_masks[member]
+            if bin(chord).count("1") < 2:
+                raise ValueError(f"Chord {name} needs at least two different buttons")
+            chords.append((chord, parse_action(value, name)))
+            chord_mask |= chord
+        elif isinstance(value, dict) and any(gesture in value for gesture in GESTURES[:4]):
+            if name not in button_masks:
+                raise ValueError(f"Gestures mapped to unknown button {name}")
+            if "key" in value:
+                raise ValueError(f"{name} maps both a key and gestures")
+            if "long_press" in value and "hold" in value:
+                raise ValueError(f"{name} maps both a long press and a hold")
+            long_press_time = value.get("long_press_time", LONG_PRESS_TIME)
+            double_tap_time = value.get("double_tap_time", DOUBLE_TAP_TIME)
+            for option, seconds in (("long_press_time", long_press_time), ("double_tap_time", double_tap_time)):
+                if not is_seconds(seconds):
+                    raise ValueError(f"{option} of {name} must be a number of seconds, got {seconds!r}")
+            bit = button_masks[name].bit_length() - 1
+            buttons[bit] = ButtonGestures(
+                *(parse_action(value[gesture], f"{name} {gesture}") if gesture in value else None
+                  for gesture in GESTURES[:4]),
+                long_press_time=long_press_time,
+                double_tap_time=double_tap_time,
+            )
+            mask |= 1 << bit
+
+    if not mask and not chords:
+        return None
+
+    # Chord buttons mapped to a plain key hold it, once it's clear they aren't chording
+    remaining = chord_mask & ~mask
+    while remaining:
+        low = remaining & -remaining
+        remaining ^= low
+        bit = low.bit_length() - 1
+        name = next(name for name, button_mask in button_masks.items() if button_mask == low)
+        value = key_mapping.get(name)
+        key = value.get("key") if isinstance(value, dict) else value
+        if key:
+            buttons[bit] = ButtonGestures(hold=(key,), long_press_time=0.0)
+
+    chords.sort(key=lambda chord: -bin(chord[0]).count("1"))
+    return GestureTable(mask | chord_mask, tuple(buttons), tuple(chords), chord_mask, chord_time)
+
+
+class GestureEngine:
+    """Turn the pressed buttons of a gesture table into keys, one state machine per button
+
+    update() takes the buttons pressed at a timestamp and expire() handles the deadlines
+    due by a timestamp. Without explicit timestamps both use the clock, and once started
+    on a loop the engine arms one timer for its earliest deadline, like KeyRepeater.
+    """
+
+    def __init__(self, table: GestureTable, injector, clock: Any = None):
+        self.table = table
+        self.mask = table.mask
+        self.injector = injector
+        # Anything with time() and call_at(), normally the running event loop
+        self.clock = clock
+        self._state = [IDLE] * 32
+        # When the button was pressed (PRESSED, CHORDING) or released (RELEASED)
+        self._since = [0.0] * 32
+        self._deadlines = [INFINITY] * 32
+        # Buttons down, buttons waiting for a chord, and buttons with a deadline
+        self._pressed = 0
+        self._chording = 0
+        self._timed = 0
+        # Chords whose keys are held, as (mask, action)
+        self._active_chords: List[Tuple[int, Action]] = []
+        # Keys held by the engine, released by release_all()
+        self._held: List[str] = []
+        # Called with the name of every command an action runs
+        self.on_command: Optional[Callable[[str], None]] = None
+        self._commands: List[str] = []
+        self._timer = None
+        self._timer_at = INFINITY
+        # Gestures recognized since the start, by kind
+        self.counts = dict.fromkeys(GESTURES, 0)
+
+    def start(self) -> None:
+        """Handle deadlines on the running loop (must be called from the event loop)"""
+        self.clock = asyncio.get_running_loop()
+
+    def now(self) -> float:
+        clock = self.clock
+        return clock.time() if clock is not None else time.monotonic()
+
+    def update(self, pressed: int, now: Optional[float] = None) -> None:
+        """Apply the buttons pressed at now (a bitmask, bits outside the table are ignored)"""
+        if now is None:
+            now = self.now()
+        self._expire(now)
+        pressed &= self.mask
+        changed = pressed ^ self._pressed
+        self._pressed = pressed
+
+        edges = changed & pressed
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            self._press(low.bit_length() - 1, now)
+        if self._chording:
+            self._match_chords()
+
+        edges = changed & ~pressed
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            self._release(low.bit_length() - 1, now)
+
+        self.injector.flush()
+        self._schedule()
+        if self._commands:
+            self._run_commands()
+
+    def expire(self, now: Optional[float] = None) -> None:
+        """Handle every deadline due by now"""
+        self._expire(self.now() if now is None else now)
+        self.injector.flush()
+        self._schedule()
+        if self._commands:
+            self._run_commands()
+
+    def release_all(self) -> None:
+        """Release every key held by the engine and forget pending gestures"""
+        for key in reversed(self._held):
+            self.injector.release(key)
+        self._held.clear()
+        self._active_chords.clear()
+        self._commands.clear()
+        for bit in range(32):
+            self._state[bit] = IDLE
+            self._deadlines[bit] = INFINITY
+        self._pressed = self._chording = self._timed = 0
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+            self._timer_at = INFINITY
+
+    def _press(self, bit: int, now: float) -> None:
+        if self._state[bit] == IDLE and (1 << bit) & self.table.chord_mask:
+            self._state[bit] = CHORDING
+            self._since[bit] = now
+            self._set_deadline(bit, now + self.table.chord_time)
+            self._chording |= 1 << bit
+        else:
+            self._begin(bit, now)
+
+    def _begin(self, bit: int, at: float) -> None:
+        """Start the button's own gestures for a press at time at"""
+        gestures = self.table.buttons[bit]
+        if gestures is None:
+            self._state[bit] = DONE
+        elif self._state[bit] == RELEASED:
+            self._set_deadline(bit, INFINITY)
+            self._state[bit] = DONE
+            self._fire("double_tap", gestures.double_tap)
+        elif gestures.hold and not gestures.long_press_time:
+            self._state[bit] = HELD
+            self._hold(gestures.hold)
+        elif gestures.double_tap or gestures.long_press or gestures.hold:
+            self._state[bit] = PRESSED
+            self._since[bit] = at
+            if gestures.long_press or gestures.hold:
+                self._set_deadline(bit, at + gestures.long_press_time)
+        else:
+            # Nothing to tell a tap from
+            self._state[bit] = DONE
+            self._fire("tap", gestures.tap)
+
+    def _release(self, bit: int, now: float) -> None:
+        state = self._state[bit]
+        if state == CHORDING:
+            # Released before the chord came together: a press and release of its own
+            self._chording &= ~(1 << bit)
+            self._set_deadline(bit, INFINITY)
+            self._state[bit] = IDLE
+            self._begin(bit, self._since[bit])
+            if self._deadlines[bit] <= now:
+                self._deadline(bit, self._deadlines[bit])
+            state = self._state[bit]
+
+        gestures = self.table.buttons[bit]
+        if state == PRESSED:
+            self._set_deadline(bit, INFINITY)
+            if gestures.double_tap:
+                self._state[bit] = RELEASED
+                self._since[bit] = now
+                self._set_deadline(bit, now + gestures.double_tap_time)
+                return
+            self._fire("tap", gestures.tap)
+        elif state == HELD and gestures.hold:
+            self._unhold(gestures.hold)
+        self._state[bit] = IDLE
+
+        if self._active_chords:
+            for chord in self._active_chords:
+                if chord[0] & (1 << bit):
+                    self._active_chords.remove(chord)
+                    self._unhold(chord[1])
+                    break
+
+    def _match_chords(self) -> None:
+        chording = self._chording
+        for chord, keys in self.table.chords:
+            if chord & chording == chord:
+                chording &= ~chord
+                self._active_chords.append((chord, keys))
+                members = chord
+                while members:
+                    low = members & -members
+                    members ^= low
+                    bit = low.bit_length() - 1
+                    self._state[bit] = DONE
+                    self._set_deadline(bit, INFINITY)
+                self.counts["chord"] += 1
+                self._hold(keys)
+        self._chording = chording
+
+    def _expire(self, now: float) -> None:
+        # Earliest deadline first, each handled at its own time
+        while self._timed:
+            bit, deadline = self._earliest()
+            if deadline > now:
+                break
+            self._deadline(bit, deadline)
+
+    def _deadline(self, bit: int, at: float) -> None:
+        self._set_deadline(bit, INFINITY)
+        state = self._state[bit]
+        gestures = self.table.buttons[bit]
+        if state == CHORDING:
+            # No chord came together: the button acts on its own, from when it was pressed
+            self._chording &= ~(1 << bit)
+            self._state[bit] = IDLE
+            self._begin(bit, self._since[bit])
+        elif state == PRESSED:
+            self._state[bit] = HELD
+            if gestures.hold:
+                self.counts["hold"] += 1
+                self._hold(gestures.hold)
+            else:
+                self._fire("long_press", gestures.long_press)
+        elif state == RELEASED:
+            self._state[bit] = IDLE
+            self._fire("tap", gestures.tap)
+
+    def _earliest(self) -> Tuple[int, float]:
+        deadlines = self._deadlines
+        earliest_bit = -1
+        earliest = INFINITY
+        timed = self._timed
+        while timed:
+            low = timed & -timed
+            timed ^= low
+            bit = low.bit_length() - 1
+            if deadlines[bit] < earliest:
+                earliest_bit = bit
+                earliest = deadlines[bit]
+        return earliest_bit, earliest
+
+    def _set_deadline(self, bit: int, deadline: float) -> None:
+        self._deadlines[bit] = deadline
+        if deadline == INFINITY:
+            self._timed &= ~(1 << bit)
+        else:
+            self._timed |= 1 << bit
+
+    def _fire(self, gesture: str, keys: Optional[Action]) -> None:
+        """Tap keys one after the other, each press and release in a batch of its own"""
+        if not keys:
+            return
+        self.counts[gesture] += 1
+        if type(keys) is Command:
+            self._commands.append(keys.name)
+            return
+        injector = self.injector
+        for key in keys:
+            injector.press(key)
+            injector.flush()
+            injector.release(key)
+            injector.flush()
+
+    def _hold(self, keys: Action) -> None:
+        if type(keys) is Command:
+            self._commands.append(keys.name)
+            return
+        for key in keys:
+            self.injector.press(key)
+            self._held.append(key)
+
+    def _unhold(self, keys: Action) -> None:
+        if type(keys) is Command:
+            return
+        for key in reversed(keys):
+            self.injector.release(key)
+            self._held.remove(key)
+
+    def _run_commands(self) -> None:
+        # Only once the engine is done with the event, as a command may replace the engine
+        commands, self._commands = self._commands, []
+        if self.on_command is not None:
+            for name in commands:
+                self.on_command(name)
+
+    def _schedule(self) -> None:
+        """Arm the loop timer for the earliest deadline, if it comes before the armed one"""
+        clock = self.clock
+        if clock is None or not self._timed:
+            return
+        deadline = self._earliest()[1]
+        if deadline < self._timer_at:
+            if self._timer is not None:
+                self._timer.cancel()
+            self._timer_at = deadline
+            self._timer = clock.call_at(deadline, self._fire_timer)
+
+    def _fire_timer(self) -> None:
+        self._timer = None
+        self._timer_at = INFINITY
+        self.expire()
@@ -0,0 +1,179 @@
+"""Key output backends: where the controller's key presses and releases end up
+
+The injection thread calls press() and release() for every edge of one notification,
+then flush() once, so backends that can batch write the whole notification at once.
+"""
+import os
+import struct
+import sys
+from typing import Dict, List, Optional, Tuple
+
+# Linux input event codes (linux/input-event-codes.h)
+EV_SYN = 0x00
+EV_KEY = 0x01
+EV_REL = 0x02
+EV_ABS = 0x03
+SYN_REPORT = 0
+
+# uinput ioctls (linux/uinput.h)
+UI_DEV_CREATE = 0x5501
+UI_DEV_DESTROY = 0x5502
+UI_SET_EVBIT = 0x40045564
+UI_SET_KEYBIT = 0x40045565
+UI_SET_RELBIT = 0x40045566
+UI_SET_ABSBIT = 0x40045567
+# ioctl enabling one code of each event type
+UI_SET_BITS = {EV_KEY: UI_SET_KEYBIT, EV_REL: UI_SET_RELBIT, EV_ABS: UI_SET_ABSBIT}
+
+# struct input_event: timeval, type, code, value (the kernel fills in the time)
+INPUT_EVENT = struct.Struct("llHHi")
+# struct uinput_user_dev: name, input_id, ff_effects_max, absmax/absmin/absfuzz/absflat
+UINPUT_USER_DEV = struct.Struct("80sHHHHi" + "64i" * 4)
+BUS_VIRTUAL = 0x06
+VENDOR_ID = 0x094A
+
+# Key names as used in key_mapping.json (keyboard module names) -> Linux key codes
+LINUX_KEY_CODES: Dict[str, int] = {
+    "escape": 1, "esc": 1,
+    "1": 2, "2": 3, "3": 4, "4": 5, "5": 6, "6": 7, "7": 8, "8": 9, "9": 10, "0": 11,
+    "-": 12, "=": 13, "backspace": 14, "tab": 15,
+    "q": 16, "w": 17, "e": 18, "r": 19, "t": 20, "y": 21, "u": 22, "i": 23, "o": 24, "p": 25,
+    "[": 26, "]": 27, "enter": 28, "return": 28, "ctrl": 29, "left ctrl": 29,
+    "a": 30, "s": 31, "d": 32, "f": 33, "g": 34, "h": 35, "j": 36, "k": 37, "l": 38,
+    ";": 39, "'": 40, "`": 41, "shift": 42, "left shift": 42, "\\": 43,
+    "z": 44, "x": 45, "c": 46, "v": 47, "b": 48, "n": 49, "m": 50,
+    ",": 51, ".": 52, "/": 53, "right shift": 54, "alt": 56, "left alt": 56,
+    "space": 57, "caps lock": 58,
+    "f1": 59, "f2": 60, "f3": 61, "f4": 62, "f5": 63, "f6": 64, "f7": 65, "f8": 66, "f9": 67, "f10": 68,
+    "f11": 87, "f12": 88, "right ctrl": 97, "right alt": 100,
+    "home": 102, "up": 103, "page up": 104, "left": 105, "right": 106, "end": 107,
+    "down": 108, "page down": 109, "insert": 110, "delete": 111,
+}
+
+
+class KeyOutput:
+    """Base class for key output backends"""
+
+    def press(self, key: str) -> None:
+        raise NotImplementedError
+
+    def release(self, key: str) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Deliver the events of one notification (called once after its presses and releases)"""
+
+    def close(self) -> None:
+        """Release any resources held by the backend"""
+
+
+class KeyboardOutput(KeyOutput):
+    """Send keys through the keyboard module (Windows, macOS, Linux as root)"""
+
+    def __init__(self):
+        import keyboard
+        self.press = keyboard.press
+        self.release = keyboard.release
+
+
+class RecordingKeyOutput(KeyOutput):
+    """Keep every event in memory instead of pressing keys, for replays and benchmarks"""
+
+    def __init__(self):
+        self.events: List[Tuple[bool, str]] = []
+        # Number of flushes, i.e. batches delivered
+        self.frames = 0
+
+    def press(self, key: str) -> None:
+        self.events.append((True, key))
+
+    def release(self, key: str) -> None:
+        self.events.append((False, key))
+
+    def flush(self) -> None:
+        self.frames += 1
+
+
+class UinputDevice:
+    """Virtual Linux input device on /dev/uinput, with the event bits its subclass declares
+
+    Events are buffered until flush() and written with a single write() ending in one
+    SYN_REPORT, so the events of one notification or tick reach applications in the same
+    input frame. A device given as fd is written to as is, without being set up.
+    """
+
+    NAME = "Zwift Ride"
+    PRODUCT_ID = 0x0000
+    # Event type -> codes of that type the device sends
+    EVENT_BITS: Dict[int, Tuple[int, ...]] = {}
+    # Absolute axis -> (min, max)
+    ABS_RANGES: Dict[int, Tuple[int, int]] = {}
+
+    def __init__(self, fd: Optional[int] = None, name: Optional[str] = None):
+        self._owns_device = fd is None
+        if fd is None:
+            import fcntl
+            fd = os.open("/dev/uinput", os.O_WRONLY | os.O_NONBLOCK)
+            for event_type, codes in self.EVENT_BITS.items():
+                fcntl.ioctl(fd, UI_SET_EVBIT, event_type)
+                for code in codes:
+                    fcntl.ioctl(fd, UI_SET_BITS[event_type], code)
+            absmax = [0] * 64
+            absmin = [0] * 64
+            for axis, (low, high) in self.ABS_RANGES.items():
+                absmin[axis] = low
+                absmax[axis] = high
+            os.write(fd, UINPUT_USER_DEV.pack((name or self.NAME).encode(), BUS_VIRTUAL, VENDOR_ID, self.PRODUCT_ID,
+                                              1, 0, *absmax, *absmin, *([0] * 128)))
+            fcntl.ioctl(fd, UI_DEV_CREATE)
+        self.fd = fd
+        self._buffer = bytearray()
+        self._syn_report = INPUT_EVENT.pack(0, 0, EV_SYN, SYN_REPORT, 0)
+
+    def _event(self, event_type: int, code: int, value: int) -> None:
+        self._buffer += INPUT_EVENT.pack(0, 0, event_type, code, value)
+
+    def flush(self) -> None:
+        if self._buffer:
+            self._buffer += self._syn_report
+            os.write(self.fd, self._buffer)
+            self._buffer.clear()
+
+    def close(self) -> None:
+        if self._owns_device:
+            import fcntl
+            fcntl.ioctl(self.fd, UI_DEV_DESTROY)
+        os.close(self.fd)
+
+
+class UinputKeyOutput(UinputDevice, KeyOutput):
+    """Virtual Linux keyboard on /dev/uinput, so chorded buttons reach applications in the same input frame"""
+
+    NAME = "Zwift Ride Keytrigger"
+    PRODUCT_ID = 0x0001
+    EVENT_BITS = {EV_KEY: tuple(sorted(set(LINUX_KEY_CODES.values())))}
+
+    def _key_event(self, key: str, value: int) -> None:
+        code = LINUX_KEY_CODES.get(key)
+        if code is None:
+            raise ValueError(f"Key not supported by the uinput output: {key}")
+        self._buffer += INPUT_EVENT.pack(0, 0, EV_KEY, code, value)
+
+    def press(self, key: str) -> None:
+        self._key_event(key, 1)
+
+    def release(self, key: str) -> None:
+        self._key_event(key, 0)
+
+
+KEY_OUTPUTS = {
+    "keyboard": KeyboardOutput,
+    "uinput": UinputKeyOutput,
+}
+
+
+def create_key_output(name: str) -> KeyOutput:
+    """Create a key output backend by name"""
+    if name == "uinput" and not sys.platform.startswith("linux"):
+        raise ValueError("The uinput key output is only available on Linux")
+    return KEY_OUTPUTS[name]()
@@ -0,0 +1,102 @@
+"""Per-stage latency from BLE notification to key injection
+
+Stages, all measured with time.perf_counter_ns:
+    decode   notification_handler entry until the button map is decoded
+    trigger  key edges computed and queued for injection
+    queue    waiting for the injection thread
+    output   the key output's press/release/flush calls
+    total    notification_handler entry until the key output returned
+
+Samples go into a fixed-size ring buffer per stage, so recording never allocates. The
+notification handler and the injection thread each record all their stages in one call.
+"""
+from array import array
+from typing import Dict, List
+
+STAGES = ("decode", "trigger", "queue", "output", "total")
+DECODE, TRIGGER, QUEUE, OUTPUT, TOTAL = range(len(STAGES))
+
+HISTOGRAM_WIDTH = 40
+
+
+class LatencyStats:
+    """Ring buffer of the latest samples of every stage"""
+
+    def __init__(self, capacity: int = 8192):
+        self.capacity = capacity
+        self.samples = [array("q", bytes(8 * capacity)) for _ in STAGES]
+        # Samples recorded per stage since the start, including overwritten ones
+        self.counts = [0] * len(STAGES)
+
+    def record(self, stage: int, ns: int) -> None:
+        count = self.counts[stage]
+        self.samples[stage][count % self.capacity] = ns
+        self.counts[stage] = count + 1
+
+    def record_handler(self, start: int, decoded: int, triggered: int) -> None:
+        """Record the decode and trigger stages of one notification from its time stamps"""
+        samples = self.samples
+        counts = self.counts
+        # Only ever recorded together, so both stages are at the same count
+        count = counts[DECODE]
+        index = count % self.capacity
+        samples[DECODE][index] = decoded - start
+        samples[TRIGGER][index] = triggered - decoded
+        counts[DECODE] = counts[TRIGGER] = count + 1
+
+    def record_injection(self, stamp: int, queued: int, picked: int, done: int) -> None:
+        """Record the queue, output and (with the stamp of a notification) total stages of one batch"""
+        samples = self.samples
+        counts = self.counts
+        # Only ever recorded together, so both stages are at the same count
+        count = counts[QUEUE]
+        index = count % self.capacity
+        samples[QUEUE][index] = picked - queued
+        samples[OUTPUT][index] = done - picked
+        counts[QUEUE] = counts[OUTPUT] = count + 1
+        if stamp:
+            count = counts[TOTAL]
+            samples[TOTAL][count % self.capacity] = done - stamp
+            counts[TOTAL] = count + 1
+
+    def _kept(self, stage: int) -> List[int]:
+        return sorted(self.samples[stage][:min(self.counts[stage], self.capacity)])
+
+    def percentiles(self, stage: int) -> Dict[str, float]:
+        """p50/p95/p99/max of a stage in microseconds, empty without samples"""
+        kept = self._kept(stage)
+        if not kept:
+            return {}
+        last = len(kept) - 1
+        return {
+            "p50": kept[last * 50 // 100] / 1000,
+            "p95": kept[last * 95 // 100] / 1000,
+            "p99": kept[last * 99 // 100] / 1000,
+            "max": kept[last] / 1000,
+        }
+
+    def report(self) -> str:
+        """Percentile table and a log2 histogram per stage"""
+        lines = [f"{'stage':8} {'count':>8} {'p50 us':>9} {'p95 us':>9} {'p99 us':>9} {'max us':>9}"]
+        for stage, name in enumerate(STAGES):
+            p = self.percentiles(stage)
+            if p:
+                lines.append(f"{name:8} {self.counts[stage]:8} {p['p50']:9.1f} {p['p95']:9.1f} "
+                             f"{p['p99']:9.1f} {p['max']:9.1f}")
+
+        for stage, name in enumerate(STAGES):
+            kept = self._kept(stage)
+            if not kept:
+                continue
+            # Bucket b holds samples below 2**b microseconds
+            buckets: Dict[int, int] = {}
+            for ns in kept:
+                bucket = max(0, (ns // 1000).bit_length())
+                buckets[bucket] = buckets.get(bucket, 0) + 1
+            peak = max(buckets.values())
+            lines.append(f"\n{name}")
+            for bucket in range(min(buckets), max(buckets) + 1):
+                count = buckets.get(bucket, 0)
+                bar = "#" * (count * HISTOGRAM_WIDTH // peak)
+                lines.append(f"  < {2 ** bucket:>7} us {count:8} {bar}")
+        return "\n".join(lines)
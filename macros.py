@@ -0,0 +1,227 @@
+"""Macros: timed key sequences and typed text, run on the event loop beside the notifications
+
+A key_mapping.json entry can run a macro instead of mirroring one key:
+
+    "B_BTN": {"macro": ["escape", {"wait": 0.2}, "down", "down", "enter"]},
+    "A_BTN": {"macro": [{"type": "gg"}, "enter"], "until_release": true}
+
+A step is a key name to tap, or one of {"tap": key}, {"press": key}, {"release": key},
+{"wait": seconds} and {"type": text}. Keys a macro leaves pressed are released when it
+ends. Pressing the button again starts the macro over; with "until_release" releasing
+the button stops it too. Either way the keys it holds are released.
+
+Each step runs in a loop callback of its own (loop.call_at), so a long macro never holds
+up the notifications that come in meanwhile: they are handled between two of its steps.
+Waits are counted from the previous wait's deadline, so a late step doesn't delay the
+rest of the macro.
+"""
+import asyncio
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from gestures import is_seconds
+
+# Steps of a compiled macro
+PRESS = 0
+RELEASE = 1
+WAIT = 2
+
+Step = Tuple[int, Any]
+
+# Characters typed with shift, on a US layout, and the key under them
+SHIFTED = {
+    "~": "`", "!": "1", "@": "2", "#": "3", "$": "4", "%": "5", "^": "6", "&": "7", "*": "8", "(": "9", ")": "0",
+    "_": "-", "+": "=", "{": "[", "}": "]", "|": "\\", ":": ";", '"': "'", "<": ",", ">": ".", "?": "/",
+}
+# Characters typed with a key of another name
+NAMED = {" ": "space", "\n": "enter", "\t": "tab"}
+# Characters that are their own key
+PLAIN = set("abcdefghijklmnopqrstuvwxyz0123456789`-=[]\\;',./")
+
+
+class MacroTable(NamedTuple):
+    """Compiled macros of a key mapping"""
+    # Bits of the buttons that run a macro
+    mask: int
+    # Steps per bit of the button map
+    macros: Tuple[Optional[Tuple[Step, ...]], ...]
+    # Bits whose macro stops when the button is released
+    until_release_mask: int
+
+
+def type_steps(text: str, name: str) -> List[Step]:
+    """Steps typing text, one key tap per character"""
+    steps: List[Step] = []
+    for char in text:
+        if char in NAMED:
+            steps += [(PRESS, NAMED[char]), (RELEASE, NAMED[char])]
+        elif char in PLAIN:
+            steps += [(PRESS, char), (RELEASE, char)]
+        elif char in SHIFTED or char.lower() in PLAIN:
+            key = SHIFTED.get(char, char.lower())
+            steps += [(PRESS, "shift"), (PRESS, key), (RELEASE, key), (RELEASE, "shift")]
+        else:
+            raise ValueError(f"{name} types {char!r}, which has no key")
+    return steps
+
+
+def compile_macro(value: Any, name: str) -> Tuple[Step, ...]:
+    """Steps of a macro entry's list, with consecutive waits merged and held keys released at the end"""
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"The macro of {name} must be a list of steps, got {value!r}")
+    steps: List[Step] = []
+    held: List[str] = []
+    for step in value:
+        if isinstance(step, str):
+            step = {"tap": step}
+        if not isinstance(step, dict) or len(step) != 1:
+            raise ValueError(f"Macro step of {name} must be a key name or an object with one step, got {step!r}")
+        (kind, argument), = step.items()
+        if kind == "wait":
+            if not is_seconds(argument):
+                raise ValueError(f"Macro wait of {name} must be a number of seconds, got {argument!r}")
+            if steps and steps[-1][0] == WAIT:
+                steps[-1] = (WAIT, steps[-1][1] + argument)
+            else:
+                steps.append((WAIT, argument))
+            continue
+        if not isinstance(argument, str) or not argument:
+            raise ValueError(f"Macro step {kind} of {name} needs a key name or text, got {argument!r}")
+        if kind == "type":
+            steps += type_steps(argument, name)
+        elif kind == "tap":
+            steps += [(PRESS, argument), (RELEASE, argument)]
+        elif kind == "press":
+            if argument in held:
+                raise ValueError(f"The macro of {name} presses {argument} while it's already pressed")
+            held.append(argument)
+            steps.append((PRESS, argument))
+        elif kind == "release":
+            if argument not in held:
+                raise ValueError(f"The macro of {name} releases {argument} without pressing it")
+            held.remove(argument)
+            steps.append((RELEASE, argument))
+        else:
+            raise ValueError(f"Unknown macro step {kind} in {name}, expected tap, press, release, wait or type")
+    steps += [(RELEASE, key) for key in reversed(held)]
+    return tuple(steps)
+
+
+def compile_macro_table(key_mapping: Dict[str, Any], button_masks: Dict[str, int]) -> Optional[MacroTable]:
+    """Compile the macro entries of a key mapping, None if it has none; raises ValueError if one can't be used"""
+    macros: List[Optional[Tuple[Step, ...]]] = [None] * 32
+    mask = 0
+    until_release_mask = 0
+    for name, value in key_mapping.items():
+        if not isinstance(value, dict) or "macro" not in value:
+            continue
+        if name not in button_masks:
+            raise ValueError(f"Macro mapped to unknown button {name}")
+        if "key" in value:
+            raise ValueError(f"{name} maps both a key and a macro")
+        bit = button_masks[name].bit_length() - 1
+        macros[bit] = compile_macro(value["macro"], name)
+        mask |= 1 << bit
+        if value.get("until_release", False):
+            until_release_mask |= 1 << bit
+    if not mask:
+        return None
+    return MacroTable(mask, tuple(macros), until_release_mask)
+
+
+class MacroRun:
+    """A macro in progress: its next step, the deadline it runs at, and the keys it holds"""
+    __slots__ = ("bit", "steps", "index", "deadline", "held", "handle")
+
+    def __init__(self, bit: int, steps: Tuple[Step, ...], start: float):
+        self.bit = bit
+        self.steps = steps
+        self.index = 0
+        self.deadline = start
+        self.held: List[str] = []
+        self.handle: Optional[asyncio.TimerHandle] = None
+
+
+class MacroEngine:
+    """Run the macros of a macro table as their buttons are pressed, one step per loop callback"""
+
+    def __init__(self, table: MacroTable, injector: Any, clock: Any = None):
+        self.table = table
+        self.mask = table.mask
+        self.injector = injector
+        # Anything with time() and call_at(), normally the running event loop
+        self.clock = clock
+        # Running macros by bit
+        self._running: Dict[int, MacroRun] = {}
+        # Macros started, run to their end, and stopped early; key steps run
+        self.counts = {"started": 0, "completed": 0, "cancelled": 0, "steps": 0}
+
+    def start(self) -> None:
+        """Run macros on the running loop (must be called from the event loop)"""
+        self.clock = asyncio.get_running_loop()
+
+    @property
+    def running(self) -> int:
+        return len(self._running)
+
+    def update(self, pressed: int, previous: int) -> None:
+        """Start the macros of newly pressed buttons, and stop those released with until_release
+
+        Does nothing until start() gave the engine a loop. Keys released by a stopped macro
+        are left for the caller to flush.
+        """
+        changed = (pressed ^ previous) & self.mask
+        edges = changed & pressed
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            self._start(low.bit_length() - 1)
+        edges = changed & previous & self.table.until_release_mask
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            self._stop(low.bit_length() - 1)
+
+    def release_all(self) -> None:
+        """Stop every macro, releasing the keys they hold"""
+        for bit in list(self._running):
+            self._stop(bit)
+
+    def _start(self, bit: int) -> None:
+        clock = self.clock
+        if clock is None:
+            return
+        if bit in self._running:
+            self._stop(bit)
+        run = self._running[bit] = MacroRun(bit, self.table.macros[bit], clock.time())
+        # The first step too runs after the notification that started it
+        run.handle = clock.call_at(run.deadline, self._step, run)
+        self.counts["started"] += 1
+
+    def _stop(self, bit: int) -> None:
+        run = self._running.pop(bit, None)
+        if run is None:
+            return
+        run.handle.cancel()
+        for key in reversed(run.held):
+            self.injector.release(key)
+        self.counts["cancelled"] += 1
+
+    def _step(self, run: MacroRun) -> None:
+        kind, argument = run.steps[run.index]
+        run.index += 1
+        if kind == WAIT:
+            run.deadline += argument
+        else:
+            if kind == PRESS:
+                self.injector.press(argument)
+                run.held.append(argument)
+            else:
+                self.injector.release(argument)
+                run.held.remove(argument)
+            self.injector.flush()
+            self.counts["steps"] += 1
+        if run.index == len(run.steps):
+            del self._running[run.bit]
+            self.counts["completed"] += 1
+            return
+        run.handle = self.clock.call_at(run.deadline, self._step, run)
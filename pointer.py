@@ -0,0 +1,428 @@
+"""Mouse actions: pointer motion, clicks and the scroll wheel from buttons and paddles
+
+A key_mapping.json entry can drive the mouse instead of a key:
+
+    "UP_BTN": {"move": "up"},
+    "RIGHT_BTN": {"move": "right", "speed": 600},
+    "A_BTN": {"click": "left"},
+    "SHFT_UP_R_BTN": {"scroll": "up"},
+    "PADDLE_L": {"move": "x"},
+    "PADDLE_R": {"scroll": "vertical"}
+
+A click holds its mouse button while the Ride button is held. Motion and scrolling start
+at "speed" (pixels or wheel notches per second) and speed up the longer the button is
+held, by up to "acceleration" times more after ACCELERATION_TIME, along a quadratic
+curve. A paddle (with --paddles mouse) moves at up to that top speed at full travel,
+through the paddle deadzone and curve.
+
+Nothing moves per notification: buttons and paddles only set velocities, and a loop
+timer ticking at TICK_RATE turns them into motion while anything is moving. Each tick
+moves by the velocity times the time since the previous one, and keeps the fractions of
+a pixel or notch for the next, so slow motion isn't lost to rounding and the output
+rate doesn't depend on how often the Ride sends frames.
+"""
+import asyncio
+import collections
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from analog import AXIS_MAX, DEFAULT_CURVE, DEFAULT_DEADZONE, AnalogChannel
+from key_output import EV_KEY, EV_REL, UinputDevice
+
+# Motion ticks per second
+TICK_RATE = 125
+# Longest time one tick moves for, so a stalled loop doesn't make the pointer jump
+MAX_TICK_TIME = 0.05
+
+MOVE_SPEED = 400.0
+SCROLL_SPEED = 8.0
+# Extra speed reached after ACCELERATION_TIME of holding, as a multiple of the speed
+ACCELERATION = 3.0
+ACCELERATION_TIME = 1.0
+
+# Action kinds
+MOVE = 0
+SCROLL = 1
+CLICK = 2
+
+# Unit vector of each direction: pointer x and y (y grows downwards), or wheel vertical and horizontal
+MOVE_DIRECTIONS = {"up": (0, -1), "down": (0, 1), "left": (-1, 0), "right": (1, 0)}
+SCROLL_DIRECTIONS = {"up": (1, 0), "down": (-1, 0), "left": (0, -1), "right": (0, 1)}
+# Paddle axes, positive with the paddle's positive values
+PADDLE_DIRECTIONS = {MOVE: {"x": (1, 0), "y": (0, 1)}, SCROLL: {"vertical": (1, 0), "horizontal": (0, 1)}}
+MOUSE_BUTTONS = ("left", "right", "middle")
+
+# Linux input event codes (linux/input-event-codes.h)
+REL_X = 0x00
+REL_Y = 0x01
+REL_HWHEEL = 0x06
+REL_WHEEL = 0x08
+BTN_CODES = {"left": 0x110, "right": 0x111, "middle": 0x112}
+
+
+class MouseAction(NamedTuple):
+    """What one button or paddle does with the mouse"""
+    kind: int
+    # Direction for MOVE and SCROLL
+    x: int = 0
+    y: int = 0
+    # Mouse button for CLICK
+    button: str = ""
+    speed: float = 0.0
+    acceleration: float = ACCELERATION
+
+
+class MouseTable(NamedTuple):
+    """Compiled mouse actions of a key mapping"""
+    # Bits of the buttons with a mouse action
+    mask: int
+    # Action per bit of the button map
+    actions: Tuple[Optional[MouseAction], ...]
+
+
+def parse_mouse_action(value: Any, name: str, paddle: bool = False) -> Optional[MouseAction]:
+    """Mouse action of a key mapping entry, None if it has none; raises ValueError if it can't be used"""
+    if not isinstance(value, dict):
+        return None
+    kinds = [kind for kind in ("move", "scroll", "click") if kind in value]
+    if not kinds:
+        return None
+    if len(kinds) > 1 or "key" in value:
+        raise ValueError(f"{name} must map one of a key, move, scroll or click")
+    kind = kinds[0]
+    argument = value[kind]
+    if kind == "click":
+        if paddle or argument not in MOUSE_BUTTONS:
+            raise ValueError(f"{name} clicks {argument!r}, expected one of {', '.join(MOUSE_BUTTONS)}")
+        return MouseAction(CLICK, button=argument)
+    action = MOVE if kind == "move" else SCROLL
+    directions = PADDLE_DIRECTIONS[action] if paddle else MOVE_DIRECTIONS if action == MOVE else SCROLL_DIRECTIONS
+    if argument not in directions:
+        raise ValueError(f"{name} {kind}s {argument!r}, expected one of {', '.join(directions)}")
+    speed = value.get("speed", MOVE_SPEED if action == MOVE else SCROLL_SPEED)
+    acceleration = value.get("acceleration", ACCELERATION)
+    if not isinstance(speed, (int, float)) or isinstance(speed, bool) or speed <= 0:
+        raise ValueError(f"The speed of {name} must be a positive number, got {speed!r}")
+    if not isinstance(acceleration, (int, float)) or isinstance(acceleration, bool) or acceleration < 0:
+        raise ValueError(f"The acceleration of {name} can't be negative, got {acceleration!r}")
+    return MouseAction(action, *directions[argument], speed=speed, acceleration=acceleration)
+
+
+def compile_mouse_table(key_mapping: Dict[str, Any], button_masks: Dict[str, int]) -> Optional[MouseTable]:
+    """Compile the mouse actions of a key mapping's buttons, None if it has none"""
+    actions: List[Optional[MouseAction]] = [None] * 32
+    mask = 0
+    for name, mask_of_name in button_masks.items():
+        action = parse_mouse_action(key_mapping.get(name), name)
+        if action is not None:
+            bit = mask_of_name.bit_length() - 1
+            actions[bit] = action
+            mask |= 1 << bit
+    if not mask:
+        return None
+    return MouseTable(mask, tuple(actions))
+
+
+class MouseOutput:
+    """Base class for mouse output backends, called from the injection thread"""
+
+    def move(self, dx: int, dy: int) -> None:
+        raise NotImplementedError
+
+    def scroll(self, vertical: int, horizontal: int) -> None:
+        raise NotImplementedError
+
+    def press(self, button: str) -> None:
+        raise NotImplementedError
+
+    def release(self, button: str) -> None:
+        raise NotImplementedError
+
+    def flush(self) -> None:
+        """Deliver the events of one tick"""
+
+    def close(self) -> None:
+        """Release any resources held by the backend"""
+
+
+class MouseModuleOutput(MouseOutput):
+    """Drive the mouse through the mouse module (pip install mouse), where uinput isn't available"""
+
+    def __init__(self):
+        import mouse
+        self.mouse = mouse
+
+    def move(self, dx: int, dy: int) -> None:
+        self.mouse.move(dx, dy, absolute=False)
+
+    def scroll(self, vertical: int, horizontal: int) -> None:
+        # The module only has the vertical wheel
+        if vertical:
+            self.mouse.wheel(vertical)
+
+    def press(self, button: str) -> None:
+        self.mouse.press(button)
+
+    def release(self, button: str) -> None:
+        self.mouse.release(button)
+
+
+class RecordingMouseOutput(MouseOutput):
+    """Keep every event in memory instead of moving the mouse, for benchmarks"""
+
+    def __init__(self):
+        self.events: List[Tuple[str, Any, Any]] = []
+        # Number of flushes, i.e. ticks delivered
+        self.frames = 0
+
+    def move(self, dx: int, dy: int) -> None:
+        self.events.append(("move", dx, dy))
+
+    def scroll(self, vertical: int, horizontal: int) -> None:
+        self.events.append(("scroll", vertical, horizontal))
+
+    def press(self, button: str) -> None:
+        self.events.append(("press", button, None))
+
+    def release(self, button: str) -> None:
+        self.events.append(("release", button, None))
+
+    def flush(self) -> None:
+        self.frames += 1
+
+
+class UinputMouse(UinputDevice, MouseOutput):
+    """Virtual Linux mouse on /dev/uinput, each tick written at once"""
+
+    NAME = "Zwift Ride Mouse"
+    PRODUCT_ID = 0x0003
+    EVENT_BITS = {EV_KEY: tuple(BTN_CODES.values()), EV_REL: (REL_X, REL_Y, REL_WHEEL, REL_HWHEEL)}
+
+    def move(self, dx: int, dy: int) -> None:
+        if dx:
+            self._event(EV_REL, REL_X, dx)
+        if dy:
+            self._event(EV_REL, REL_Y, dy)
+
+    def scroll(self, vertical: int, horizontal: int) -> None:
+        if vertical:
+            self._event(EV_REL, REL_WHEEL, vertical)
+        if horizontal:
+            self._event(EV_REL, REL_HWHEEL, horizontal)
+
+    def press(self, button: str) -> None:
+        self._event(EV_KEY, BTN_CODES[button], 1)
+
+    def release(self, button: str) -> None:
+        self._event(EV_KEY, BTN_CODES[button], 0)
+
+
+MOUSE_OUTPUTS = {
+    "mouse": MouseModuleOutput,
+    "uinput": UinputMouse,
+}
+
+
+class MouseEngine:
+    """Velocities of the held buttons and paddles, turned into mouse motion on a fixed loop timer
+
+    Button and paddle changes only update velocities; one timer (loop.call_at) runs every
+    1 / tick_rate seconds while anything moves, and stops when nothing does. Motion and
+    clicks reach the output on the injection thread, after the keys queued before them.
+    """
+
+    def __init__(self, injector: Any, output: MouseOutput, clock: Any = None, tick_rate: float = TICK_RATE):
+        self.injector = injector
+        self.output = output
+        # Anything with time() and call_at(), normally the running event loop
+        self.clock = clock
+        self.period = 1 / tick_rate
+        self.table: Optional[MouseTable] = None
+        self.mask = 0
+        # Bits of the held buttons that move or scroll, and when each was pressed
+        self._held = 0
+        self._since = [0.0] * 32
+        # Mouse buttons held by clicks
+        self._clicked: List[str] = []
+        # Pointer x and y, wheel vertical and horizontal velocity of each paddle
+        self._analog: List[Tuple[float, float, float, float]] = []
+        # Fractions of a pixel or notch left over from the last tick
+        self._rest = [0.0, 0.0, 0.0, 0.0]
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tick_at = 0.0
+        self._last_tick = 0.0
+        # Events for the injection thread, delivered by a method bound once
+        self._events: Deque[Tuple[str, Any, Any]] = collections.deque()
+        self._deliver_bound = self._deliver
+        # Ticks run, and the pixels and notches moved since the start
+        self.ticks = 0
+        self.moved = [0, 0, 0, 0]
+
+    def start(self) -> None:
+        """Tick on the running loop (must be called from the event loop)"""
+        self.clock = asyncio.get_running_loop()
+
+    def set_table(self, table: Optional[MouseTable]) -> None:
+        """Use the mouse actions of another key mapping, releasing whatever the current one holds"""
+        self.release_all()
+        self.table = table
+        self.mask = table.mask if table is not None else 0
+
+    @property
+    def ticking(self) -> bool:
+        return self._timer is not None
+
+    def update(self, pressed: int, previous: int) -> None:
+        """Apply the button changes of one notification"""
+        changed = (pressed ^ previous) & self.mask
+        actions = self.table.actions
+        clicked = False
+        edges = changed & pressed
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            bit = low.bit_length() - 1
+            action = actions[bit]
+            if action.kind == CLICK:
+                self._events.append(("press", action.button, None))
+                self._clicked.append(action.button)
+                clicked = True
+            elif self.clock is not None:
+                self._held |= low
+                self._since[bit] = self.clock.time()
+        edges = changed & previous
+        while edges:
+            low = edges & -edges
+            edges ^= low
+            action = actions[low.bit_length() - 1]
+            if action.kind == CLICK:
+                if action.button in self._clicked:
+                    self._events.append(("release", action.button, None))
+                    self._clicked.remove(action.button)
+                    clicked = True
+            else:
+                self._held &= ~low
+        if clicked:
+            self.injector.call(self._deliver_bound)
+        if self._held and self._timer is None:
+            self._start_ticking()
+
+    def set_analog(self, velocities: Sequence[Tuple[float, float, float, float]]) -> None:
+        """Velocities from the paddles, one (x, y, wheel, horizontal wheel) per paddle"""
+        self._analog = list(velocities)
+        if self.clock is not None and self._timer is None and any(any(velocity) for velocity in self._analog):
+            self._start_ticking()
+
+    def release_all(self) -> None:
+        """Release the clicks and stop the motion of every button (paddles keep theirs)"""
+        self._held = 0
+        if self._clicked:
+            for button in reversed(self._clicked):
+                self._events.append(("release", button, None))
+            self._clicked.clear()
+            self.injector.call(self._deliver_bound)
+
+    def _start_ticking(self) -> None:
+        now = self.clock.time()
+        self._last_tick = now
+        self._tick_at = now + self.period
+        self._timer = self.clock.call_at(self._tick_at, self._tick)
+
+    def _tick(self) -> None:
+        now = self.clock.time()
+        elapsed = min(now - self._last_tick, MAX_TICK_TIME)
+        self._last_tick = now
+        velocity = [0.0, 0.0, 0.0, 0.0]
+
+        held = self._held
+        actions = self.table.actions if held else ()
+        while held:
+            low = held & -held
+            held ^= low
+            bit = low.bit_length() - 1
+            action = actions[bit]
+            ramp = min((now - self._since[bit]) / ACCELERATION_TIME, 1.0)
+            speed = action.speed * (1 + action.acceleration * ramp * ramp)
+            offset = 0 if action.kind == MOVE else 2
+            velocity[offset] += action.x * speed
+            velocity[offset + 1] += action.y * speed
+        moving = self._held != 0
+        for analog in self._analog:
+            for axis in range(4):
+                if analog[axis]:
+                    velocity[axis] += analog[axis]
+                    moving = True
+
+        if not moving:
+            self._timer = None
+            self._rest = [0.0, 0.0, 0.0, 0.0]
+            return
+
+        rest = self._rest
+        steps = [0, 0, 0, 0]
+        for axis in range(4):
+            amount = rest[axis] + velocity[axis] * elapsed
+            # Whole pixels or notches go out, the fraction waits for the next tick
+            steps[axis] = int(amount)
+            rest[axis] = amount - steps[axis]
+            self.moved[axis] += steps[axis]
+        if steps[0] or steps[1]:
+            self._events.append(("move", steps[0], steps[1]))
+        if steps[2] or steps[3]:
+            self._events.append(("scroll", steps[2], steps[3]))
+        if steps != [0, 0, 0, 0]:
+            self.injector.call(self._deliver_bound)
+        self.ticks += 1
+
+        # A fixed rate: ticks missed by a late loop are skipped, not run in a burst
+        self._tick_at += self.period
+        if self._tick_at <= now:
+            self._tick_at = now + self.period
+        self._timer = self.clock.call_at(self._tick_at, self._tick)
+
+    def _deliver(self) -> None:
+        output = self.output
+        events = self._events
+        while events:
+            kind, a, b = events.popleft()
+            if kind == "move":
+                output.move(a, b)
+            elif kind == "scroll":
+                output.scroll(a, b)
+            elif kind == "press":
+                output.press(a)
+            else:
+                output.release(a)
+        output.flush()
+
+    def close(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self.output.close()
+
+
+class PaddleMouse(AnalogChannel):
+    """Paddles moving the pointer or scrolling, at up to their action's top speed at full travel"""
+
+    def __init__(self, engine: MouseEngine, actions: Dict[int, MouseAction], deadzone: float = DEFAULT_DEADZONE,
+                 curve: float = DEFAULT_CURVE):
+        super().__init__(tuple(actions), deadzone, curve)
+        self.engine = engine
+        self.actions = tuple(actions.values())
+
+    def set_actions(self, actions: Dict[int, MouseAction]) -> None:
+        """Use the actions of another key mapping, at once for paddles held off center"""
+        self.set_locations(tuple(actions))
+        self.actions = tuple(actions.values())
+        self.emit()
+
+    def emit(self) -> None:
+        velocities = []
+        for action, position in zip(self.actions, self.positions):
+            speed = action.speed * (1 + action.acceleration) * position / AXIS_MAX
+            velocity = [0.0, 0.0, 0.0, 0.0]
+            offset = 0 if action.kind == MOVE else 2
+            velocity[offset] = action.x * speed
+            velocity[offset + 1] = action.y * speed
+            velocities.append(tuple(velocity))
+        self.engine.set_analog(velocities)
@@ -0,0 +1,142 @@
+"""Record raw Zwift Ride notifications to a binary log and play them back without the hardware
+
+A log starts with LOG_MAGIC and is followed by one record per notification:
+a little-endian header (monotonic timestamp in ns, device ID, characteristic index,
+payload length) and the raw payload bytes. Records are only ever appended.
+
+Usage:
+    python replay.py ride.zrl              # play back at recorded speed
+    python replay.py ride.zrl --speed 10   # ten times faster
+    python replay.py ride.zrl --speed 0    # as fast as possible
+"""
+import argparse
+import asyncio
+import logging
+import struct
+import time
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
+
+from app import (
+    LEFT_DEVICE_ID,
+    MEASUREMENT_CHAR_UUID,
+    RESPONSE_CHAR_UUID,
+    ZwiftRideController,
+    logger,
+    setup_logging,
+)
+from key_output import RecordingKeyOutput
+
+LOG_MAGIC = b"ZRNL\x02"
+RECORD_HEADER = struct.Struct("<qBBH")
+
+# Characteristics are stored by index to keep records small
+CHARACTERISTICS = (MEASUREMENT_CHAR_UUID, RESPONSE_CHAR_UUID)
+
+
+class NotificationRecorder:
+    """Append every notification to a binary log"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file: BinaryIO = open(path, "ab")
+        if self._file.tell() == 0:
+            self._file.write(LOG_MAGIC)
+
+    def wrap(self, char_uuid: str, handler: Callable[[int, bytearray], None],
+             device_id: int = LEFT_DEVICE_ID) -> Callable[[int, bytearray], None]:
+        """Return a notification handler that records before calling handler"""
+        index = CHARACTERISTICS.index(char_uuid)
+        pack = RECORD_HEADER.pack
+        write = self._file.write
+
+        def recording_handler(sender: int, data: bytearray) -> None:
+            write(pack(time.monotonic_ns(), device_id, index, len(data)))
+            write(data)
+            handler(sender, data)
+
+        return recording_handler
+
+    def close(self) -> None:
+        self._file.close()
+        logger.info(f"Recorded notifications to {self.path}")
+
+
+def read_log(path: str) -> Iterator[Tuple[int, int, str, bytearray]]:
+    """Yield (timestamp_ns, device ID, characteristic UUID, data) for every record in a log"""
+    with open(path, "rb") as f:
+        if f.read(len(LOG_MAGIC)) != LOG_MAGIC:
+            raise ValueError(f"{path} is not a notification log")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                # A truncated tail is left by an interrupted recording
+                return
+            timestamp, device_id, index, length = RECORD_HEADER.unpack(header)
+            data = f.read(length)
+            if len(data) < length:
+                return
+            yield timestamp, device_id, CHARACTERISTICS[index], bytearray(data)
+
+
+async def play(path: str, controller: ZwiftRideController, speed: Optional[float] = 1.0) -> int:
+    """Feed a log to controller, at speed times the recorded rate or as fast as possible if speed is falsy
+
+    Returns the number of notifications played.
+    """
+    loop = asyncio.get_running_loop()
+    first_timestamp = None
+    start = loop.time()
+    count = 0
+
+    for timestamp, device_id, char_uuid, data in read_log(path):
+        if first_timestamp is None:
+            first_timestamp = timestamp
+        if speed:
+            delay = start + (timestamp - first_timestamp) / 1e9 / speed - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        elif count % 256 == 0:
+            # Let scheduled key repeats run even at full speed
+            await asyncio.sleep(0)
+        if char_uuid == MEASUREMENT_CHAR_UUID:
+            controller.notification_handler(0, data, device_id)
+        else:
+            controller.response_handler(0, data)
+        count += 1
+
+    return count
+
+
+async def main(path: str, speed: float, mapping_file: str, latency: bool) -> None:
+    output = RecordingKeyOutput()
+    controller = ZwiftRideController(key_output=output)
+    controller.load_key_mapping(mapping_file)
+    if latency:
+        controller.enable_latency()
+    controller.injector.start()
+    controller.start_timers()
+    start = time.perf_counter()
+    try:
+        count = await play(path, controller, speed)
+    finally:
+        controller.injector.stop()
+    elapsed = time.perf_counter() - start
+    logger.info(f"Played {count} notifications in {elapsed:.3f}s, {len(output.events)} key events")
+    if controller.latency:
+        print(controller.latency.report())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Play a recorded Zwift Ride notification log")
+    parser.add_argument("log", help="log written with app.py --record")
+    parser.add_argument("--speed", type=float, default=1.0, help="playback speed, 0 for as fast as possible")
+    parser.add_argument("--mapping", default="key_mapping.json", help="key mapping file")
+    parser.add_argument("--quiet", action="store_true", help="only log warnings and errors")
+    parser.add_argument("--latency", action="store_true", help="print per-stage latency after playback")
+    args = parser.parse_args()
+
+    log_listener = setup_logging(logging.WARNING if args.quiet else logging.INFO)
+    try:
+        asyncio.run(main(args.log, args.speed, args.mapping, args.latency))
+    finally:
+        log_listener.stop()
@@ -0,0 +1,328 @@
+"""In-process simulated Zwift Ride, for running the controller without the hardware
+
+SimulatedRide plays one or both units. Its scanner_class and client_class stand in for
+BleakScanner and BleakClient:
+
+    ride = SimulatedRide(button_rate=1000)
+    ride.install(controller)
+    await controller.reconnect()
+
+The units advertise like the real ones (manufacturer 2378, device ID 8 or 9) until
+connected, answer the RideOn handshake on the control characteristic and then stream
+0x23 button frames with analog KeyGroups, 0x19 status updates and 0x15 idle frames at
+the configured rates. Like on real hardware, notifications only reach characteristics
+that have been subscribed to.
+"""
+import asyncio
+import functools
+import random
+from types import SimpleNamespace
+from typing import Callable, Dict, List, Optional, Tuple
+
+from bleak.exc import BleakError
+
+from app import (
+    ALL_BUTTONS_MASK,
+    CONTROL_CHAR_UUID,
+    CUSTOM_SERVICE_UUID,
+    LEFT_DEVICE_ID,
+    MANUFACTURER_ID,
+    MEASUREMENT_CHAR_UUID,
+    PADDLE_LOCATIONS,
+    RESPONSE_CHAR_UUID,
+    RIDE_NAME,
+    RIGHT_DEVICE_ID,
+    ZwiftRideController,
+)
+
+# GATT handles the simulated units report for their characteristics
+HANDLES = {MEASUREMENT_CHAR_UUID: 11, CONTROL_CHAR_UUID: 14, RESPONSE_CHAR_UUID: 17}
+
+# Streams are serviced at most this often; faster rates send several frames per tick
+MIN_TICK = 0.001
+MAX_TICK = 0.05
+
+INITIAL_STATUS_FRAME = bytes([0x2a, 0x08, 0x03, 0x12, 0x0d, 0x22, 0x0b])
+IDLE_FRAME = bytes([0x15])
+
+
+def encode_varint(value: int) -> bytes:
+    """Protobuf varint encoding of a non-negative int"""
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7f) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def encode_key_group(location: int, value: int) -> bytes:
+    """KeyGroup (field 3) holding a KeyPress with location and ZigZag encoded sint32 value"""
+    key_press = b"\x08" + encode_varint(location) + b"\x10" + encode_varint(((value << 1) ^ (value >> 31)) & 0xFFFFFFFF)
+    return b"\x1a" + encode_varint(len(key_press)) + key_press
+
+
+def button_frame(pressed: int, analog: Optional[Dict[int, int]] = None) -> bytearray:
+    """0x23 frame for the pressed mask (in BUTTON_MASKS bits) followed by one KeyGroup per analog location"""
+    # 0 means pressed in the protocol. The bits outside ALL_BUTTONS_MASK are the varint
+    # continuation bits of the button map, which stay set
+    button_map = 0xFFFFFFFF & ~(pressed & ALL_BUTTONS_MASK)
+    frame = bytearray([0x23, 0x08]) + button_map.to_bytes(4, "little") + b"\x0f"
+    if analog:
+        for location, value in analog.items():
+            frame += encode_key_group(location, value)
+    return frame
+
+
+def status_frame(battery: int) -> bytes:
+    """0x19 status update carrying the battery level"""
+    return bytes([0x19, 0x08]) + encode_varint(battery)
+
+
+class SimulatedUnit:
+    """State of one simulated unit: what it advertises and what its next frames contain
+
+    Set pressed (a mask of BUTTON_MASKS bits) and analog directly, or let the ride's
+    script update them before every button frame.
+    """
+
+    def __init__(self, ride: "SimulatedRide", device_id: int, address: str):
+        self.ride = ride
+        self.device_id = device_id
+        self.address = address
+        self.name = RIDE_NAME
+        self.pressed = 0
+        self.analog: Dict[int, int] = {PADDLE_LOCATIONS.get(device_id, 0): 0} if ride.analog else {}
+        self.battery = 90
+        self.client: Optional["SimulatedClient"] = None
+        # Frames sent per message type, whether or not anyone was subscribed
+        self.sent: Dict[int, int] = {0x23: 0, 0x19: 0, 0x15: 0, 0x2a: 0}
+        self._stream: Optional[asyncio.Task] = None
+
+    @property
+    def connected(self) -> bool:
+        return self.client is not None
+
+    def advertisement(self) -> Tuple[SimpleNamespace, SimpleNamespace]:
+        """(BLEDevice, AdvertisementData) look-alikes for one advertisement"""
+        device = SimpleNamespace(name=self.name, address=self.address)
+        adv = SimpleNamespace(
+            local_name=self.name,
+            rssi=self.ride.rng.randint(-75, -45),
+            manufacturer_data={MANUFACTURER_ID: bytes([self.device_id, 0x02])},
+            service_uuids=[CUSTOM_SERVICE_UUID],
+        )
+        return device, adv
+
+    def start_streaming(self) -> None:
+        if self._stream is None:
+            self._stream = asyncio.ensure_future(self._run_stream())
+
+    def stop_streaming(self) -> None:
+        if self._stream is not None:
+            self._stream.cancel()
+            self._stream = None
+
+    def _notify(self, frame: bytes) -> None:
+        self.sent[frame[0]] += 1
+        client = self.client
+        if client is not None:
+            client.notify(MEASUREMENT_CHAR_UUID, frame)
+
+    async def _run_stream(self) -> None:
+        """Send every frame that is due since the handshake, then sleep until the next one"""
+        ride = self.ride
+        loop = asyncio.get_running_loop()
+        rates = [rate for rate in (ride.button_rate, ride.status_rate, ride.idle_rate) if rate > 0]
+        tick = min(max(1.0 / max(rates), MIN_TICK), MAX_TICK) if rates else MAX_TICK
+        start = loop.time()
+        buttons = status = idle = 0
+        while True:
+            elapsed = loop.time() - start
+            due = int(elapsed * ride.button_rate)
+            while buttons < due:
+                if ride.script is not None:
+                    ride.script(self, buttons)
+                buttons += 1
+                self._notify(button_frame(self.pressed, self.analog))
+            due = int(elapsed * ride.status_rate)
+            while status < due:
+                status += 1
+                self._notify(status_frame(self.battery))
+            due = int(elapsed * ride.idle_rate)
+            while idle < due:
+                idle += 1
+                # Units only report idle while nothing is held
+                if not self.pressed:
+                    self._notify(IDLE_FRAME)
+            await asyncio.sleep(tick)
+
+
+class SimulatedScanner:
+    """Stand-in for BleakScanner that hears the advertisements of the simulated units"""
+
+    def __init__(self, ride: "SimulatedRide", detection_callback: Callable, service_uuids: Optional[List[str]] = None):
+        self.ride = ride
+        self.detection_callback = detection_callback
+        self.service_uuids = service_uuids
+        self._advertiser: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self._advertiser is None:
+            self._advertiser = asyncio.ensure_future(self._advertise())
+
+    async def stop(self) -> None:
+        if self._advertiser is not None:
+            self._advertiser.cancel()
+            self._advertiser = None
+
+    async def _advertise(self) -> None:
+        ride = self.ride
+        # Units don't advertise in lockstep
+        await asyncio.sleep(ride.rng.uniform(0, ride.advertising_interval))
+        while True:
+            for unit in ride.units.values():
+                # A connected unit stops advertising
+                if not unit.connected:
+                    self.detection_callback(*unit.advertisement())
+            # Other BLE devices nearby, dropped by the OS when scanning for the Ride service
+            if not self.service_uuids:
+                for n in range(ride.other_devices):
+                    device = SimpleNamespace(name=None, address=f"AA:00:00:00:{n >> 8:02X}:{n & 0xff:02X}")
+                    adv = SimpleNamespace(local_name=None, rssi=-90, manufacturer_data={0x004C: b"\x10\x05"},
+                                          service_uuids=[])
+                    self.detection_callback(device, adv)
+            await asyncio.sleep(ride.advertising_interval)
+
+
+class SimulatedClient:
+    """Stand-in for BleakClient connecting to a simulated unit by address"""
+
+    mtu_size = 247
+
+    def __init__(self, ride: "SimulatedRide", address_or_device, disconnected_callback: Optional[Callable] = None):
+        self.ride = ride
+        self.address = getattr(address_or_device, "address", address_or_device)
+        self.disconnected_callback = disconnected_callback
+        self.unit: Optional[SimulatedUnit] = None
+        self._characteristics = {
+            uuid: SimpleNamespace(uuid=uuid, handle=handle) for uuid, handle in HANDLES.items()
+        }
+        self._by_handle = {char.handle: char for char in self._characteristics.values()}
+        self._callbacks: Dict[str, Callable] = {}
+        self.services = SimpleNamespace(get_characteristic=self._characteristics.get)
+
+    @property
+    def is_connected(self) -> bool:
+        return self.unit is not None
+
+    def _resolve(self, char) -> SimpleNamespace:
+        if isinstance(char, int):
+            return self._by_handle[char]
+        if isinstance(char, str):
+            return self._characteristics[char]
+        return char
+
+    async def connect(self, **kwargs) -> bool:
+        ride = self.ride
+        await asyncio.sleep(ride.connect_time + ride.rng.uniform(0, ride.connect_jitter))
+        unit = ride.units_by_address.get(self.address)
+        if unit is None:
+            raise BleakError(f"Device with address {self.address} was not found")
+        if unit.connected or ride.rng.random() < ride.connect_failure_rate:
+            raise BleakError(f"Failed to connect to {self.address}")
+        unit.client = self
+        self.unit = unit
+        return True
+
+    async def disconnect(self) -> bool:
+        if self.unit is not None:
+            self._lose_link()
+        return True
+
+    async def write_gatt_char(self, char, data, response: bool = False) -> None:
+        if self.unit is None:
+            raise BleakError("Not connected")
+        if self._resolve(char).uuid == CONTROL_CHAR_UUID and bytes(data) == b"RideOn":
+            self.notify(RESPONSE_CHAR_UUID, b"RideOn")
+            self.unit._notify(INITIAL_STATUS_FRAME)
+            self.unit.start_streaming()
+
+    async def start_notify(self, char, callback: Callable, **kwargs) -> None:
+        if self.unit is None:
+            raise BleakError("Not connected")
+        self._callbacks[self._resolve(char).uuid] = callback
+
+    async def stop_notify(self, char) -> None:
+        self._callbacks.pop(self._resolve(char).uuid, None)
+
+    def notify(self, uuid: str, frame: bytes) -> None:
+        """Deliver a notification, if the characteristic is subscribed to"""
+        callback = self._callbacks.get(uuid)
+        if callback is not None:
+            callback(self._characteristics[uuid], bytearray(frame))
+
+    def _lose_link(self) -> None:
+        unit = self.unit
+        unit.stop_streaming()
+        unit.client = None
+        self.unit = None
+        self._callbacks.clear()
+        if self.disconnected_callback is not None:
+            self.disconnected_callback(self)
+
+
+class SimulatedRide:
+    """One or both units of a simulated Zwift Ride
+
+    Rates are frames per second per unit; 0 disables a stream. script, if given, is
+    called as script(unit, n) before the unit's n-th button frame to update unit.pressed
+    and unit.analog. connect_failure_rate is the share of connection attempts that fail.
+    """
+
+    def __init__(
+        self,
+        device_ids: Tuple[int, ...] = (LEFT_DEVICE_ID, RIGHT_DEVICE_ID),
+        button_rate: float = 50.0,
+        status_rate: float = 1.0,
+        idle_rate: float = 1.0,
+        analog: bool = True,
+        script: Optional[Callable[[SimulatedUnit, int], None]] = None,
+        advertising_interval: float = 0.1,
+        other_devices: int = 0,
+        connect_time: float = 0.02,
+        connect_jitter: float = 0.0,
+        connect_failure_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.button_rate = button_rate
+        self.status_rate = status_rate
+        self.idle_rate = idle_rate
+        self.analog = analog
+        self.script = script
+        self.advertising_interval = advertising_interval
+        self.other_devices = other_devices
+        self.connect_time = connect_time
+        self.connect_jitter = connect_jitter
+        self.connect_failure_rate = connect_failure_rate
+        self.rng = random.Random(seed)
+        self.units: Dict[int, SimulatedUnit] = {
+            device_id: SimulatedUnit(self, device_id, f"F0:0D:00:00:00:{device_id:02X}") for device_id in device_ids
+        }
+        self.units_by_address = {unit.address: unit for unit in self.units.values()}
+        self.scanner_class = functools.partial(SimulatedScanner, self)
+        self.client_class = functools.partial(SimulatedClient, self)
+
+    def install(self, controller: ZwiftRideController) -> None:
+        """Make the controller scan for and connect to the simulated units"""
+        controller.scanner_class = self.scanner_class
+        controller.client_class = self.client_class
+
+    def drop(self, device_id: int) -> None:
+        """Lose the link to a unit, as when it goes out of range"""
+        client = self.units[device_id].client
+        if client is not None:
+            client._lose_link()
+
+    def frames_sent(self) -> int:
+        return sum(sum(unit.sent.values()) for unit in self.units.values())
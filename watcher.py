@@ -0,0 +1,134 @@
+"""Watch a file for changes: inotify on Linux, stat polling elsewhere
+
+inotify watches the file's directory rather than the file, because most editors save by
+writing a new file and renaming it over the old one. Only the events of a finished save
+count (closed after writing, or renamed into place), and its descriptor is read through
+loop.add_reader, so nothing runs until the kernel reports one.
+
+Without inotify the file is stat()ed every POLL_INTERVAL seconds. A change seen that way
+may be a save still in progress, so the callback runs DEBOUNCE seconds later.
+"""
+import asyncio
+import ctypes
+import ctypes.util
+import logging
+import os
+import struct
+import sys
+from typing import Any, Awaitable, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 1.0
+DEBOUNCE = 0.05
+
+# inotify flags and events (sys/inotify.h)
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_TO = 0x080
+WATCHED_EVENTS = IN_CLOSE_WRITE | IN_MOVED_TO
+
+# struct inotify_event: wd, mask, cookie, len, followed by len bytes of name
+INOTIFY_EVENT = struct.Struct("iIII")
+
+
+def open_inotify(directory: str) -> Optional[int]:
+    """inotify descriptor watching directory, or None where inotify isn't available"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or None, use_errno=True)
+        fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, os.fsencode(directory), WATCHED_EVENTS) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def file_signature(path: str) -> Optional[Tuple[int, int, int]]:
+    """What changes when a file is rewritten or replaced, or None if it doesn't exist"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+
+class FileWatcher:
+    """Await on_change() whenever the file at path is written or replaced"""
+
+    def __init__(self, path: str, on_change: Callable[[], Awaitable[Any]], poll_interval: float = POLL_INTERVAL,
+                 debounce: float = DEBOUNCE, use_inotify: bool = True):
+        self.path = os.path.abspath(path)
+        self.on_change = on_change
+        self.poll_interval = poll_interval
+        self.debounce = debounce
+        self.use_inotify = use_inotify
+        # "inotify" or "poll" once running
+        self.backend: Optional[str] = None
+        # Set as soon as the watcher is waiting for changes
+        self.ready = asyncio.Event()
+
+    async def run(self) -> None:
+        """Watch until cancelled"""
+        fd = open_inotify(os.path.dirname(self.path)) if self.use_inotify else None
+        if fd is None:
+            self.backend = "poll"
+            await self._poll()
+        else:
+            self.backend = "inotify"
+            try:
+                await self._watch(fd)
+            finally:
+                os.close(fd)
+
+    async def _watch(self, fd: int) -> None:
+        loop = asyncio.get_running_loop()
+        name = os.fsencode(os.path.basename(self.path))
+        changed = asyncio.Event()
+
+        def read_events() -> None:
+            try:
+                data = os.read(fd, 4096)
+            except BlockingIOError:
+                return
+            offset = 0
+            while offset < len(data):
+                _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                offset += INOTIFY_EVENT.size
+                if data[offset:offset + length].rstrip(b"\0") == name:
+                    changed.set()
+                offset += length
+
+        loop.add_reader(fd, read_events)
+        try:
+            self.ready.set()
+            while True:
+                await changed.wait()
+                # Events that come in while the callback runs make for one more call
+                changed.clear()
+                await self._changed()
+        finally:
+            loop.remove_reader(fd)
+
+    async def _poll(self) -> None:
+        signature = file_signature(self.path)
+        self.ready.set()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            if file_signature(self.path) != signature:
+                await asyncio.sleep(self.debounce)
+                signature = file_signature(self.path)
+                if signature is not None:
+                    await self._changed()
+
+    async def _changed(self) -> None:
+        try:
+            await self.on_change()
+        except Exception as e:
+            logger.error(f"Error handling a change of {self.path}: {e}")